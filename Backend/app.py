@@ -1,23 +1,192 @@
 # app.py
 import os
-import tempfile
-import time
+import re
+import math
 import uuid
+import gzip
 import json
-from flask import Flask, request, send_file, jsonify
-import cv2
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from redis import Redis
 import rq
 from rq.job import Job
-from utils.tasks import process_image 
+from rq.exceptions import NoSuchJobError
+from utils import config, result_cache, progress, batch_jobs, metrics, lanes
+from utils.artifacts import get_store
+from utils.redis_client import get_redis
+from utils.results import read_result, queue_read, parse_result, result_key
+from utils.jobs import LANES, PROCESS_IMAGE, PROCESS_REGION, RENDER_MODES, input_key, predictions_key, parse_bounds
+from utils.model_registry import model_checksum
+from utils.image_header import read_image_header, reduction_factor, ALLOWED_FORMATS
 
 app = Flask(__name__)
+# Request bodies: one image plus form fields; /detect_rooftops_batch raises its own limit
+FORM_OVERHEAD_BYTES = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES
 CORS(app)
 
-# Initialize Redis and RQ
-redis_conn = Redis(host='localhost', port=6379, db=0)
-queue = rq.Queue('rooftop_detection', connection=redis_conn)
+# Initialize Redis and RQ. Jobs are enqueued by name: the detection code (OpenCV,
+# NumPy, ultralytics/torch) is only ever imported by the workers, and by the
+# on-demand rendering and re-scoring routes when they are first used.
+redis_conn = get_redis()
+# /job_events subscriptions are long-lived and get their own connection pool
+pubsub_conn = get_redis(pubsub=True)
+queues = {lane: rq.Queue(name, connection=redis_conn) for lane, name in LANES.items()}
+
+
+def current_model_checksum():
+    try:
+        return model_checksum(config.INFERENCE_MODEL_PATH)
+    except OSError:
+        return 'unavailable'
+
+
+def existing_job_response(job_id):
+    """Response for an upload that matches an earlier job, or None if that job cannot be reused"""
+    result = read_result(redis_conn, job_id, ('status',))
+    if result:
+        if result.get('status') != 'completed':
+            return None
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in (result_key(job_id), predictions_key(job_id), progress.stage_key(job_id),
+                    progress.rooftops_key(job_id)):
+            pipe.expire(key, config.RESULT_TTL)
+        pipe.execute()
+        return jsonify({
+            'status': 'completed',
+            'job_id': job_id,
+            'cached': True,
+            'message': f'Identical analysis found. Results are available at /job_status/{job_id}'
+        }), 200
+    
+    try:
+        job = Job.fetch(job_id, connection=redis_conn)
+    except NoSuchJobError:
+        # Claimed but not enqueued yet: the owner announces 'queued' as soon as it
+        # claims the digest, and 'error' if it gives up
+        event = progress.latest_event(redis_conn, job_id)
+        if event is None or event.get('stage') == 'error':
+            return None
+    else:
+        if job.is_failed:
+            return None
+    return jsonify({
+        'status': 'processing',
+        'job_id': job_id,
+        'deduplicated': True,
+        'message': f'An identical image is already being processed. Check status at /job_status/{job_id}'
+    }), 202
+
+
+def admission_error(lane):
+    """
+    429 response (with Retry-After) when the estimated wait in ``lane`` is over its
+    limit, or None when a new job may be queued.
+    """
+    limit = config.LANE_MAX_WAIT.get(lane, 0)
+    if not limit:
+        return None
+    wait = lanes.estimated_wait(redis_conn, lane, queues)
+    if wait <= limit:
+        return None
+    retry_after = math.ceil(wait - limit)
+    print(f"Rejecting {lane} job: estimated wait {wait:.0f}s exceeds {limit:.0f}s")
+    response = jsonify({
+        'error': 'Server busy',
+        'details': f'The {lane} queue is full; estimated wait {wait:.0f} s. Retry in {retry_after} s.',
+        'lane': lane,
+        'estimated_wait_seconds': round(wait, 1),
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+
+def artifact_response(key, mimetype, max_age, content_encoding=None):
+    """
+    Stream an artifact with validators (ETag, Last-Modified) and byte-range support.
+
+    Clients may cache it privately for ``max_age`` seconds, the time the job's result
+    has left in Redis; a matching ``If-None-Match`` gets ``304``, a single ``Range`` gets ``206``.
+    """
+    store = get_store()
+    info = store.stat(key)
+    size = info['size']
+    
+    etag = info['etag'].strip('"')
+    response = Response(mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = info['modified']
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = f"private, max-age={max_age}"
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+    
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    
+    start, end = 0, size
+    byte_range = request.range
+    if byte_range is not None and request.if_range.etag in (None, etag):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f"bytes */{size}"
+            return response
+        start, end = bounds
+        response.status_code = 206
+        response.headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+    
+    response.response = store.stream(key, start, end)
+    response.content_length = end - start
+    return response
+
+
+def parse_options(form):
+    """Read the analysis options shared by single and batch uploads; returns (render, tiled, error)"""
+    render = form.get('render', 'lazy').strip().lower()
+    if render not in RENDER_MODES:
+        return None, None, (jsonify({
+            'error': 'Invalid render mode',
+            'details': f'render must be one of: {", ".join(RENDER_MODES)}'
+        }), 400)
+    
+    tiled = form.get('tiled')
+    tiled = config.TILED_INFERENCE if tiled is None else tiled.strip().lower() in ('1', 'true', 'yes', 'on')
+    return render, tiled, None
+
+
+def validate_image(image_bytes):
+    """
+    Validate an upload from its header only; the worker does the one and only full decode.
+    
+    Returns:
+        tuple: (header, None) for a usable image, otherwise (None, (error payload, HTTP status))
+    """
+    if len(image_bytes) > config.MAX_UPLOAD_BYTES:
+        return None, ({
+            'error': 'Image too large',
+            'details': f'The file exceeds the limit of {config.MAX_UPLOAD_BYTES} bytes'
+        }, 413)
+    
+    header = read_image_header(image_bytes)
+    if header is None or header[0] not in ALLOWED_FORMATS:
+        return None, ({
+            'error': 'Invalid image file',
+            'details': 'The uploaded file could not be read as an image'
+        }, 400)
+    
+    image_format, width, height = header
+    if width * height > config.MAX_IMAGE_PIXELS and (
+            config.OVERSIZE_POLICY == 'reject'
+            or reduction_factor(width, height, config.MAX_IMAGE_PIXELS) is None):
+        return None, ({
+            'error': 'Image too large',
+            'details': f'{width}x{height} exceeds the limit of {config.MAX_IMAGE_PIXELS} pixels'
+        }, 413)
+    
+    return header, None
 
 
 @app.route('/detect_rooftops', methods=['POST'])
@@ -46,45 +215,93 @@ def detect_rooftops():
             'details': 'Filename is empty. Make sure you selected a valid image file'
         }), 400
     
+    render, tiled, error = parse_options(request.form)
+    if error:
+        return error
+    
+    # Optional georeference of the image, for rooftop outlines in longitude/latitude
+    try:
+        bounds = parse_bounds(request.form.get('bounds'))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid bounds', 'details': str(e)}), 400
+    
     try:
-        # Create a directory for temporary files if it doesn't exist
-        os.makedirs("temp", exist_ok=True)
-        
         # Generate unique job ID
         job_id = str(uuid.uuid4())
         
-        # Save uploaded file with job ID in the filename
-        temp_image_path = os.path.join("temp", f"{job_id}_{uploaded_file.filename}")
-        uploaded_file.save(temp_image_path)
-        print(f"Saved file to {temp_image_path}")
+        # Validate from the header only; the worker does the one and only full decode
+        image_bytes = uploaded_file.read()
+        header, error = validate_image(image_bytes)
+        if error:
+            return jsonify(error[0]), error[1]
         
-        # Test if file is a valid image
-        test_image = cv2.imread(temp_image_path)
-        if test_image is None:
-            return jsonify({
-                'error': 'Invalid image file',
-                'details': 'The uploaded file could not be read as an image'
-            }), 400
+        image_format, width, height = header
+        print(f"Image validated, format: {image_format}, size: {width}x{height}")
+        lane = lanes.choose_lane(width * height, tiled)
+        
+        # Reuse an earlier or in-flight job for the same image, model and parameters
+        digest = None
+        if config.RESULT_CACHE_ENABLED:
+            params = {'render': render, 'tiled': tiled, 'conf_threshold': config.CONF_THRESHOLD,
+                      'base_conf_threshold': config.BASE_CONF_THRESHOLD, 'preprocess': config.PREPROCESS_MODE,
+                      'bounds': bounds}
+            if tiled:
+                params.update(tile_size=config.TILE_SIZE, tile_overlap=config.TILE_OVERLAP,
+                              tile_iou_threshold=config.TILE_IOU_THRESHOLD)
+            digest = result_cache.cache_key(image_bytes, current_model_checksum(), params)
+            
+            for _ in range(2):
+                owner = result_cache.claim(redis_conn, digest, job_id, config.RESULT_TTL,
+                                           config.RESULT_CACHE_MAX_ENTRIES)
+                if owner == job_id:
+                    # Announced right away, so duplicates of this upload wait for it
+                    progress.publish_stage(redis_conn, job_id, 'queued', config.RESULT_TTL)
+                    break
+                response = existing_job_response(owner)
+                if response is not None:
+                    result_cache.touch(redis_conn, digest, config.RESULT_TTL, config.RESULT_CACHE_MAX_ENTRIES)
+                    print(f"Cache hit for job {owner}")
+                    return response
+                # The earlier job failed; take over the entry
+                result_cache.release(redis_conn, digest, owner)
+        
+        # Cached results are always served; new work is only queued while the lane keeps up
+        rejection = admission_error(lane)
+        if rejection:
+            if digest:
+                # Duplicates that joined this claim see it fail too
+                progress.publish_stage(redis_conn, job_id, 'error', config.RESULT_TTL, error='Queue is full')
+                result_cache.release(redis_conn, digest, job_id)
+            return rejection
         
-        print(f"Image validated, size: {test_image.shape}")
+        # Hand the bytes to the worker through Redis
+        image_key = input_key(job_id)
+        redis_conn.setex(image_key, config.RESULT_TTL, image_bytes)
         
-        # Queue the job
+        # Queue the job (announced first, so a fast worker's updates are never overwritten)
+        if not digest:
+            progress.publish_stage(redis_conn, job_id, 'queued', config.RESULT_TTL)
         try:
-            job = queue.enqueue(
-                process_image, 
-                args=(temp_image_path, job_id),
+            queues[lane].enqueue(
+                PROCESS_IMAGE,
+                args=(image_key, job_id, render, tiled, uploaded_file.filename, None, bounds),
                 job_id=job_id,
-                result_ttl=3600  # Keep job result for 1 hour
+                result_ttl=config.RESULT_TTL  # Keep job result for 1 hour by default
             )
-            print(f"Job enqueued with ID: {job_id}")
+            print(f"Job enqueued with ID: {job_id} ({lane} lane)")
             
             return jsonify({
                 'status': 'processing',
                 'job_id': job_id,
+                'lane': lane,
                 'message': 'Your image is being processed. Check status at /job_status/{job_id}'
             }), 202
         except Exception as job_error:
             print(f"Error enqueueing job: {str(job_error)}")
+            redis_conn.delete(image_key)
+            progress.publish_stage(redis_conn, job_id, 'error', config.RESULT_TTL, error=str(job_error))
+            if digest:
+                result_cache.release(redis_conn, digest, job_id)
             return jsonify({
                 'error': 'Job queue error',
                 'details': str(job_error)
@@ -99,40 +316,234 @@ def detect_rooftops():
             'details': str(e)
         }), 500
 
+@app.route('/detect_rooftops_batch', methods=['POST'])
+def detect_rooftops_batch():
+    """
+    Analyse many images at once: several files under "images" and/or zip archives
+    under "archive". Each image becomes its own job; the batch keeps a running total.
+    """
+    # Batches may be much larger than a single upload; must be set before the body is parsed
+    request.max_content_length = config.BATCH_MAX_UPLOAD_BYTES
+    render, tiled, error = parse_options(request.form)
+    if error:
+        return error
+    
+    # Batches always go to the bulk lane
+    rejection = admission_error('bulk')
+    if rejection:
+        return rejection
+    
+    def read_uploads():
+        # (filename, bytes) for every candidate image, one at a time; None for oversized files
+        for f in request.files.getlist('images'):
+            if f.filename:
+                yield f.filename, f.read(config.MAX_UPLOAD_BYTES + 1)
+        for archive in request.files.getlist('archive'):
+            yield from batch_jobs.read_archive(archive.read(), config.BATCH_MAX_IMAGES, config.MAX_UPLOAD_BYTES)
+    
+    batch_id = str(uuid.uuid4())
+    children, rejected = [], []
+    
+    def discard(response):
+        if children:
+            redis_conn.delete(*[input_key(job_id) for job_id, _ in children])
+        return response
+    
+    # Each image goes to Redis as soon as it is read and validated, so the request
+    # never holds more than one decompressed image in memory
+    extracted = 0
+    try:
+        for filename, image_bytes in read_uploads():
+            if len(children) + len(rejected) >= config.BATCH_MAX_IMAGES:
+                return discard((jsonify({
+                    'error': 'Too many images',
+                    'details': f'More images sent than the limit of {config.BATCH_MAX_IMAGES}'
+                }), 413))
+            if image_bytes is None:
+                rejected.append({'filename': filename, 'error': 'Image too large'})
+                continue
+            extracted += len(image_bytes)
+            if extracted > config.BATCH_MAX_EXTRACTED_BYTES:
+                return discard((jsonify({
+                    'error': 'Batch too large',
+                    'details': f'The images add up to more than {config.BATCH_MAX_EXTRACTED_BYTES} bytes'
+                }), 413))
+            header, error = validate_image(image_bytes)
+            if error:
+                rejected.append({'filename': filename, 'error': error[0]['error']})
+                continue
+            job_id = str(uuid.uuid4())
+            redis_conn.setex(input_key(job_id), config.RESULT_TTL, image_bytes)
+            children.append((job_id, filename))
+    except ValueError as e:
+        return discard((jsonify({'error': 'Invalid archive', 'details': str(e)}), 400))
+    except Exception as e:
+        print(f"Error storing batch images: {str(e)}")
+        return jsonify({'error': 'Job queue error', 'details': str(e)}), 500
+    
+    if not children and not rejected:
+        return jsonify({
+            'error': 'No images uploaded',
+            'instructions': 'Send image files with key "images" or a zip archive with key "archive"'
+        }), 400
+    if not children:
+        return jsonify({'error': 'No valid images in the upload', 'rejected': rejected}), 400
+    
+    try:
+        batch_jobs.create_batch(redis_conn, batch_id, children, config.BATCH_TTL)
+        for job_id, _ in children:
+            progress.publish_stage(redis_conn, job_id, 'queued', config.RESULT_TTL)
+        
+        # Fan out: one child job per image, all enqueued in a single round-trip
+        queues['bulk'].enqueue_many([
+            rq.Queue.prepare_data(
+                PROCESS_IMAGE,
+                args=(input_key(job_id), job_id, render, tiled, filename, batch_id),
+                job_id=job_id,
+                result_ttl=config.RESULT_TTL
+            ) for job_id, filename in children
+        ])
+        print(f"Batch {batch_id} enqueued with {len(children)} jobs")
+        
+        return jsonify({
+            'status': 'processing',
+            'batch_id': batch_id,
+            'job_ids': [job_id for job_id, _ in children],
+            'rejected': rejected,
+            'message': f'{len(children)} images are being processed. Check progress at /batch_status/{batch_id}'
+        }), 202
+    except Exception as e:
+        print(f"Error enqueueing batch: {str(e)}")
+        return jsonify({
+            'error': 'Job queue error',
+            'details': str(e)
+        }), 500
+
+
+@app.route('/detect_region', methods=['POST'])
+def detect_region():
+    """Analyse every rooftop inside a bounding box of a configured XYZ tile directory or GeoTIFF"""
+    source = request.form.get('source', '').strip()
+    if source not in config.TILE_SOURCES:
+        return jsonify({
+            'error': 'Unknown tile source',
+            'details': f'source must be one of: {", ".join(config.TILE_SOURCES) or "(none configured)"}'
+        }), 400
+    
+    try:
+        bounds = parse_bounds(request.form.get('bounds'))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid bounds', 'details': str(e)}), 400
+    if bounds is None:
+        return jsonify({'error': 'Missing bounds', 'details': 'bounds=west,south,east,north is required'}), 400
+    
+    zoom = request.form.get('zoom')
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= 24:
+            return jsonify({'error': 'zoom must be an integer between 0 and 24'}), 400
+    elif config.TILE_SOURCES[source].startswith('xyz:'):
+        return jsonify({'error': 'Missing zoom', 'details': 'XYZ tile sources need a zoom level'}), 400
+    
+    rejection = admission_error('bulk')
+    if rejection:
+        return rejection
+    
+    job_id = str(uuid.uuid4())
+    progress.publish_stage(redis_conn, job_id, 'queued', config.RESULT_TTL)
+    try:
+        queues['bulk'].enqueue(
+            PROCESS_REGION,
+            args=(job_id, source, bounds, zoom),
+            job_id=job_id,
+            result_ttl=config.RESULT_TTL,
+            job_timeout=config.REGION_JOB_TIMEOUT
+        )
+        print(f"Region job enqueued with ID: {job_id}")
+        return jsonify({
+            'status': 'processing',
+            'job_id': job_id,
+            'message': f'The region is being analysed. Check status at /job_status/{job_id}'
+        }), 202
+    except Exception as e:
+        print(f"Error enqueueing region job: {str(e)}")
+        progress.publish_stage(redis_conn, job_id, 'error', config.RESULT_TTL, error=str(e))
+        return jsonify({
+            'error': 'Job queue error',
+            'details': str(e)
+        }), 500
+
+
+@app.route('/batch_status/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Progress and aggregate totals of a batch, without loading its children's results"""
+    try:
+        include_jobs = request.args.get('include_jobs', '').lower() in ('1', 'true', 'yes')
+        summary = batch_jobs.batch_summary(redis_conn, batch_id, include_jobs)
+        if summary is None:
+            return jsonify({
+                'status': 'not_found',
+                'message': f'No batch found with ID {batch_id}'
+            }), 404
+        return jsonify(summary), 200
+    except Exception as e:
+        return jsonify({
+            'error': 'Error checking batch status',
+            'details': str(e)
+        }), 500
+
+
 # Rest of the app.py code remains the same...
 @app.route('/job_status/<job_id>', methods=['GET'])
 def job_status(job_id):
-    """Check the status of a job"""
+    """
+    Check the status of a job.
+
+    ``?fields=status,total_energy_potential`` returns only those fields of a finished
+    job, which pollers can use to skip the rooftop list.
+    """
+    fields = request.args.get('fields')
+    fields = tuple(name.strip() for name in fields.split(',') if name.strip()) if fields else None
     try:
-        # First check if the result is in Redis
-        result_data = redis_conn.get(f"job_result:{job_id}")
-        if result_data:
-            result = json.loads(result_data)
+        # The result, the RQ job's state and the latest stage, in one round trip
+        pipe = redis_conn.pipeline(transaction=False)
+        queue_read(pipe, job_id, fields)
+        pipe.hmget(Job.key_for(job_id), 'status', 'origin')
+        pipe.get(progress.stage_key(job_id))
+        result_reply, (status, origin), stage = pipe.execute(raise_on_error=False)
+        
+        result = parse_result(result_reply, fields)
+        if result:
             return jsonify(result), 200
         
         # If not in Redis, check job status in queue
-        try:
-            job = Job.fetch(job_id, connection=redis_conn)
-            if job.is_finished:
-                return jsonify({
-                    'status': 'completed',
-                    'message': 'Job completed but results not found. They may have expired.'
-                }), 200
-            elif job.is_failed:
-                return jsonify({
-                    'status': 'failed',
-                    'error': str(job.exc_info)
-                }), 500
-            else:
-                return jsonify({
-                    'status': 'processing',
-                    'position_in_queue': job.get_position()
-                }), 200
-        except:
+        if status is None:
             return jsonify({
                 'status': 'not_found',
                 'message': f'No job found with ID {job_id}'
             }), 404
+        status = status.decode()
+        if status == 'finished':
+            return jsonify({
+                'status': 'completed',
+                'message': 'Job completed but results not found. They may have expired.'
+            }), 200
+        elif status == 'failed':
+            job = Job.fetch(job_id, connection=redis_conn)
+            return jsonify({
+                'status': 'failed',
+                'error': str(job.exc_info)
+            }), 500
+        
+        response = {'status': 'processing', 'position_in_queue': None}
+        if status == 'queued' and origin:
+            response['position_in_queue'] = rq.Queue(origin.decode(), connection=redis_conn).get_job_position(job_id)
+        if stage:
+            response['stage'] = json.loads(stage)['stage']
+        return jsonify(response), 200
             
     except Exception as e:
         return jsonify({
@@ -141,20 +552,172 @@ def job_status(job_id):
         }), 500
 
 
+@app.route('/job_events/<job_id>', methods=['GET'])
+def job_events(job_id):
+    """Stream a job's stage transitions and final result as Server-Sent Events"""
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if progress.latest_event(redis_conn, job_id) is None:
+        result = read_result(redis_conn, job_id)
+        if not result:
+            return jsonify({
+                'status': 'not_found',
+                'message': f'No job found with ID {job_id}'
+            }), 404
+        # The job is over but its stage event has expired: send the final event at once
+        event = progress.result_event(job_id, result)
+        return Response(f"data: {json.dumps(event)}\n\n", mimetype='text/event-stream', headers=headers)
+    
+    return Response(
+        stream_with_context(progress.stream_events(redis_conn, job_id, pubsub_conn=pubsub_conn)),
+        mimetype='text/event-stream',
+        headers=headers
+    )
+
+
+@app.route('/job_rooftops/<job_id>', methods=['GET'])
+def job_rooftops(job_id):
+    """
+    Rooftops of a job as they are measured, with running totals, before the job finishes.
+
+    Poll with ``after`` set to the returned ``cursor`` until ``complete`` is true.
+    """
+    after = request.args.get('after') or None
+    if after is not None and not re.fullmatch(r'\d+-\d+', after):
+        return jsonify({'error': 'Invalid after', 'details': 'after must be a cursor returned by this endpoint'}), 400
+    try:
+        count = int(request.args.get('count', 500))
+    except ValueError:
+        count = 0
+    if not 1 <= count <= 5000:
+        return jsonify({'error': 'count must be an integer between 1 and 5000'}), 400
+    
+    try:
+        page = progress.read_rooftops(redis_conn, job_id, after, count)
+        if page is not None:
+            return jsonify(dict(page, job_id=job_id)), 200
+        
+        # Nothing measured yet, or a job finished before its rooftops were streamed
+        result = read_result(redis_conn, job_id)
+        if result:
+            rooftops = result.get('rooftops', [])
+            return jsonify({
+                'job_id': job_id,
+                'rooftops': rooftops if after is None else [],
+                'totals': {
+                    'rooftops': len(rooftops),
+                    'area_m2': sum(rooftop['area_m2'] for rooftop in rooftops),
+                    'energy_potential_kwh_per_year': result.get('total_energy_potential', 0.0)
+                },
+                'cursor': after,
+                'complete': True,
+                'status': result.get('status')
+            }), 200
+        if progress.latest_event(redis_conn, job_id) is None:
+            return jsonify({
+                'status': 'not_found',
+                'message': f'No job found with ID {job_id}'
+            }), 404
+        return jsonify({
+            'job_id': job_id,
+            'rooftops': [],
+            'totals': {},
+            'cursor': after,
+            'complete': False,
+            'status': 'processing'
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Re-scoring parameters: (default, lowest, highest); bounds are exclusive below, inclusive above
+RESCORE_PARAMETERS = {
+    'panel_efficiency': (0.20, 0.0, 1.0),
+    'solar_radiation': (1445, 0.0, 10000.0),
+    'performance_ratio': (0.75, 0.0, 1.0),
+    'conf_threshold': (config.CONF_THRESHOLD, 0.0, 1.0),
+    'gsd': (None, 0.0, 100.0),
+}
+
+
+@app.route('/rescore/<job_id>', methods=['GET'])
+def rescore(job_id):
+    """
+    Recompute areas, energy and the report of a finished job for other economic
+    parameters or a higher confidence threshold, from its stored predictions
+    """
+    params = {}
+    for name, (default, low, high) in RESCORE_PARAMETERS.items():
+        value = request.args.get(name)
+        if value is None:
+            params[name] = default
+            continue
+        try:
+            params[name] = float(value)
+        except ValueError:
+            params[name] = None
+        if params[name] is None or not low < params[name] <= high:
+            return jsonify({
+                'error': f'Invalid {name}',
+                'details': f'{name} must be a number greater than {low} and at most {high}'
+            }), 400
+    
+    from utils.detect import analyze_predictions, format_report, scale_rooftops
+    
+    try:
+        predictions = redis_conn.get(predictions_key(job_id))
+        if not predictions:
+            return jsonify({'error': 'Job not found or predictions expired'}), 404
+        predictions = json.loads(predictions)
+        
+        try:
+            analysis, _ = analyze_predictions(predictions, **params)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid conf_threshold', 'details': str(e)}), 400
+        
+        analysis['rooftops'] = scale_rooftops(analysis['rooftops'], predictions.get('scale', 1))
+        analysis.update(
+            job_id=job_id,
+            conf_threshold=params['conf_threshold'],
+            report=format_report(analysis, predictions['image_name'] or job_id),
+            status='completed'
+        )
+        return jsonify(analysis), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/get_result_image/<job_id>', methods=['GET'])
 def get_result_image(job_id):
+    from utils.render import OUTPUT_FORMATS, normalize_format, ensure_rendered
+    
+    fmt = normalize_format(request.args.get('format'))
+    if fmt is None:
+        return jsonify({
+            'error': 'Unsupported format',
+            'details': f'format must be one of: {", ".join(OUTPUT_FORMATS)}'
+        }), 400
+    
+    quality = request.args.get('quality')
+    if quality is not None:
+        try:
+            quality = int(quality)
+        except ValueError:
+            quality = 0
+        if not 1 <= quality <= 100:
+            return jsonify({'error': 'quality must be an integer between 1 and 100'}), 400
+    
     try:
-        # Check if job result exists
-        result_data = redis_conn.get(f"job_result:{job_id}")
-        if not result_data:
+        # Check if job result exists; the rooftops are only read if the image must be drawn
+        result, ttl = read_result(redis_conn, job_id, ('status', 'render', 'artifacts'), with_ttl=True)
+        if not result:
             return jsonify({'error': 'Job not found or results expired'}), 404
             
-        # Get image path from job result
-        result = json.loads(result_data)
-        if 'image_path' not in result or result.get('status') != 'completed':
+        if result.get('status') != 'completed' or result.get('render') == 'none':
             return jsonify({'error': 'Result image not available'}), 404
-            
-        return send_file(result['image_path'], mimetype='image/png')
+        
+        # Rendered on the first request, then served from the artifact store
+        key = ensure_rendered(job_id, result, fmt, quality, load_result=lambda: read_result(redis_conn, job_id))
+        return artifact_response(key, OUTPUT_FORMATS[fmt][1], ttl)
     except FileNotFoundError:
         return jsonify({'error': 'Result image file not found'}), 404
     except Exception as e:
@@ -165,24 +728,66 @@ def get_result_image(job_id):
 def get_report(job_id):
     try:
         # Check if job result exists
-        result_data = redis_conn.get(f"job_result:{job_id}")
-        if not result_data:
+        result, ttl = read_result(redis_conn, job_id, ('status', 'artifacts'), with_ttl=True)
+        if not result:
             return jsonify({'error': 'Job not found or results expired'}), 404
             
-        # Get report path from job result
-        result = json.loads(result_data)
-        if 'report_path' not in result or result.get('status') != 'completed':
+        # Get the report's artifact key from the job result
+        if 'report' not in result.get('artifacts', {}) or result.get('status') != 'completed':
             return jsonify({'error': 'Report not available'}), 404
             
-        return send_file(result['report_path'], mimetype='text/plain')
+        return artifact_response(result['artifacts']['report'], 'text/plain', ttl)
     except FileNotFoundError:
         return jsonify({'error': 'Report file not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/get_geometry/<job_id>', methods=['GET'])
+def get_geometry(job_id):
+    """Rooftop outlines as a GeoJSON FeatureCollection, gzip-compressed for clients that accept it"""
+    try:
+        result, ttl = read_result(redis_conn, job_id, ('status', 'artifacts'), with_ttl=True)
+        if not result:
+            return jsonify({'error': 'Job not found or results expired'}), 404
+        
+        if 'geometry' not in result.get('artifacts', {}) or result.get('status') != 'completed':
+            return jsonify({'error': 'Geometry not available'}), 404
+        
+        key = result['artifacts']['geometry']
+        # Stored compressed; only clients that cannot take gzip pay for decompression
+        if 'gzip' in request.accept_encodings:
+            return artifact_response(key, 'application/geo+json', ttl, content_encoding='gzip')
+        response = Response(gzip.decompress(get_store().get(key)), mimetype='application/geo+json')
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    except FileNotFoundError:
+        return jsonify({'error': 'Geometry file not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Job counters, queue depth and per-stage latency histograms in Prometheus text format"""
+    try:
+        gauges = {
+            'geopv_queue_depth': ('Jobs waiting in each lane',
+                                  {f'lane="{lane}"': queue.count for lane, queue in queues.items()}),
+            'geopv_jobs_in_progress': ('Jobs currently being processed by a worker',
+                                       {f'lane="{lane}"': queue.started_job_registry.count
+                                        for lane, queue in queues.items()}),
+            'geopv_estimated_wait_seconds': ('Estimated wait for a new job in each lane',
+                                             {f'lane="{lane}"': lanes.estimated_wait(redis_conn, lane, queues)
+                                              for lane in queues}),
+        }
+        return Response(metrics.render_metrics(redis_conn, gauges),
+                        mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 if __name__ == '__main__':
     # Create required directories
-    os.makedirs("temp", exist_ok=True)
     os.makedirs("results", exist_ok=True)
     app.run(debug=True)
\ No newline at end of file
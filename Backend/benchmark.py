@@ -0,0 +1,494 @@
+import os
+import sys
+import json
+import time
+import uuid
+import types
+import argparse
+import contextlib
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import cv2
+from utils import config
+from utils.detect import (decode_image, prepare_image, run_inference, run_tiled_inference, analyze_detections,
+                          format_report, detect_rooftops_with_solar_potential, model_input_size)
+from utils.image_processing import resize_to_input
+from utils.render import render_result
+
+# Queue used by the load test, kept apart from the production queue
+BENCHMARK_QUEUE = 'rooftop_detection_benchmark'
+# Redis database the load test runs in, so its results, metrics and locks never mix with
+# the service's; it must be empty and is flushed afterwards
+BENCHMARK_REDIS_DB = 15
+DEFAULT_SIZES = '640x640,1280x720,1920x1080,4096x4096'
+DEFAULT_ROOFTOPS = '10,50'
+# Modules the API process must never import; they belong to the workers
+HEAVY_MODULES = ('torch', 'ultralytics', 'cv2', 'numpy', 'matplotlib', 'onnxruntime')
+
+# Run in a fresh interpreter: import time, resident memory and heavy modules of the API process
+_API_STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+rss = 0
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:')) / 1024
+except (OSError, StopIteration):
+    pass
+print(json.dumps({'seconds': seconds, 'rss_mb': rss, 'modules': sorted(sys.modules)}))
+"""
+
+
+def synthetic_scene(width, height, rooftops, seed=0):
+    """
+    Aerial-looking BGR test image: textured ground with ``rooftops`` bright,
+    rotated rectangular roofs, one per grid cell so they never touch.
+    """
+    rng = np.random.RandomState(seed)
+    image = rng.randint(40, 110, (height, width, 3)).astype(np.uint8)
+    image = cv2.GaussianBlur(image, (0, 0), 2)
+
+    cols = int(np.ceil(np.sqrt(rooftops * width / height))) if rooftops else 1
+    rows = int(np.ceil(rooftops / cols)) if rooftops else 1
+    cell_w, cell_h = width / cols, height / rows
+    for index in range(rooftops):
+        row, col = divmod(index, cols)
+        cx, cy = (col + 0.5) * cell_w, (row + 0.5) * cell_h
+        w = cell_w * rng.uniform(0.35, 0.7)
+        h = cell_h * rng.uniform(0.35, 0.7)
+        box = cv2.boxPoints(((cx, cy), (w, h), rng.uniform(-20, 20))).astype(np.int32)
+        color = [int(c) for c in rng.randint(170, 250, 3)]
+        cv2.fillPoly(image, [box], color)
+    return image
+
+
+class StubModel:
+    """
+    Deterministic stand-in for the YOLO segmentation model.
+
+    Bright regions of the input are returned as instance masks at the resolution
+    ultralytics would use, so everything downstream of the model runs for real.
+    """
+
+    def __init__(self, imgsz=640, min_area=16):
+        self.overrides = {'imgsz': imgsz}
+        self.min_area = min_area
+
+    def _predict(self, image, imgsz, retina_masks):
+        height, width = image.shape[:2]
+        if not retina_masks:
+            scale = imgsz / max(height, width)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats((gray > 150).astype(np.uint8), connectivity=4)
+        keep = [i for i in range(1, count) if stats[i, cv2.CC_STAT_AREA] >= self.min_area]
+
+        if not keep:
+            return types.SimpleNamespace(masks=None, boxes=None)
+        masks = np.stack([(labels == i).astype(np.float32) for i in keep])
+        areas = stats[keep, cv2.CC_STAT_AREA].astype(np.float32)
+        confidences = 0.55 + 0.4 * areas / areas.max()
+        return types.SimpleNamespace(masks=types.SimpleNamespace(data=masks),
+                                     boxes=types.SimpleNamespace(conf=confidences))
+
+    def __call__(self, images, conf=0.25, imgsz=None, retina_masks=False, **kwargs):
+        images = images if isinstance(images, list) else [images]
+        return [self._predict(image, imgsz or self.overrides['imgsz'], retina_masks) for image in images]
+
+
+def load_model(model_path, stub=False):
+    """The real checkpoint when available (unless ``stub``), otherwise the stub model"""
+    if not stub and model_path and os.path.exists(model_path):
+        from utils.model_registry import get_model, model_checksum
+        backend = 'onnx' if model_path.endswith('.onnx') else 'torch'
+        return get_model(model_path, warmup=True, threads=config.ONNX_THREADS), {
+            'type': backend, 'path': model_path, 'sha256': model_checksum(model_path)}
+    return StubModel(), {'type': 'stub'}
+
+
+def _reset_peak_rss():
+    # Linux can reset the high-water mark, so each stage reports its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process since the last reset, in MiB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(samples, images=1):
+    """Latency percentiles (milliseconds) and throughput (images/second) of timing samples"""
+    samples = np.asarray(samples)
+    return {
+        'samples': len(samples),
+        'mean_ms': float(samples.mean() * 1000),
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p90_ms': float(np.percentile(samples, 90) * 1000),
+        'p99_ms': float(np.percentile(samples, 99) * 1000),
+        'min_ms': float(samples.min() * 1000),
+        'max_ms': float(samples.max() * 1000),
+        'throughput_per_s': float(images * len(samples) / samples.sum()) if samples.sum() else None,
+    }
+
+
+def measure(func, repeats, warmup=1):
+    """Time ``func`` ``repeats`` times after ``warmup`` untimed calls; returns (stats, last result)"""
+    for _ in range(warmup):
+        result = func()
+    _reset_peak_rss()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    stats = summarize(samples)
+    stats['peak_rss_mb'] = peak_rss_mb()
+    return stats, result
+
+
+def benchmark_case(model, width, height, rooftops, repeats, warmup, seed, tiled, workdir):
+    """Time every pipeline stage and the whole pipeline on one synthetic image"""
+    image = synthetic_scene(width, height, rooftops, seed)
+    name = f"synthetic_{width}x{height}_{rooftops}.jpg"
+    image_path = os.path.join(workdir, name)
+    cv2.imwrite(image_path, image, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    with open(image_path, 'rb') as f:
+        data = f.read()
+
+    stages = {}
+    stages['decode'], (decoded, _) = measure(lambda: decode_image(data, config.MAX_IMAGE_PIXELS), repeats, warmup)
+    stages['preprocess'], processed = measure(lambda: prepare_image(decoded), repeats, warmup)
+    if tiled:
+        stages['inference'], result = measure(
+            lambda: run_tiled_inference(model, decoded, 0.5, tile_size=config.TILE_SIZE or None,
+                                        overlap=config.TILE_OVERLAP, batch_size=config.TILE_BATCH_SIZE,
+                                        iou_threshold=config.TILE_IOU_THRESHOLD),
+            repeats, warmup)
+    else:
+        stages['inference'], result = measure(lambda: run_inference(model, [processed], 0.5)[0], repeats, warmup)
+    stages['postprocess'], (analysis, labels) = measure(lambda: analyze_detections(result, decoded, name),
+                                                        repeats, warmup)
+    stages['render'], _ = measure(lambda: render_result(decoded, labels, analysis, 0.7), repeats, warmup)
+    stages['report'], _ = measure(lambda: format_report(analysis, name), repeats, warmup)
+
+    output_dir = os.path.join(workdir, 'end_to_end')
+    end_to_end, _ = measure(lambda: detect_rooftops_with_solar_potential(image_path, None, model=model, tiled=tiled,
+                                                                         output_dir=output_dir),
+                            repeats, warmup)
+    return {
+        'width': width,
+        'height': height,
+        'rooftops': rooftops,
+        'detected': len(analysis['rooftops']),
+        'encoded_bytes': len(data),
+        'stages': stages,
+        'end_to_end': end_to_end,
+    }
+
+
+def compare_preprocessing(model, width, height, rooftops, repeats, warmup, seed):
+    """
+    Time and accuracy of sharpening at model input resolution ('input' mode) against
+    sharpening the full image ('full' mode, the reference).
+
+    The 'full' timing includes the shrink to the input size the model performs
+    afterwards, so both cover the same work. Accuracy compares the analyses of the
+    two model outputs: rooftop counts, total area and energy, and the IoU of the
+    covered pixels.
+    """
+    image = synthetic_scene(width, height, rooftops, seed)
+    size = model_input_size(model)
+    timings = {
+        'full': measure(lambda: resize_to_input(prepare_image(image), size).copy(), repeats, warmup)[0],
+        'input': measure(lambda: prepare_image(image, size), repeats, warmup)[0],
+    }
+
+    analyses, coverage = {}, {}
+    for mode, input_size in (('full', None), ('input', size)):
+        result = run_inference(model, [prepare_image(image, input_size)], 0.5)[0]
+        analyses[mode], labels = analyze_detections(result, image, 'synthetic')
+        coverage[mode] = labels > 0
+    reference, candidate = analyses['full'], analyses['input']
+    if coverage['full'].shape == coverage['input'].shape:
+        union = np.count_nonzero(coverage['full'] | coverage['input'])
+        iou = np.count_nonzero(coverage['full'] & coverage['input']) / union if union else 1.0
+    else:
+        iou = None
+
+    def relative(key):
+        a, b = reference[key], candidate[key]
+        return abs(b - a) / abs(a) if a else float(a != b)
+
+    return {
+        'width': width,
+        'height': height,
+        'rooftops': rooftops,
+        'speedup': timings['full']['mean_ms'] / timings['input']['mean_ms'],
+        'timings': timings,
+        'rooftops_full': len(reference['rooftops']),
+        'rooftops_input': len(candidate['rooftops']),
+        'coverage_difference': relative('total_coverage_percentage'),
+        'energy_difference': relative('total_energy_potential'),
+        'coverage_iou': iou,
+    }
+
+
+def _redis_db_url(url, db):
+    """``url`` pointing at database ``db`` of the same server"""
+    from urllib.parse import urlsplit, urlunsplit
+    return urlunsplit(urlsplit(url)._replace(path=f'/{db}'))
+
+
+def _load_test_worker(queue_name, redis_url, workdir, stub, model_path, ready, start):
+    """Burst RQ worker for the load test; loads everything, waits for ``start``, exits once the queue is empty"""
+    os.chdir(workdir)
+    sys.stdout = sys.stderr
+    # Before utils.tasks creates its client
+    config.REDIS_URL = redis_url
+    from rq import SimpleWorker, Queue
+    from utils import tasks
+
+    if stub:
+        model = StubModel()
+        tasks.get_model = lambda path, **kwargs: model
+    else:
+        tasks.get_model(model_path, threads=config.ONNX_THREADS)
+
+    connection = tasks.redis_conn
+    worker = SimpleWorker([Queue(queue_name, connection=connection)], connection=connection)
+    ready.put(os.getpid())
+    start.wait()
+    worker.work(burst=True, logging_level='WARNING')
+
+
+def load_test(jobs, workers, sizes, rooftops, seed, stub, model_path, render, workdir, db=BENCHMARK_REDIS_DB):
+    """
+    Push ``jobs`` uploads through Redis and RQ to ``workers`` local worker processes
+    and measure queueing, service time and throughput as a client would see them.
+
+    Everything runs in Redis database ``db``, which is flushed afterwards.
+    """
+    import redis
+    from utils.redis_client import get_redis
+
+    redis_url = _redis_db_url(config.REDIS_URL, db)
+    connection = get_redis(redis_url)
+    try:
+        if connection.dbsize():
+            return {'skipped': f'Redis database {db} is not empty; choose an unused one with --rq-db'}
+    except redis.exceptions.ConnectionError as e:
+        return {'skipped': f'Redis is not reachable: {e}'}
+
+    try:
+        return _run_load_test(connection, redis_url, jobs, workers, sizes, rooftops, seed, stub, model_path,
+                              render, workdir)
+    finally:
+        # Results, metrics, rooftop streams, locks and RQ bookkeeping of the run
+        connection.flushdb()
+
+
+def _run_load_test(connection, redis_url, jobs, workers, sizes, rooftops, seed, stub, model_path, render,
+                   workdir):
+    from rq import Queue
+    from rq.job import Job
+    from utils.tasks import process_image, input_key
+    from utils.results import read_result
+
+    uploads = []
+    for index, (width, height) in enumerate(sizes):
+        ok, encoded = cv2.imencode('.jpg', synthetic_scene(width, height, rooftops[0], seed + index))
+        uploads.append((f"synthetic_{width}x{height}.jpg", encoded.tobytes()))
+
+    queue = Queue(BENCHMARK_QUEUE, connection=connection)
+    job_ids = [str(uuid.uuid4()) for _ in range(jobs)]
+
+    pipe = connection.pipeline()
+    for index, job_id in enumerate(job_ids):
+        pipe.setex(input_key(job_id), config.RESULT_TTL, uploads[index % len(uploads)][1])
+    pipe.execute()
+
+    # Workers start up (imports, model load) before the clock starts
+    context = multiprocessing.get_context('spawn')
+    ready, start = context.Queue(), context.Event()
+    processes = [context.Process(target=_load_test_worker,
+                                 args=(BENCHMARK_QUEUE, redis_url, workdir, stub, model_path, ready, start))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+
+    started = time.time()
+    queue.enqueue_many([
+        Queue.prepare_data(process_image,
+                           args=(input_key(job_id), job_id, render, False, uploads[index % len(uploads)][0]),
+                           job_id=job_id, result_ttl=config.RESULT_TTL)
+        for index, job_id in enumerate(job_ids)
+    ])
+    start.set()
+    for process in processes:
+        process.join()
+    elapsed = time.time() - started
+
+    waits, services, latencies, failed = [], [], [], 0
+    stage_samples = {}
+    for job_id in job_ids:
+        job = Job.fetch(job_id, connection=connection)
+        result = read_result(connection, job_id, ('status', 'timings')) or {'status': 'missing'}
+        if result.get('status') != 'completed' or not job.ended_at:
+            failed += 1
+            continue
+        waits.append((job.started_at - job.enqueued_at).total_seconds())
+        services.append((job.ended_at - job.started_at).total_seconds())
+        latencies.append((job.ended_at - job.enqueued_at).total_seconds())
+        for stage, seconds in result.get('timings', {}).items():
+            stage_samples.setdefault(stage, []).append(seconds)
+
+    return {
+        'jobs': jobs,
+        'workers': workers,
+        'render': render,
+        'failed': failed,
+        'wall_time_s': elapsed,
+        'throughput_per_s': (jobs - failed) / elapsed if elapsed else None,
+        'queue_wait': summarize(waits) if waits else None,
+        'service_time': summarize(services) if services else None,
+        'end_to_end': summarize(latencies) if latencies else None,
+        'stages': {stage: summarize(samples) for stage, samples in stage_samples.items()},
+    }
+
+
+def api_startup(runs=3):
+    """
+    Import time and resident memory of a fresh API process (``import app``), and which
+    heavy modules, if any, it loaded. Redis is not contacted.
+    """
+    samples, rss, heavy = [], [], set()
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', _API_STARTUP_PROBE],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        probe = json.loads(output.decode().strip().splitlines()[-1])
+        samples.append(probe['seconds'])
+        rss.append(probe['rss_mb'])
+        heavy.update(name for name in probe['modules'] if name.split('.')[0] in HEAVY_MODULES)
+    stats = summarize(samples)
+    stats['rss_mb'] = max(rss)
+    stats['heavy_modules'] = sorted({name.split('.')[0] for name in heavy})
+    return stats
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in size.lower().split('x')) for size in text.split(',') if size]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GeoPV detection pipeline benchmark')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='Comma-separated WIDTHxHEIGHT image sizes')
+    parser.add_argument('--rooftops', default=DEFAULT_ROOFTOPS,
+                        help='Comma-separated rooftop counts per image')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per stage')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs before each stage')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic images')
+    parser.add_argument('--model', default=config.INFERENCE_MODEL_PATH,
+                        help='YOLO checkpoint or ONNX export to benchmark; the stub model is used if it does not exist')
+    parser.add_argument('--stub', action='store_true', help='Always use the deterministic stub model')
+    parser.add_argument('--tiled', action='store_true', help='Benchmark tiled inference')
+    parser.add_argument('--compare-preprocess', action='store_true',
+                        help="Compare sharpening at model input resolution with the full-resolution path")
+    parser.add_argument('--rq-jobs', type=int, default=0,
+                        help='Jobs for the RQ load test against the local Redis (0 skips it)')
+    parser.add_argument('--rq-workers', type=int, default=2, help='Worker processes for the load test')
+    parser.add_argument('--rq-render', default='lazy', choices=('lazy', 'eager', 'none'),
+                        help='Render mode of the load test jobs')
+    parser.add_argument('--rq-db', type=int, default=BENCHMARK_REDIS_DB,
+                        help='Empty Redis database for the load test; it is flushed afterwards')
+    parser.add_argument('--api-startup', action='store_true',
+                        help='Only check the API process start-up; fails if it imports any inference module')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    if args.api_startup:
+        startup = api_startup()
+        print(json.dumps(startup, indent=2))
+        sys.exit(1 if startup['heavy_modules'] else 0)
+
+    sizes = parse_sizes(args.sizes)
+    rooftop_counts = [int(count) for count in args.rooftops.split(',') if count]
+    model, model_info = load_model(args.model, args.stub)
+    stub = model_info['type'] == 'stub'
+    model_path = os.path.abspath(args.model) if args.model else None
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'model': model_info,
+            'tiled': args.tiled,
+            'repeats': args.repeats,
+            'warmup': args.warmup,
+            'seed': args.seed,
+        },
+        'api_startup': api_startup(),
+        'cases': [],
+    }
+
+    # The pipeline prints progress; keep stdout for the JSON
+    with tempfile.TemporaryDirectory(prefix='geopv-bench-') as workdir, contextlib.redirect_stdout(sys.stderr):
+        for width, height in sizes:
+            for rooftops in rooftop_counts:
+                print(f"Benchmarking {width}x{height} with {rooftops} rooftops", file=sys.stderr)
+                report['cases'].append(benchmark_case(model, width, height, rooftops, args.repeats, args.warmup,
+                                                      args.seed, args.tiled, workdir))
+
+        if args.compare_preprocess:
+            report['preprocessing'] = [
+                compare_preprocessing(model, width, height, rooftops, args.repeats, args.warmup, args.seed)
+                for width, height in sizes for rooftops in rooftop_counts
+            ]
+
+        if args.rq_jobs:
+            print(f"Load testing {args.rq_jobs} jobs on {args.rq_workers} workers", file=sys.stderr)
+            report['rq_load_test'] = load_test(args.rq_jobs, args.rq_workers, sizes, rooftop_counts, args.seed,
+                                               stub, model_path, args.rq_render, workdir, args.rq_db)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import argparse
+from utils import config
+from utils.image_header import EXTENSIONS
+
+IMAGE_EXTENSIONS = tuple(set(EXTENSIONS.values()) | {'.jpeg', '.tiff'})
+
+
+def image_files(directory, limit=None):
+    """Sorted image paths in ``directory``, at most ``limit`` of them"""
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    return paths[:limit] if limit else paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the rooftop model to ONNX for CPU inference')
+    parser.add_argument('--model', default=config.MODEL_PATH, help='YOLO weights to export')
+    parser.add_argument('--output', default=config.ONNX_MODEL_PATH,
+                        help='Where to write the model the onnx backend will load')
+    parser.add_argument('--imgsz', type=int, default=config.MODEL_WARMUP_SIZE, help='Model input size')
+    parser.add_argument('--int8', action='store_true',
+                        help='Quantize to INT8; the FP32 export is kept next to the output as *.fp32.onnx')
+    parser.add_argument('--calibration', help='Directory of sample screenshots for INT8 calibration')
+    parser.add_argument('--calibration-count', type=int, default=200,
+                        help='Largest number of calibration images to use')
+    parser.add_argument('--parity', help='Directory of sample images to compare against the PyTorch model')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='Largest relative difference in rooftop area and energy the parity check accepts')
+    args = parser.parse_args()
+
+    from utils.onnx_backend import export_onnx, quantize_int8, OnnxSegmentationModel
+    from utils.detect import prepare_image, compare_backends
+
+    if args.int8:
+        if not args.calibration:
+            parser.error('--int8 needs --calibration')
+        fp32_path = os.path.splitext(args.output)[0] + '.fp32.onnx'
+        export_onnx(args.model, fp32_path, args.imgsz)
+        # Calibrate on inputs preprocessed exactly as in production
+        quantize_int8(fp32_path, image_files(args.calibration, args.calibration_count), args.output,
+                      args.imgsz, preprocess=prepare_image)
+        print(f"INT8 model written to {args.output} (FP32 export at {fp32_path})")
+    else:
+        export_onnx(args.model, args.output, args.imgsz)
+        print(f"ONNX model written to {args.output}")
+
+    if args.parity:
+        from ultralytics import YOLO
+        report = compare_backends(YOLO(args.model), OnnxSegmentationModel(args.output),
+                                  image_files(args.parity), tolerance=args.tolerance)
+        print(json.dumps(report, indent=2))
+        print(f"Parity {'passed' if report['passed'] else 'FAILED'}: area within "
+              f"{report['max_area_difference']:.2%}, energy within {report['max_energy_difference']:.2%} "
+              f"(tolerance {args.tolerance:.2%})")
+        sys.exit(0 if report['passed'] else 1)
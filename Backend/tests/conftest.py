@@ -0,0 +1,39 @@
+import pytest
+
+
+@pytest.fixture
+def redis_conn():
+    fakeredis = pytest.importorskip('fakeredis')
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def api(redis_conn, monkeypatch, tmp_path):
+    """The Flask app module on a fake Redis, with local artifacts under ``tmp_path``"""
+    import rq
+    import app as api
+    from utils import artifacts
+    from utils.jobs import LANES
+
+    monkeypatch.setattr(api, 'redis_conn', redis_conn)
+    monkeypatch.setattr(api, 'queues', {lane: rq.Queue(name, connection=redis_conn) for lane, name in LANES.items()})
+    monkeypatch.setattr(artifacts, '_store', artifacts.LocalArtifactStore(str(tmp_path / 'results')))
+    return api
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+
+@pytest.fixture
+def worker_conn(api, monkeypatch):
+    """Worker modules on the API's fake Redis, with the stub model in place of the checkpoint"""
+    from benchmark import StubModel
+    from utils import batching, tasks
+
+    monkeypatch.setattr(tasks, 'redis_conn', api.redis_conn)
+    monkeypatch.setattr(batching, 'redis_conn', api.redis_conn)
+    monkeypatch.setattr(tasks, 'get_model', lambda *args, **kwargs: StubModel())
+    monkeypatch.setattr(batching, 'get_model', lambda *args, **kwargs: StubModel())
+    return api.redis_conn
@@ -0,0 +1,81 @@
+import os
+import uuid
+import pytest
+from utils.artifacts import LocalArtifactStore, collect_garbage, get_store
+from utils.results import result_key
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def artifact(api):
+    get_store().put('job-1/result.png', DATA, 'image/png')
+    return api
+
+
+def _get(api, headers=None):
+    with api.app.test_request_context(headers=headers or {}):
+        response = api.artifact_response('job-1/result.png', 'image/png', 60)
+        response.direct_passthrough = False
+        return response
+
+
+def test_full_artifact_with_validators(artifact):
+    response = _get(artifact)
+
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Cache-Control'] == 'private, max-age=60'
+
+
+def test_matching_etag_is_not_modified(artifact):
+    etag = _get(artifact).headers['ETag']
+
+    response = _get(artifact, {'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    assert _get(artifact, {'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_byte_range(artifact):
+    response = _get(artifact, {'Range': 'bytes=10-19'})
+
+    assert response.status_code == 206
+    assert response.get_data() == DATA[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(DATA)}'
+    assert response.headers['Content-Length'] == '10'
+
+
+def test_suffix_range_and_stale_if_range(artifact):
+    assert _get(artifact, {'Range': 'bytes=-5'}).get_data() == DATA[-5:]
+
+    stale = _get(artifact, {'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.get_data() == DATA
+
+
+def test_unsatisfiable_range(artifact):
+    response = _get(artifact, {'Range': f'bytes={len(DATA)}-'})
+
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_garbage_collection_only_touches_job_artifacts(tmp_path, redis_conn):
+    expired, live = str(uuid.uuid4()), str(uuid.uuid4())
+    store = LocalArtifactStore(str(tmp_path))
+    store.put(f'{expired}/report.txt', b'old')
+    store.put(f'{live}/report.txt', b'current')
+    (tmp_path / f'{expired}_report.txt').write_bytes(b'old, flat')
+    (tmp_path / 'static').mkdir()
+    (tmp_path / 'static' / 'logo.png').write_bytes(b'png')
+    (tmp_path / 'notes_2024.txt').write_bytes(b'notes')
+    redis_conn.set(result_key(live), 'result')
+
+    assert set(store.jobs()) == {expired, live}
+    assert collect_garbage(store, redis_conn, grace=0) == 1
+    assert sorted(os.listdir(tmp_path)) == sorted([live, 'static', 'notes_2024.txt'])
@@ -0,0 +1,83 @@
+import time
+import cv2
+import pytest
+import rq
+from rq.job import JobStatus
+from benchmark import synthetic_scene
+from utils import batching, tasks
+from utils.jobs import PROCESS_IMAGE
+
+
+def _store_image(redis_conn, key, seed):
+    redis_conn.set(key, cv2.imencode('.png', synthetic_scene(640, 480, 3, seed=seed))[1].tobytes())
+
+
+def test_batch_returns_what_process_image_returns(worker_conn):
+    _store_image(worker_conn, 'image:a', 0)
+    _store_image(worker_conn, 'image:b', 1)
+    worker_conn.set('image:bad', b'not an image')
+
+    responses = batching.process_image_batch([('image:a', 'a'), ('image:bad', 'bad'), ('image:b', 'b')])
+
+    assert responses['bad']['status'] == 'error'
+    for job_id, image_key in (('a', 'image:a'), ('b', 'image:b')):
+        _store_image(worker_conn, image_key, ord(job_id) - ord('a'))
+        single = tasks.process_image(image_key, job_id + '-single')
+        assert responses[job_id]['status'] == single['status'] == 'completed'
+        assert responses[job_id]['rooftops'] == single['rooftops']
+
+
+def test_model_load_failure_is_an_error_response_per_job(worker_conn, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError('weights missing')
+    monkeypatch.setattr(batching, 'get_model', broken)
+    _store_image(worker_conn, 'image:a', 0)
+
+    responses = batching.process_image_batch([('image:a', 'a')])
+    assert responses == {'a': {'status': 'error', 'error': 'weights missing'}}
+
+
+def test_jobs_end_with_rq_bookkeeping(worker_conn):
+    queue = rq.Queue('rooftop_detection', connection=worker_conn)
+    worker = rq.SimpleWorker([queue], connection=worker_conn)
+    done = queue.enqueue(PROCESS_IMAGE, 'image:a', 'a')
+    failed = queue.enqueue(PROCESS_IMAGE, 'image:b', 'b')
+
+    for job, outcome in ((done, {'return_value': {'status': 'error', 'error': 'bad'}}),
+                         (failed, {'exc_string': 'Traceback: boom'})):
+        execution = batching.start_job(worker, job)
+        assert job.get_status(refresh=True) == JobStatus.STARTED
+        batching.end_job(worker, job, execution, **outcome)
+
+    assert done.get_status(refresh=True) == JobStatus.FINISHED
+    assert done.return_value() == {'status': 'error', 'error': 'bad'}
+    assert done.id in queue.finished_job_registry
+    assert failed.get_status(refresh=True) == JobStatus.FAILED
+    assert failed.id in queue.failed_job_registry
+    assert 'boom' in failed.latest_result().exc_string
+
+
+
+def test_jobs_are_charged_their_share_of_the_batched_call(worker_conn, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(tasks.metrics, 'record_job',
+                        lambda conn, timings, rooftops=None, failed=False, lane=None:
+                        recorded.append((timings.get('inference'), failed, lane)))
+    run_inference = batching.run_inference
+
+    def slow_inference(*args, **kwargs):
+        time.sleep(0.2)
+        return run_inference(*args, **kwargs)
+    monkeypatch.setattr(batching, 'run_inference', slow_inference)
+    _store_image(worker_conn, 'image:a', 0)
+    _store_image(worker_conn, 'image:b', 1)
+    worker_conn.set('image:bad', b'not an image')
+
+    batching.process_image_batch([('image:a', 'a'), ('image:b', 'b'), ('image:bad', 'bad')],
+                                 ['interactive', 'bulk', 'bulk'])
+
+    recorded.sort(key=lambda record: (record[1], record[2]))
+    assert [(failed, lane) for _, failed, lane in recorded] == [(False, 'bulk'), (False, 'interactive'),
+                                                                (True, 'bulk')]
+    assert recorded[0][0] == recorded[1][0]
+    assert 0.1 <= recorded[0][0] < 0.2
@@ -0,0 +1,26 @@
+import io
+import numpy as np
+from PIL import Image
+from utils.detect import decode_image
+
+
+def _jpeg(width, height, orientation=None):
+    image = Image.fromarray(np.full((height, width, 3), 128, dtype=np.uint8))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def test_exif_rotated_jpeg_is_not_reported_as_shrunk():
+    image, scale = decode_image(_jpeg(400, 300, orientation=6))
+    assert image.shape[:2] == (400, 300)
+    assert scale == 1.0
+
+
+def test_exif_rotated_jpeg_scale_matches_reduction():
+    image, scale = decode_image(_jpeg(400, 300, orientation=6), max_pixels=400 * 300 // 4)
+    assert image.shape[:2] == (200, 150)
+    assert scale == 2.0
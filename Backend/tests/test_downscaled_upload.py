@@ -0,0 +1,54 @@
+import gzip
+import json
+import cv2
+import numpy as np
+import pytest
+from benchmark import synthetic_scene
+from utils import config, tasks
+from utils.artifacts import get_store
+from utils.progress import read_rooftops
+from utils.render import ensure_rendered
+
+
+@pytest.fixture
+def downscaled_job(worker_conn, monkeypatch):
+    # Decoded at half size on each side
+    monkeypatch.setattr(config, 'MAX_IMAGE_PIXELS', 1280 * 960 // 3)
+    worker_conn.set('image:big', cv2.imencode('.png', synthetic_scene(1280, 960, 6))[1].tobytes())
+    return tasks.process_image('image:big', 'big')
+
+
+def _extent(feature):
+    geometry = feature['geometry']
+    polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+    points = np.array([point for polygon in polygons for ring in polygon for point in ring])
+    return points.min(axis=0), points.max(axis=0)
+
+
+def test_positions_are_in_uploaded_pixels(client, downscaled_job):
+    assert downscaled_job['scale'] == 2
+    geometry = json.loads(gzip.decompress(get_store().get(downscaled_job['artifacts']['geometry'])))
+    assert geometry['properties']['width'] == 1280
+
+    features = {feature['id']: feature for feature in geometry['features']}
+    for rooftop in downscaled_job['rooftops']:
+        x0, y0, x1, y1 = rooftop['bbox']
+        low, high = _extent(features[rooftop['id']])
+        assert low == pytest.approx([x0, y0], abs=4)
+        assert high == pytest.approx([x1, y1], abs=4)
+        assert x0 < rooftop['centroid'][0] < x1 and y0 < rooftop['centroid'][1] < y1
+
+
+def test_streamed_and_rescored_positions_match_the_result(client, worker_conn, downscaled_job):
+    def positions(rooftops):
+        return [(r['centroid'], r['bbox']) for r in rooftops]
+
+    streamed = read_rooftops(worker_conn, 'big')['rooftops']
+    assert positions(streamed) == positions(downscaled_job['rooftops'])
+    assert positions(client.get('/rescore/big').json['rooftops']) == positions(downscaled_job['rooftops'])
+
+
+def test_lazy_render_draws_on_the_decoded_image(worker_conn, downscaled_job):
+    key = ensure_rendered('big', downscaled_job)
+    image = cv2.imdecode(np.frombuffer(get_store().get(key), np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[0] == 480
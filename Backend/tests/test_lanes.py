@@ -0,0 +1,75 @@
+import io
+import types
+import numpy as np
+import cv2
+from utils import config, lanes, metrics
+from utils.jobs import LANES
+
+
+def _queues(*lanes_):
+    return [types.SimpleNamespace(name=LANES[lane]) for lane in lanes_]
+
+
+def _drain(scheduler, picks):
+    served = []
+    for _ in range(picks):
+        lane = next(lane for lane in LANES if LANES[lane] == scheduler.order(_queues('interactive', 'bulk'))[0].name)
+        scheduler.served(lane)
+        served.append(lane)
+    return served
+
+
+def test_lanes_are_served_in_proportion_to_their_weights():
+    served = _drain(lanes.WeightedScheduler({'interactive': 3, 'bulk': 1}), 12)
+
+    assert served.count('interactive') == 9
+    assert served.count('bulk') == 3
+    # Interleaved, not three of one lane followed by a run of the other
+    assert all('bulk' in served[i:i + 4] for i in range(0, 12, 4))
+
+
+def test_idle_lane_does_not_build_up_credit():
+    scheduler = lanes.WeightedScheduler({'interactive': 3, 'bulk': 1})
+    for _ in range(20):
+        scheduler.served('interactive')
+
+    served = _drain(scheduler, 8)
+    assert served.count('bulk') <= 3
+
+
+def _jobs(queue, count):
+    for _ in range(count):
+        queue.enqueue('utils.tasks.process_image', 'image')
+
+
+def test_estimated_wait_uses_lane_share_and_recent_durations(api, monkeypatch):
+    monkeypatch.setattr(config, 'LANE_WEIGHTS', {'interactive': 3, 'bulk': 1})
+    assert lanes.estimated_wait(api.redis_conn, 'interactive', api.queues) == 0
+
+    _jobs(api.queues['interactive'], 6)
+    api.redis_conn.rpush(metrics.recent_key('interactive'), 2, 4)
+    assert lanes.estimated_wait(api.redis_conn, 'interactive', api.queues) == 18
+
+    _jobs(api.queues['bulk'], 1)
+    assert lanes.estimated_wait(api.redis_conn, 'interactive', api.queues) == 24
+
+
+def _upload(client, shade):
+    image = np.full((64, 64, 3), shade, np.uint8)
+    data = {'image': (io.BytesIO(cv2.imencode('.png', image)[1].tobytes()), 'roof.png')}
+    return client.post('/detect_rooftops', data=data, content_type='multipart/form-data')
+
+
+def test_upload_is_rejected_when_the_lane_is_full(client, api, monkeypatch):
+    monkeypatch.setattr(config, 'LANE_MAX_WAIT', {'interactive': 10, 'bulk': 0})
+    monkeypatch.setattr(config, 'ADMISSION_DEFAULT_JOB_SECONDS', 4)
+
+    _jobs(api.queues['interactive'], 1)
+    assert _upload(client, 0).status_code == 202
+
+    _jobs(api.queues['interactive'], 1)
+    response = _upload(client, 1)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert response.json['lane'] == 'interactive'
+    assert response.json['estimated_wait_seconds'] == 12
@@ -0,0 +1,62 @@
+import json
+import numpy as np
+import pytest
+from benchmark import StubModel, synthetic_scene
+from utils.detect import rle_encode, rle_decode, run_inference, prepare_image, analyze_detections, compact_predictions
+from utils.jobs import predictions_key
+
+
+@pytest.mark.parametrize('mask', [
+    np.zeros((3, 4), dtype=bool),
+    np.ones((3, 4), dtype=bool),
+    np.eye(5, dtype=bool),
+    np.random.RandomState(0).rand(17, 23) > 0.5,
+])
+def test_rle_round_trip(mask):
+    counts = rle_encode(mask)
+    assert sum(counts) == mask.size
+    assert np.array_equal(rle_decode(counts, mask.shape), mask)
+
+
+def test_rle_of_empty_mask():
+    assert rle_encode(np.zeros((0, 5), dtype=bool)) == []
+    assert rle_decode([], (0, 5)).shape == (0, 5)
+
+
+@pytest.fixture
+def stored_job(api):
+    image = synthetic_scene(1280, 720, 8)
+    result = run_inference(StubModel(), [prepare_image(image)])[0]
+    analysis, _ = analyze_detections(result, image, 'scene.png')
+    predictions = compact_predictions(result, 1280, 720, 0.25, 0.12, 'scene.png')
+    api.redis_conn.set(predictions_key('job-1'), json.dumps(predictions))
+    return analysis, predictions
+
+
+def test_rescore_matches_the_stored_analysis(client, stored_job):
+    analysis, _ = stored_job
+    response = client.get('/rescore/job-1?conf_threshold=0.5')
+
+    assert response.status_code == 200
+    rescored = response.json
+    assert rescored['total_coverage_percentage'] == pytest.approx(analysis['total_coverage_percentage'])
+    assert rescored['total_energy_potential'] == pytest.approx(analysis['total_energy_potential'])
+    assert [r['area_m2'] for r in rescored['rooftops']] == pytest.approx([r['area_m2'] for r in analysis['rooftops']])
+
+
+def test_rescore_applies_new_parameters(client, stored_job):
+    analysis, predictions = stored_job
+    threshold = sorted(d['confidence'] for d in predictions['detections'])[3]
+
+    doubled = client.get('/rescore/job-1?conf_threshold=0.5&panel_efficiency=0.4').json
+    assert doubled['total_energy_potential'] == pytest.approx(2 * analysis['total_energy_potential'])
+
+    stricter = client.get(f'/rescore/job-1?conf_threshold={threshold}').json
+    assert len(stricter['rooftops']) == len(analysis['rooftops']) - 4
+
+
+def test_rescore_rejects_bad_parameters(client, stored_job):
+    assert client.get('/rescore/job-1?conf_threshold=0.1').status_code == 400
+    assert client.get('/rescore/job-1?panel_efficiency=abc').status_code == 400
+    assert client.get('/rescore/job-1?solar_radiation=-5').status_code == 400
+    assert client.get('/rescore/missing').status_code == 404
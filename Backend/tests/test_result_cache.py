@@ -0,0 +1,67 @@
+import io
+import itertools
+import types
+import numpy as np
+import cv2
+from utils import result_cache, progress
+
+
+def test_claim_is_taken_once_and_can_be_released(redis_conn):
+    assert result_cache.claim(redis_conn, 'digest', 'job-a', 60, 10) == 'job-a'
+    assert result_cache.claim(redis_conn, 'digest', 'job-b', 60, 10) == 'job-a'
+
+    result_cache.release(redis_conn, 'digest', 'job-b')
+    assert result_cache.claim(redis_conn, 'digest', 'job-b', 60, 10) == 'job-a'
+
+    result_cache.release(redis_conn, 'digest', 'job-a')
+    assert result_cache.claim(redis_conn, 'digest', 'job-b', 60, 10) == 'job-b'
+
+
+def test_least_recently_used_entry_is_evicted(redis_conn, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(result_cache, 'time', types.SimpleNamespace(time=lambda: next(clock)))
+
+    result_cache.claim(redis_conn, 'a', 'job-a', 3600, 2)
+    result_cache.claim(redis_conn, 'b', 'job-b', 3600, 2)
+    result_cache.touch(redis_conn, 'a', 3600, 2)
+    result_cache.claim(redis_conn, 'c', 'job-c', 3600, 2)
+
+    assert redis_conn.get(result_cache.CACHE_PREFIX + 'b') is None
+    assert redis_conn.get(result_cache.CACHE_PREFIX + 'a') == b'job-a'
+    assert redis_conn.get(result_cache.CACHE_PREFIX + 'c') == b'job-c'
+    assert redis_conn.zcard(result_cache.INDEX_KEY) == 2
+
+
+def _upload(client):
+    image = np.random.RandomState(0).randint(0, 255, (120, 160, 3), np.uint8)
+    data = {'image': (io.BytesIO(cv2.imencode('.png', image)[1].tobytes()), 'roof.png')}
+    return client.post('/detect_rooftops', data=data, content_type='multipart/form-data')
+
+
+def test_identical_upload_joins_the_job_in_flight(client):
+    first = _upload(client)
+    second = _upload(client)
+
+    assert first.status_code == 202
+    assert second.status_code == 202
+    assert second.json['deduplicated'] is True
+    assert second.json['job_id'] == first.json['job_id']
+
+
+def test_claimed_job_that_is_not_enqueued_yet_is_joined(client, api, monkeypatch):
+    # The owner has claimed the digest and announced itself, but not enqueued its job yet
+    monkeypatch.setattr(result_cache, 'claim', lambda *args: 'owner')
+    progress.publish_stage(api.redis_conn, 'owner', 'queued', 60)
+
+    response = _upload(client)
+    assert response.status_code == 202
+    assert response.json['job_id'] == 'owner'
+
+
+def test_failed_owner_is_taken_over(client, api, monkeypatch):
+    monkeypatch.setattr(result_cache, 'claim', lambda *args: 'owner')
+    progress.publish_stage(api.redis_conn, 'owner', 'error', 60, error='Queue is full')
+
+    response = _upload(client)
+    assert response.status_code == 202
+    assert response.json['job_id'] != 'owner'
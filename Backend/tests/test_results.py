@@ -0,0 +1,58 @@
+import sys
+import pytest
+from utils import config, results
+
+
+def _rooftops(count):
+    return [{'id': i + 1, 'area_m2': 10.5 * i, 'percentage': 0.25, 'energy_potential_kwh_per_year': 900.0 + i,
+             'centroid': [1.5 * i, 2.0], 'bbox': [i, 0, i + 4, 3]} for i in range(count)]
+
+
+def test_short_lists_are_plain_json(monkeypatch):
+    monkeypatch.setattr(config, 'RESULT_COMPACT_ROOFTOPS', 4)
+    data, encoding = results.encode_rooftops(_rooftops(3))
+
+    assert encoding == 'json'
+    assert results.decode_rooftops(data, encoding) == _rooftops(3)
+
+
+def test_long_lists_are_msgpack_and_zlib(monkeypatch):
+    pytest.importorskip('msgpack')
+    monkeypatch.setattr(config, 'RESULT_COMPACT_ROOFTOPS', 4)
+    data, encoding = results.encode_rooftops(_rooftops(200))
+
+    assert encoding == 'msgpack+zlib'
+    assert results.decode_rooftops(data, encoding.encode()) == _rooftops(200)
+    assert len(data) < len(results.encode_rooftops(_rooftops(3))[0]) * 200 / 3
+
+
+def test_long_lists_fall_back_to_json_and_zlib_without_msgpack(monkeypatch):
+    monkeypatch.setattr(config, 'RESULT_COMPACT_ROOFTOPS', 4)
+    monkeypatch.setitem(sys.modules, 'msgpack', None)
+    data, encoding = results.encode_rooftops(_rooftops(200))
+
+    assert encoding == 'json+zlib'
+    assert results.decode_rooftops(data, encoding) == _rooftops(200)
+
+
+def test_written_result_reads_back_whole_or_by_field(redis_conn, monkeypatch):
+    monkeypatch.setattr(config, 'RESULT_COMPACT_ROOFTOPS', 4)
+    result = {'status': 'completed', 'total_energy_potential': 1234.5, 'rooftops': _rooftops(10)}
+    pipe = redis_conn.pipeline()
+    results.write_result(pipe, 'job-1', result, 60)
+    pipe.execute()
+
+    stored, ttl = results.read_result(redis_conn, 'job-1', with_ttl=True)
+    assert stored == dict(result, rooftop_count=10)
+    assert 0 < ttl <= 60
+
+    assert results.read_result(redis_conn, 'job-1', fields=('status',)) == {'status': 'completed'}
+    assert results.read_result(redis_conn, 'job-1', fields=('rooftops', 'missing')) == {'rooftops': _rooftops(10)}
+
+
+def test_missing_and_legacy_results_read_as_none(redis_conn):
+    assert results.read_result(redis_conn, 'missing') is None
+    assert results.read_result(redis_conn, 'missing', with_ttl=True) == (None, 0)
+
+    redis_conn.set(results.result_key('legacy'), '{"status": "completed"}')
+    assert results.read_result(redis_conn, 'legacy') is None
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from benchmark import StubModel, synthetic_scene
+from utils.detect import run_tiled_inference, run_inference, prepare_image, analyze_detections, merge_tile_detections
+
+
+def _piece(tile, window, box):
+    x0, y0, x1, y1 = box
+    mask = np.ones((y1 - y0, x1 - x0), dtype=bool)
+    return {'tile': tile, 'window': window, 'box': box, 'mask': mask, 'area': int(mask.sum()), 'confidence': 0.9}
+
+
+@pytest.mark.parametrize('width, height, rooftops', [(1920, 1080, 10), (4000, 3000, 50)])
+def test_tiled_and_single_pass_count_the_same_rooftops(width, height, rooftops):
+    model = StubModel()
+    image = synthetic_scene(width, height, rooftops)
+
+    tiled = run_tiled_inference(model, image)
+    single, _ = analyze_detections(run_inference(model, [prepare_image(image)])[0], image, 'scene')
+
+    assert len(tiled) == len(single['rooftops']) == rooftops
+
+
+def test_pieces_of_one_rooftop_merge_through_a_chain():
+    # A roof spanning x 500-1100 seen by three tiles: a thin strip at the right edge of
+    # the first, a piece cut off by the second and the whole roof in the third
+    strip = _piece(0, (0, 0, 520, 640), (500, 100, 520, 300))
+    partial = _piece(1, (400, 0, 1040, 640), (500, 100, 1040, 300))
+    whole = _piece(2, (480, 0, 1120, 640), (500, 100, 1100, 300))
+
+    merged = merge_tile_detections([strip, partial, whole])
+
+    assert len(merged) == 1
+    assert merged[0]['box'] == (500, 100, 1100, 300)
+    assert merged[0]['area'] == 600 * 200
+
+
+def test_separate_rooftops_in_the_tile_overlap_stay_apart():
+    left = _piece(0, (0, 0, 640, 640), (450, 100, 500, 200))
+    right = _piece(1, (400, 0, 1040, 640), (550, 100, 600, 200))
+    assert len(merge_tile_detections([left, right])) == 2
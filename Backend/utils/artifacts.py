@@ -0,0 +1,234 @@
+import os
+import time
+import shutil
+from utils import config
+from utils.results import result_key
+from utils.jobs import is_job_id
+
+CHUNK_SIZE = 256 * 1024
+
+# Set while a worker runs garbage collection, so one worker does it per interval
+GC_LOCK_KEY = 'artifacts:gc'
+
+
+def artifact_key(job_id, name):
+    """Key of one of a job's artifacts; all of a job's artifacts share the ``{job_id}/`` prefix"""
+    return f"{job_id}/{name}"
+
+
+def _read_range(f, start, end):
+    try:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class LocalArtifactStore:
+    """Artifacts as files under ``root``, one directory per job. Only usable when the API and the workers share it."""
+
+    def __init__(self, root='results'):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid artifact key: {key}")
+        return path
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a partly written file
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key, source_path, content_type=None):
+        """Store a finished local file under ``key``, consuming it"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(source_path, path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def stat(self, key):
+        """``size``, ``etag`` (quoted) and ``modified`` (epoch seconds); FileNotFoundError if missing"""
+        st = os.stat(self._path(key))
+        return {'size': st.st_size, 'etag': f'"{st.st_mtime_ns:x}-{st.st_size:x}"', 'modified': st.st_mtime}
+
+    def stream(self, key, start=0, end=None):
+        """Iterator over bytes ``[start, end)``; the file is opened before returning, so a missing one raises here"""
+        f = open(self._path(key), 'rb')
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        return _read_range(f, start, end)
+
+    def jobs(self):
+        """
+        ``{job_id: newest modification time}`` of every job with artifacts. Entries not
+        named after a job id are someone else's and are left out, so they are never collected.
+        """
+        jobs = {}
+        if not os.path.isdir(self.root):
+            return jobs
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                if not is_job_id(entry.name):
+                    continue
+                modified = max((e.stat().st_mtime for e in os.scandir(entry.path)), default=entry.stat().st_mtime)
+                jobs[entry.name] = max(jobs.get(entry.name, 0), modified)
+            else:
+                # Files written flat into results/ by older versions: "<job_id>_<name>"
+                job_id, _, name = entry.name.partition('_')
+                if not name or not is_job_id(job_id):
+                    continue
+                jobs[job_id] = max(jobs.get(job_id, 0), entry.stat().st_mtime)
+        return jobs
+
+    def delete_job(self, job_id):
+        shutil.rmtree(self._path(job_id), ignore_errors=True)
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.startswith(f"{job_id}_"):
+                os.remove(entry.path)
+
+
+class S3ArtifactStore:
+    """
+    Artifacts in an S3-compatible bucket (AWS S3, MinIO, ...), under ``prefix``,
+    so the API and the workers can run on different hosts.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None):
+        import boto3
+
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def _call(self, method, key, **kwargs):
+        from botocore.exceptions import ClientError
+
+        try:
+            return getattr(self.client, method)(Bucket=self.bucket, Key=self.prefix + key, **kwargs)
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(f"Artifact not found: {key}")
+            raise
+
+    def put(self, key, data, content_type=None):
+        extra = {'ContentType': content_type} if content_type else {}
+        self._call('put_object', key, Body=data, **extra)
+
+    def put_file(self, key, source_path, content_type=None):
+        """Upload a finished local file under ``key`` (multipart for large files), consuming it"""
+        extra = {'ContentType': content_type} if content_type else {}
+        try:
+            self.client.upload_file(source_path, self.bucket, self.prefix + key, ExtraArgs=extra)
+        finally:
+            os.remove(source_path)
+
+    def get(self, key):
+        return self._call('get_object', key)['Body'].read()
+
+    def exists(self, key):
+        try:
+            self._call('head_object', key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stat(self, key):
+        head = self._call('head_object', key)
+        return {'size': head['ContentLength'], 'etag': head['ETag'], 'modified': head['LastModified'].timestamp()}
+
+    def stream(self, key, start=0, end=None):
+        kwargs = {}
+        if start or end is not None:
+            kwargs['Range'] = f"bytes={start}-{'' if end is None else end - 1}"
+        return self._call('get_object', key, **kwargs)['Body'].iter_chunks(CHUNK_SIZE)
+
+    def _objects(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            yield from page.get('Contents', [])
+
+    def jobs(self):
+        """As for :meth:`LocalArtifactStore.jobs`: only keys under a job id prefix count"""
+        jobs = {}
+        for item in self._objects():
+            job_id, _, name = item['Key'][len(self.prefix):].partition('/')
+            if not name or not is_job_id(job_id):
+                continue
+            jobs[job_id] = max(jobs.get(job_id, 0), item['LastModified'].timestamp())
+        return jobs
+
+    def delete_job(self, job_id):
+        keys = [{'Key': item['Key']} for item in self._objects(f"{job_id}/")]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys[start:start + 1000]})
+
+
+_store = None
+
+
+def get_store():
+    """The configured artifact store (``config.ARTIFACT_STORE``), created on first use"""
+    global _store
+    if _store is None:
+        if config.ARTIFACT_STORE == 's3':
+            _store = S3ArtifactStore(config.S3_BUCKET, config.S3_PREFIX, config.S3_ENDPOINT_URL, config.S3_REGION)
+        else:
+            _store = LocalArtifactStore(config.ARTIFACT_DIR)
+    return _store
+
+
+def collect_garbage(store, redis_conn, grace=None):
+    """
+    Delete the artifacts of every job whose result has expired from Redis.
+
+    Artifacts modified within the last ``grace`` seconds are kept, since a job
+    writes its files shortly before it publishes its result.
+
+    Returns:
+        int: Number of jobs whose artifacts were deleted
+    """
+    grace = config.ARTIFACT_GC_GRACE if grace is None else grace
+    now = time.time()
+    removed = 0
+    for job_id, modified in store.jobs().items():
+        if now - modified < grace or redis_conn.exists(result_key(job_id)):
+            continue
+        store.delete_job(job_id)
+        removed += 1
+    return removed
+
+
+def collect_garbage_periodically(redis_conn, store=None):
+    """Run :func:`collect_garbage` if no worker has in the last ``config.ARTIFACT_GC_INTERVAL`` seconds"""
+    if not config.ARTIFACT_GC_INTERVAL or not redis_conn.set(GC_LOCK_KEY, 1, nx=True, ex=config.ARTIFACT_GC_INTERVAL):
+        return 0
+    try:
+        removed = collect_garbage(store or get_store(), redis_conn)
+    except Exception as e:
+        print(f"Artifact garbage collection failed: {str(e)}")
+        return 0
+    if removed:
+        print(f"Deleted the artifacts of {removed} expired jobs")
+    return removed
@@ -0,0 +1,138 @@
+import io
+import os
+import time
+import zipfile
+import zlib
+
+# Numeric fields of a batch hash, updated incrementally as children finish
+COUNTERS = ('completed', 'failed', 'rooftop_count')
+FLOAT_COUNTERS = ('total_energy_potential', 'rooftop_area_m2', 'image_area_m2')
+
+
+def batch_key(batch_id):
+    """Hash holding a batch's progress counters and running aggregate"""
+    return f"batch:{batch_id}"
+
+
+def batch_jobs_key(batch_id):
+    """List of ``job_id:filename`` entries for a batch's children"""
+    return f"batch_jobs:{batch_id}"
+
+
+def read_archive(data, max_files, max_file_bytes):
+    """
+    Yield ``(filename, bytes)`` for the files inside a zip archive, one at a time.
+
+    Directories and macOS resource forks are skipped. Entries are checked against
+    ``max_file_bytes`` before they are decompressed, and no more than that is ever
+    decompressed from one entry, whatever size its header declares. Oversized
+    entries are yielded with None.
+
+    Raises:
+        ValueError: If the archive is invalid or holds more than ``max_files`` files
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ValueError("The archive is not a valid zip file")
+
+    entries = [info for info in archive.infolist()
+               if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+               and not os.path.basename(info.filename).startswith('.')]
+    if len(entries) > max_files:
+        raise ValueError(f"The archive holds {len(entries)} files; the limit is {max_files}")
+
+    for info in entries:
+        if info.file_size > max_file_bytes:
+            yield info.filename, None
+            continue
+        try:
+            with archive.open(info) as member:
+                content = member.read(max_file_bytes + 1)
+        except (zipfile.BadZipFile, zlib.error):
+            raise ValueError(f"{info.filename} in the archive is corrupt")
+        yield info.filename, content if len(content) <= max_file_bytes else None
+
+
+def create_batch(redis_conn, batch_id, children, ttl):
+    """
+    Register a batch and its children.
+
+    Args:
+        children (list): ``(job_id, filename)`` pairs
+        ttl (int): Seconds to keep the batch after its last update
+    """
+    pipe = redis_conn.pipeline()
+    pipe.hset(batch_key(batch_id), mapping=dict(
+        {name: 0 for name in COUNTERS + FLOAT_COUNTERS},
+        total=len(children),
+        created_at=time.time(),
+    ))
+    if children:
+        pipe.rpush(batch_jobs_key(batch_id), *[f"{job_id}:{filename}" for job_id, filename in children])
+    pipe.expire(batch_key(batch_id), ttl)
+    pipe.expire(batch_jobs_key(batch_id), ttl)
+    pipe.execute()
+
+
+def record_child(redis_conn, batch_id, ttl, results=None):
+    """
+    Fold one finished child into the batch aggregate atomically.
+
+    Args:
+        results (dict, optional): The child's analysis; None records a failure
+    """
+    key = batch_key(batch_id)
+    pipe = redis_conn.pipeline(transaction=True)
+    if results is None:
+        pipe.hincrby(key, 'failed', 1)
+    else:
+        rooftop_area = sum(rooftop['area_m2'] for rooftop in results['rooftops'])
+        pipe.hincrby(key, 'completed', 1)
+        pipe.hincrby(key, 'rooftop_count', len(results['rooftops']))
+        pipe.hincrbyfloat(key, 'total_energy_potential', results['total_energy_potential'])
+        pipe.hincrbyfloat(key, 'rooftop_area_m2', rooftop_area)
+        pipe.hincrbyfloat(key, 'image_area_m2', results['image_area_m2'])
+    pipe.hset(key, 'updated_at', time.time())
+    pipe.expire(key, ttl)
+    pipe.expire(batch_jobs_key(batch_id), ttl)
+    pipe.execute()
+
+
+def batch_summary(redis_conn, batch_id, include_jobs=False):
+    """
+    Progress and aggregate of a batch, read from its hash alone.
+
+    Returns:
+        dict: The summary, or None if the batch does not exist
+    """
+    fields = redis_conn.hgetall(batch_key(batch_id))
+    if not fields:
+        return None
+    fields = {k.decode(): v.decode() for k, v in fields.items()}
+
+    total = int(fields['total'])
+    completed = int(fields['completed'])
+    failed = int(fields['failed'])
+    image_area = float(fields['image_area_m2'])
+    rooftop_area = float(fields['rooftop_area_m2'])
+
+    summary = {
+        'batch_id': batch_id,
+        'status': 'completed' if completed + failed >= total else 'processing',
+        'total': total,
+        'completed': completed,
+        'failed': failed,
+        'pending': max(0, total - completed - failed),
+        'rooftop_count': int(fields['rooftop_count']),
+        'total_energy_potential': float(fields['total_energy_potential']),
+        'rooftop_area_m2': rooftop_area,
+        'image_area_m2': image_area,
+        'total_coverage_percentage': rooftop_area / image_area * 100 if image_area else 0.0,
+    }
+    if include_jobs:
+        summary['jobs'] = []
+        for entry in redis_conn.lrange(batch_jobs_key(batch_id), 0, -1):
+            job_id, _, filename = entry.decode().partition(':')
+            summary['jobs'].append({'job_id': job_id, 'filename': filename})
+    return summary
@@ -0,0 +1,244 @@
+import time
+import traceback
+from rq import Queue, SimpleWorker
+from rq.exceptions import DequeueTimeout
+from rq.executions import Execution
+from rq.job import JobStatus
+from rq.utils import now
+from utils import config, metrics
+from utils.detect import prepare_image, preprocess_size, run_inference
+from utils.model_registry import get_model
+from utils.tasks import redis_conn, load_upload, finish_job, store_error
+from utils.progress import publish_stage
+from utils.jobs import PROCESS_IMAGE, lane_of
+from utils.lanes import WeightedScheduler
+
+BATCHABLE_FUNC = PROCESS_IMAGE
+
+
+def collect_batch(queues, connection, batch_size, max_wait_ms, idle_timeout=5):
+    """
+    Pop up to ``batch_size`` jobs from ``queues``.
+
+    Blocks until the first job arrives, then takes whatever is already queued.
+    The worker only lingers for up to ``max_wait_ms`` when more jobs keep
+    arriving, so a lone request on an idle queue starts immediately.
+
+    Returns:
+        list: Popped jobs, empty if nothing arrived within ``idle_timeout`` seconds
+    """
+    try:
+        popped = Queue.dequeue_any(queues, idle_timeout, connection=connection)
+    except DequeueTimeout:
+        return []
+    if popped is None:
+        return []
+    batch = [popped[0]]
+
+    deadline = time.monotonic() + max_wait_ms / 1000.0
+    waiting = False
+    while len(batch) < batch_size:
+        popped = Queue.dequeue_any(queues, None, connection=connection)
+        if popped is not None:
+            batch.append(popped[0])
+            waiting = True
+            continue
+        if not waiting or time.monotonic() >= deadline:
+            break
+        time.sleep(0.005)
+
+    return batch
+
+
+def process_image_batch(jobs, lanes=None):
+    """
+    Run detection for several ``process_image`` jobs with one batched model call.
+
+    Each job's result (or error) is written to Redis exactly as the single-image
+    path would write it; a bad image only fails its own job.
+
+    Args:
+        jobs (list): ``process_image`` argument tuples,
+            ``(image_key, job_id[, render, tiled, filename, batch_id, bounds])``
+        lanes (list, optional): Lane each job was queued in
+
+    Returns:
+        dict: ``{job_id: response}``, what ``process_image`` returns for each job
+            (the result, or the error response for a job that failed)
+    """
+    responses = {}
+    shared = {}
+    try:
+        with metrics.timed(shared, 'model_load'):
+            model = get_model(config.INFERENCE_MODEL_PATH, threads=config.ONNX_THREADS)
+    except Exception as e:
+        for (image_key, job_id, *options), lane in zip(jobs, lanes or [None] * len(jobs)):
+            batch_id = options[3] if len(options) > 3 else None
+            responses[job_id] = store_error(image_key, job_id, e, batch_id, dict(shared), lane)
+        return responses
+
+    input_size = preprocess_size(model, config.PREPROCESS_MODE)
+    loaded = []
+    for (image_key, job_id, *options), lane in zip(jobs, lanes or [None] * len(jobs)):
+        render = options[0] if options else 'lazy'
+        filename = options[2] if len(options) > 2 else None
+        batch_id = options[3] if len(options) > 3 else None
+        bounds = options[4] if len(options) > 4 else None
+        timings = dict(shared)
+        try:
+            publish_stage(redis_conn, job_id, 'preprocessing', config.RESULT_TTL)
+            upload = load_upload(image_key, filename, timings)
+            upload['bounds'] = bounds
+            upload['lane'] = lane
+            with metrics.timed(timings, 'preprocess'):
+                processed_image = prepare_image(upload['image'], input_size)
+            loaded.append((upload, job_id, render, batch_id, processed_image))
+        except Exception as e:
+            responses[job_id] = store_error(image_key, job_id, e, batch_id, timings, lane)
+
+    if not loaded:
+        return responses
+
+    for _, job_id, _, _, _ in loaded:
+        publish_stage(redis_conn, job_id, 'inference', config.RESULT_TTL)
+    # Each job is charged its share of the batched call, so the per-job timings (and the
+    # lane wait estimates built from them) add up to the worker time actually spent
+    started = time.perf_counter()
+    try:
+        results = run_inference(model, [item[4] for item in loaded], conf_threshold=config.BASE_CONF_THRESHOLD)
+        share = (time.perf_counter() - started) / len(loaded)
+        for upload, *_ in loaded:
+            upload['timings']['inference'] = share
+    except Exception as e:
+        # Fall back to one image at a time so a single bad input cannot fail the batch
+        print(f"Batched inference failed ({str(e)}), retrying images individually")
+        results = []
+        for upload, job_id, _, batch_id, processed_image in loaded:
+            try:
+                with metrics.timed(upload['timings'], 'inference'):
+                    results.append(run_inference(model, [processed_image],
+                                                 conf_threshold=config.BASE_CONF_THRESHOLD)[0])
+            except Exception as single_error:
+                responses[job_id] = store_error(upload['key'], job_id, single_error, batch_id, upload['timings'],
+                                                upload['lane'])
+                results.append(None)
+
+    for (upload, job_id, render, batch_id, _), result in zip(loaded, results):
+        if result is None:
+            continue
+        try:
+            responses[job_id] = finish_job(upload, job_id, result, render, batch_id)
+        except Exception as e:
+            responses[job_id] = store_error(upload['key'], job_id, e, batch_id, upload['timings'], upload['lane'])
+    return responses
+
+
+# start_job and end_job are the only places relying on RQ internals (executions and
+# the job's success/failure handlers); requirements.txt pins rq to the versions they
+# were written against.
+
+def start_job(worker, job):
+    """
+    Record a job as started the way an RQ worker does: status, worker name and an
+    execution in the started registry. The execution expires, so if this process
+    dies the job is moved to the failed registry by RQ's registry cleanup.
+
+    Returns:
+        Execution: To pass to :func:`end_job`
+    """
+    with worker.connection.pipeline() as pipe:
+        execution = Execution.create(job, (job.timeout or Queue.DEFAULT_TIMEOUT) + 60, pipe, worker_name=worker.name)
+        job.prepare_for_execution(worker.name, pipe)
+        pipe.execute()
+    return execution
+
+
+def end_job(worker, job, execution, return_value=None, exc_string=None):
+    """
+    Record a job as finished, or as failed when ``exc_string`` is given, with RQ's
+    own bookkeeping: result, finished or failed registry, ``result_ttl`` or
+    ``failure_ttl`` expiry of the job hash, and the worker's counters.
+    """
+    job.ended_at = now()
+    with worker.connection.pipeline() as pipe:
+        if exc_string is None:
+            job._result = return_value
+            result_ttl = job.get_result_ttl(worker.default_result_ttl)
+            if result_ttl != 0:
+                job._handle_success(result_ttl, pipe, worker_name=worker.name, execution_id=execution.id,
+                                    execution_started_at=execution.created_at, execution_ended_at=job.ended_at)
+            job.cleanup(result_ttl, pipe, remove_from_queue=False)
+            worker.increment_successful_job_count(pipeline=pipe)
+        else:
+            job.set_status(JobStatus.FAILED, pipeline=pipe)
+            job._handle_failure(exc_string, pipe, worker_name=worker.name, execution_id=execution.id,
+                                execution_started_at=execution.created_at, execution_ended_at=job.ended_at)
+            worker.increment_failed_job_count(pipe)
+        worker.increment_total_working_time(job.ended_at - job.started_at, pipe)
+        execution.delete(job, pipe)
+        pipe.execute()
+
+
+def run_batching_worker(queue_names, connection, batch_size=None, max_wait_ms=None):
+    """
+    Worker loop that drains the queues in micro-batches.
+
+    ``process_image`` jobs are grouped into a single inference call; any other
+    job type is performed on its own as a regular RQ worker would. The queues are
+    visited in weighted lane order (``config.LANE_WEIGHTS``).
+
+    The process registers itself as an RQ worker, so it is counted by ``Worker.count``
+    and the admission estimates, and every job goes through the started, finished and
+    failed registries with its result and failure TTLs.
+    """
+    batch_size = batch_size or config.BATCH_SIZE
+    max_wait_ms = config.BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+    queues = [Queue(name, connection=connection) for name in queue_names]
+    scheduler = WeightedScheduler(config.LANE_WEIGHTS)
+    worker = SimpleWorker(queues, connection=connection)
+    worker.register_birth()
+    print(f"Batching worker {worker.name} started (batch size {batch_size}, max wait {max_wait_ms} ms), "
+          f"listening to queues: {queue_names}")
+
+    try:
+        while True:
+            worker.heartbeat()
+            if worker.should_run_maintenance_tasks:
+                # Moves jobs abandoned by dead workers to the failed registry
+                worker.run_maintenance_tasks()
+            jobs = collect_batch(scheduler.order(queues), connection, batch_size, max_wait_ms)
+            if not jobs:
+                continue
+            for job in jobs:
+                scheduler.served(lane_of(job.origin))
+
+            batchable = []
+            for job in jobs:
+                execution = start_job(worker, job)
+                # Tiled jobs already batch their tiles internally
+                tiled = len(job.args) > 3 and job.args[3]
+                if job.func_name == BATCHABLE_FUNC and not tiled:
+                    batchable.append((job, execution))
+                    continue
+                try:
+                    return_value = job.perform()
+                except Exception:
+                    end_job(worker, job, execution, exc_string=traceback.format_exc())
+                else:
+                    end_job(worker, job, execution, return_value)
+
+            if batchable:
+                print(f"Processing batch of {len(batchable)} images")
+                # Like process_image, a job whose image failed still ends with its error response
+                try:
+                    responses = process_image_batch([tuple(job.args) for job, _ in batchable],
+                                                    [lane_of(job.origin) for job, _ in batchable])
+                except Exception:
+                    exc_string = traceback.format_exc()
+                    for job, execution in batchable:
+                        end_job(worker, job, execution, exc_string=exc_string)
+                else:
+                    for job, execution in batchable:
+                        end_job(worker, job, execution, responses.get(job.id))
+    finally:
+        worker.register_death()
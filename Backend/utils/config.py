@@ -0,0 +1,131 @@
+import os
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Model
+MODEL_PATH = os.environ.get('GEOPV_MODEL_PATH', 'best.pt')
+MODEL_WARMUP = _env_bool('GEOPV_MODEL_WARMUP', True)
+MODEL_WARMUP_SIZE = int(os.environ.get('GEOPV_MODEL_WARMUP_SIZE', 640))
+
+# Inference backend: 'torch' runs MODEL_PATH with ultralytics, 'onnx' runs its ONNX export
+# (see export_onnx.py) with ONNX Runtime
+INFERENCE_BACKEND = os.environ.get('GEOPV_INFERENCE_BACKEND', 'torch')
+ONNX_MODEL_PATH = os.environ.get('GEOPV_ONNX_MODEL_PATH') or os.path.splitext(MODEL_PATH)[0] + '.onnx'
+ONNX_THREADS = int(os.environ.get('GEOPV_ONNX_THREADS', 0))  # 0 = the worker's thread limit
+# The weights the workers actually load
+INFERENCE_MODEL_PATH = ONNX_MODEL_PATH if INFERENCE_BACKEND == 'onnx' else MODEL_PATH
+
+# Preprocessing: 'full' sharpens the full-resolution image, 'input' shrinks it to the model
+# input size first and sharpens that (much cheaper on large images). GEOPV_PREPROCESS_MODES
+# sets it per model file name, e.g. "best.pt=full,best.onnx=input".
+_PREPROCESS_MODES = dict(item.strip().split('=', 1)
+                         for item in os.environ.get('GEOPV_PREPROCESS_MODES', '').split(',') if '=' in item)
+PREPROCESS_MODE = _PREPROCESS_MODES.get(os.path.basename(INFERENCE_MODEL_PATH),
+                                        os.environ.get('GEOPV_PREPROCESS_MODE', 'full'))
+
+# Micro-batching worker
+BATCH_SIZE = int(os.environ.get('GEOPV_BATCH_SIZE', 8))
+BATCH_MAX_WAIT_MS = int(os.environ.get('GEOPV_BATCH_MAX_WAIT_MS', 50))
+
+# Tiled inference for large images
+TILED_INFERENCE = _env_bool('GEOPV_TILED_INFERENCE', False)
+TILE_SIZE = int(os.environ.get('GEOPV_TILE_SIZE', 0))  # 0 = the model's input size
+TILE_OVERLAP = float(os.environ.get('GEOPV_TILE_OVERLAP', 0.2))
+TILE_BATCH_SIZE = int(os.environ.get('GEOPV_TILE_BATCH_SIZE', 8))
+TILE_IOU_THRESHOLD = float(os.environ.get('GEOPV_TILE_IOU_THRESHOLD', 0.5))
+
+# Detection thresholds. The model runs at the lower base threshold and every job keeps
+# its raw predictions, so /rescore can apply any threshold from the base upwards.
+CONF_THRESHOLD = float(os.environ.get('GEOPV_CONF_THRESHOLD', 0.5))
+BASE_CONF_THRESHOLD = float(os.environ.get('GEOPV_BASE_CONF_THRESHOLD', 0.25))
+
+# Redis: one client and connection pool per process, shared by every module. Requests
+# wait up to REDIS_POOL_TIMEOUT seconds for a free connection once the pool is full.
+REDIS_URL = os.environ.get('GEOPV_REDIS_URL', 'redis://localhost:6379/0')
+REDIS_MAX_CONNECTIONS = int(os.environ.get('GEOPV_REDIS_MAX_CONNECTIONS', 200))
+REDIS_POOL_TIMEOUT = float(os.environ.get('GEOPV_REDIS_POOL_TIMEOUT', 5))
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('GEOPV_REDIS_CONNECT_TIMEOUT', 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('GEOPV_REDIS_HEALTH_CHECK_INTERVAL', 30))
+# Each open /job_events stream holds a pub/sub connection for up to 10 minutes, so the
+# subscriptions get a pool of their own and cannot starve ordinary commands. Once it is
+# full, new streams wait REDIS_POOL_TIMEOUT seconds and then ask the client to reconnect.
+REDIS_PUBSUB_MAX_CONNECTIONS = int(os.environ.get('GEOPV_REDIS_PUBSUB_MAX_CONNECTIONS', 200))
+
+# Results
+RESULT_TTL = int(os.environ.get('GEOPV_RESULT_TTL', 3600))
+# Rooftop lists at least this long are stored compressed (msgpack when installed, else JSON,
+# then zlib); 0 always stores plain JSON
+RESULT_COMPACT_ROOFTOPS = int(os.environ.get('GEOPV_RESULT_COMPACT_ROOFTOPS', 64))
+
+# Per-rooftop records are streamed to clients while jobs run; longer streams drop their
+# oldest records (the running totals stay exact)
+ROOFTOP_STREAM_MAXLEN = int(os.environ.get('GEOPV_ROOFTOP_STREAM_MAXLEN', 20000))
+# Records per round-trip, so the first ones are readable before the rest are sent
+ROOFTOP_STREAM_CHUNK = int(os.environ.get('GEOPV_ROOFTOP_STREAM_CHUNK', 50))
+
+# Artifacts (reports, result images, rooftop outlines): 'local' keeps them under ARTIFACT_DIR,
+# which the API and the workers must share; 's3' keeps them in an S3-compatible bucket
+ARTIFACT_STORE = os.environ.get('GEOPV_ARTIFACT_STORE', 'local')
+ARTIFACT_DIR = os.environ.get('GEOPV_ARTIFACT_DIR', 'results')
+S3_BUCKET = os.environ.get('GEOPV_S3_BUCKET', 'geopv')
+S3_PREFIX = os.environ.get('GEOPV_S3_PREFIX', 'results/')
+S3_ENDPOINT_URL = os.environ.get('GEOPV_S3_ENDPOINT_URL')  # e.g. a local MinIO, http://localhost:9000
+S3_REGION = os.environ.get('GEOPV_S3_REGION')
+# Workers delete the artifacts of expired results, at most once per interval (0 = never);
+# anything modified within the grace period is kept
+ARTIFACT_GC_INTERVAL = int(os.environ.get('GEOPV_ARTIFACT_GC_INTERVAL', 300))
+ARTIFACT_GC_GRACE = int(os.environ.get('GEOPV_ARTIFACT_GC_GRACE', 600))
+
+# Content-addressed result cache
+RESULT_CACHE_ENABLED = _env_bool('GEOPV_RESULT_CACHE', True)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('GEOPV_RESULT_CACHE_MAX_ENTRIES', 1000))
+
+# Uploads
+MAX_UPLOAD_BYTES = int(os.environ.get('GEOPV_MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('GEOPV_MAX_IMAGE_PIXELS', 40_000_000))
+# 'downscale' shrinks oversized images while decoding, 'reject' refuses them with 413
+OVERSIZE_POLICY = os.environ.get('GEOPV_OVERSIZE_POLICY', 'downscale')
+
+# Worker pool
+WORKER_PROCESSES = int(os.environ.get('GEOPV_WORKER_PROCESSES', 1))  # 0 = size to the available cores
+WORKER_THREADS = int(os.environ.get('GEOPV_WORKER_THREADS', 0))  # 0 = cores / processes
+AUTO_THREADS_PER_WORKER = int(os.environ.get('GEOPV_AUTO_THREADS_PER_WORKER', 2))
+
+# Job lanes (see utils/jobs.py): images above LARGE_IMAGE_PIXELS go to the bulk lane.
+# Workers take jobs from the lanes in proportion to their weights.
+LARGE_IMAGE_PIXELS = int(os.environ.get('GEOPV_LARGE_IMAGE_PIXELS', 12_000_000))
+LANE_WEIGHTS = {lane: int(weight) for lane, weight in
+                (item.strip().split('=', 1) for item in
+                 os.environ.get('GEOPV_LANE_WEIGHTS', 'interactive=4,bulk=1').split(',') if '=' in item)}
+
+# Admission control: new jobs get 429 with Retry-After when the estimated wait in their
+# lane exceeds its limit in seconds (0 = no limit). Waits are estimated from the recent
+# job durations of the lane, or ADMISSION_DEFAULT_JOB_SECONDS until there are any.
+LANE_MAX_WAIT = {lane: float(limit) for lane, limit in
+                 (item.strip().split('=', 1) for item in
+                  os.environ.get('GEOPV_LANE_MAX_WAIT', 'interactive=120,bulk=3600').split(',') if '=' in item)}
+ADMISSION_DEFAULT_JOB_SECONDS = float(os.environ.get('GEOPV_ADMISSION_DEFAULT_JOB_SECONDS', 5))
+
+# Batch (multi-image) analysis
+BATCH_MAX_IMAGES = int(os.environ.get('GEOPV_BATCH_MAX_IMAGES', 500))
+BATCH_TTL = int(os.environ.get('GEOPV_BATCH_TTL', 24 * 3600))
+BATCH_MAX_UPLOAD_BYTES = int(os.environ.get('GEOPV_BATCH_MAX_UPLOAD_BYTES', 1024 * 1024 * 1024))
+# Total size of the images in a batch request once its archives are decompressed
+BATCH_MAX_EXTRACTED_BYTES = int(os.environ.get('GEOPV_BATCH_MAX_EXTRACTED_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Georeferenced imagery for region analysis (/detect_region), as name=kind:path pairs:
+# "xyz:/data/tiles/{z}/{x}/{y}.png" for a local XYZ tile directory or "geotiff:/data/ortho.tif",
+# e.g. GEOPV_TILE_SOURCES="district=xyz:/data/tiles/{z}/{x}/{y}.jpg,ortho=geotiff:/data/ortho.tif"
+TILE_SOURCES = dict(item.strip().split('=', 1)
+                    for item in os.environ.get('GEOPV_TILE_SOURCES', '').split(',') if '=' in item)
+REGION_WINDOW = int(os.environ.get('GEOPV_REGION_WINDOW', 1024))  # pixels per detection window
+# Context each window shares with its neighbours; rooftops up to twice this wide are counted exactly once
+REGION_MARGIN = int(os.environ.get('GEOPV_REGION_MARGIN', 128))
+REGION_MAX_WINDOWS = int(os.environ.get('GEOPV_REGION_MAX_WINDOWS', 20000))
+REGION_JOB_TIMEOUT = int(os.environ.get('GEOPV_REGION_JOB_TIMEOUT', 6 * 3600))
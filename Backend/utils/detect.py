@@ -1,13 +1,433 @@
+import os
+import math
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
-from ultralytics import YOLO 
-from utils.image_processing import preprocess_image
+from utils.image_header import read_image_header, reduction_factor, MAX_DECODE_REDUCTION
+from utils.image_processing import unsharp_mask, resize_to_input
+from utils.model_registry import get_model
+from utils.render import render_result, nearest_index
+
+
+def build_label_map(masks, confidences):
+    """
+    Combine instance masks into a single integer label map in one pass.
+
+    Label ``i + 1`` marks pixels of mask ``i``; 0 is background. Where masks
+    overlap, the pixel goes to the most confident detection, so every pixel is
+    counted once. The map stays at model resolution; see :func:`label_statistics`
+    for measuring it in original-image pixels.
+
+    Args:
+        masks (numpy.ndarray): (N, h, w) masks at model resolution
+        confidences (numpy.ndarray): (N,) detection confidences, or None to favour later masks
+
+    Returns:
+        numpy.ndarray: (h, w) uint16 label map
+    """
+    if confidences is None:
+        rank = np.arange(1, len(masks) + 1, dtype=np.uint16)
+    else:
+        rank = np.empty(len(masks), dtype=np.uint16)
+        rank[np.argsort(confidences, kind='stable')] = np.arange(1, len(masks) + 1, dtype=np.uint16)
+
+    priority = (masks > 0.5) * rank[:, None, None]
+    return np.where(priority.max(axis=0) > 0, priority.argmax(axis=0) + 1, 0).astype(np.uint16)
+
+
+def build_label_map_from_detections(detections, width, height):
+    """
+    Label map for tiled detections (see :func:`run_tiled_inference`).
+
+    Detections are painted in order of increasing confidence into their own
+    bounding boxes, so overlaps end up with the most confident rooftop.
+    """
+    labels = np.zeros((height, width), dtype=np.uint16)
+    order = sorted(range(len(detections)), key=lambda i: detections[i]['confidence'])
+    for i in order:
+        x0, y0, x1, y1 = detections[i]['box']
+        labels[y0:y1, x0:x1][detections[i]['mask']] = i + 1
+    return labels
+
+
+def label_statistics(labels, num_labels, width, height, block_pixels=1 << 20):
+    """
+    Per-label areas, centroids and bounding boxes, measured in original-image pixels.
+
+    ``labels`` may be smaller than the image (model resolution). Each label-map
+    cell is then weighted by the number of image pixels a ``cv2.INTER_NEAREST``
+    resize would copy it to, so the areas equal a pixel count of the resized
+    masks without ever building them; this matched the full-resolution count
+    exactly on every size we tried, and can only differ through floating point
+    rounding of the resize grid (at most one cell row or column of a mask).
+    Areas come from ``np.bincount``, centroids from the first-order image moments
+    (m10/m00, m01/m00). The map is walked in row blocks of about ``block_pixels``
+    cells so temporaries stay small for full-resolution maps too.
+
+    Returns:
+        tuple: (areas, centroids, boxes) with shapes (num_labels,), (num_labels, 2) as (x, y)
+            and (num_labels, 4) as (x0, y0, x1, y1) with exclusive ends
+    """
+    rows, cols = labels.shape
+    bins = num_labels + 1
+    map_y = nearest_index(height, rows)
+    map_x = nearest_index(width, cols)
+
+    # Image pixels per label-map cell along each axis, and the sums of their coordinates
+    row_counts = np.bincount(map_y, minlength=rows).astype(np.float64)
+    col_counts = np.bincount(map_x, minlength=cols).astype(np.float64)
+    row_sums = np.bincount(map_y, weights=np.arange(height, dtype=np.float64), minlength=rows)
+    col_sums = np.bincount(map_x, weights=np.arange(width, dtype=np.float64), minlength=cols)
+
+    m00 = np.zeros(bins)
+    m10 = np.zeros(bins)
+    m01 = np.zeros(bins)
+    top = np.full(bins, rows, dtype=np.intp)
+    bottom = np.full(bins, -1, dtype=np.intp)
+    left = np.full(bins, cols, dtype=np.intp)
+    right = np.full(bins, -1, dtype=np.intp)
+
+    step = max(1, block_pixels // max(cols, 1))
+    for start in range(0, rows, step):
+        block = labels[start:start + step]
+        flat = block.ravel()
+        counts = row_counts[start:start + step, None]
+        sums = row_sums[start:start + step, None]
+        m00 += np.bincount(flat, weights=(counts * col_counts).ravel(), minlength=bins)[:bins]
+        m10 += np.bincount(flat, weights=(counts * col_sums).ravel(), minlength=bins)[:bins]
+        m01 += np.bincount(flat, weights=(sums * col_counts).ravel(), minlength=bins)[:bins]
+
+        ys, xs = np.nonzero(block)
+        ids = block[ys, xs]
+        ys += start
+        np.minimum.at(top, ids, ys)
+        np.maximum.at(bottom, ids, ys)
+        np.minimum.at(left, ids, xs)
+        np.maximum.at(right, ids, xs)
+
+    areas = m00[1:]
+    safe = np.maximum(areas, 1)
+    centroids = np.stack([m10[1:] / safe, m01[1:] / safe], axis=1)
+
+    # Cell bounds to image pixel bounds: first pixel of the first cell, past the last pixel of the last cell
+    present = bottom[1:] >= 0
+    boxes = np.zeros((num_labels, 4), dtype=np.intp)
+    boxes[present, 0] = np.searchsorted(map_x, left[1:][present], side='left')
+    boxes[present, 1] = np.searchsorted(map_y, top[1:][present], side='left')
+    boxes[present, 2] = np.searchsorted(map_x, right[1:][present], side='right')
+    boxes[present, 3] = np.searchsorted(map_y, bottom[1:][present], side='right')
+    return areas, centroids, boxes
+
+
+def load_image(image_path):
+    """
+    Read an image from disk in BGR order.
+
+    Args:
+        image_path (str): Path to the input image
+
+    Returns:
+        numpy.ndarray: Decoded image
+    """
+    original_image = cv2.imread(image_path)
+    if original_image is None:
+        raise ValueError(f"Could not load image at {image_path}")
+    return original_image
+
+
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def decode_image(data, max_pixels=None):
+    """
+    Decode an uploaded image in one pass, shrinking it while decoding when it is
+    larger than ``max_pixels`` (JPEG decoders do this natively and much faster).
+
+    Args:
+        data (bytes): Encoded image
+        max_pixels (int, optional): Largest decoded image to return
+
+    Returns:
+        tuple: (BGR image, scale) where ``scale`` is how many original pixels one decoded
+            pixel spans along each side (1.0 when the image was not shrunk)
+    """
+    header = read_image_header(data)
+    factor = 1
+    if header and max_pixels:
+        factor = reduction_factor(header[1], header[2], max_pixels) or MAX_DECODE_REDUCTION
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_DECODE_FLAGS[factor])
+    if image is None:
+        raise ValueError("Could not decode the uploaded image")
+
+    # The scale comes from the reductions applied, not from the header: the decoder has
+    # already applied any EXIF rotation, so the header's width may be the decoded height
+    scale = float(factor)
+    height, width = image.shape[:2]
+    if max_pixels and height * width > max_pixels:
+        shrink = (max_pixels / (height * width)) ** 0.5
+        image = cv2.resize(image, (max(1, int(width * shrink)), max(1, int(height * shrink))),
+                           interpolation=cv2.INTER_AREA)
+        scale *= width / image.shape[1]
+
+    return image, scale
+
+
+def prepare_image(original_image, input_size=None):
+    """
+    Apply the preprocessing the model was tuned for.
+
+    Args:
+        original_image (numpy.ndarray): Decoded BGR image
+        input_size (int, optional): Shrink to the model's input size before sharpening
+            (``'input'`` preprocessing mode). The model would shrink the image to exactly
+            this size anyway, so the masks come out on the same grid, but the unsharp
+            mask then runs on a fraction of the pixels.
+
+    Returns:
+        numpy.ndarray: Preprocessed image
+    """
+    if input_size:
+        original_image = resize_to_input(original_image, input_size)
+    return unsharp_mask(original_image, amount=1.5)
+
+
+def preprocess_size(model, mode):
+    """Input size to pass to :func:`prepare_image` for a preprocessing mode ('full' or 'input')"""
+    return model_input_size(model) if mode == 'input' else None
+
+
+def run_inference(model, images, conf_threshold=0.5):
+    """
+    Run the segmentation model on one or more preprocessed images in a single call.
+
+    Args:
+        model (YOLO): Loaded segmentation model
+        images (list): Preprocessed images
+        conf_threshold (float): Confidence threshold for detections
+
+    Returns:
+        list: One ultralytics ``Results`` object per input image, in order
+    """
+    return list(model(list(images), conf=conf_threshold))
+
+
+def model_input_size(model, default=640):
+    """Side length of the square input the model was trained at."""
+    imgsz = getattr(model, 'overrides', {}).get('imgsz')
+    if imgsz is None:
+        args = getattr(getattr(model, 'model', None), 'args', None) or {}
+        imgsz = args.get('imgsz') if isinstance(args, dict) else getattr(args, 'imgsz', None)
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz)
+    return int(imgsz or default)
+
+
+def tile_windows(width, height, tile_size, overlap=0.2):
+    """
+    Overlapping ``(x0, y0, x1, y1)`` windows covering the image.
+
+    The last row and column are shifted back to end on the image border, so every
+    tile is full size unless the image itself is smaller than a tile.
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def _mask_data(result):
+    """
+    ``result.masks.data`` as a NumPy array covering the image only.
+
+    Ultralytics pads the letterboxed input to a multiple of the model stride and returns
+    masks over the padded input; the padding is cropped off here, so every backend gives
+    masks on a grid with the image's aspect ratio. Masks without padding are unchanged.
+    """
+    masks = result.masks.data
+    masks = masks.cpu().numpy() if hasattr(masks, 'cpu') else np.asarray(masks)
+    orig_shape = getattr(result, 'orig_shape', None)
+    if orig_shape is None or masks.ndim != 3:
+        return masks
+
+    grid_h, grid_w = masks.shape[1:]
+    gain = min(grid_h / orig_shape[0], grid_w / orig_shape[1])
+    pad_w, pad_h = (grid_w - orig_shape[1] * gain) / 2, (grid_h - orig_shape[0] * gain) / 2
+    # Rounded as ultralytics rounds the padding it adds
+    top, left = int(round(pad_h - 0.1)), int(round(pad_w - 0.1))
+    bottom, right = grid_h - int(round(pad_h + 0.1)), grid_w - int(round(pad_w + 0.1))
+    return masks[:, top:bottom, left:right]
+
+
+def _tile_detections(result, x0, y0):
+    """Yield each mask of a tile cropped to its bounding box, in full-image coordinates."""
+    if getattr(result, 'masks', None) is None:
+        return
+    masks = _mask_data(result)
+    confidences = result.boxes.conf
+    confidences = confidences.cpu().numpy() if hasattr(confidences, 'cpu') else np.asarray(confidences)
+
+    for mask, confidence in zip(masks, confidences):
+        binary = mask > 0.5
+        rows = np.flatnonzero(binary.any(axis=1))
+        cols = np.flatnonzero(binary.any(axis=0))
+        if not rows.size:
+            continue
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        crop = binary[r0:r1, c0:c1].copy()
+        yield {
+            'confidence': float(confidence),
+            'box': (int(x0 + c0), int(y0 + r0), int(x0 + c1), int(y0 + r1)),
+            'mask': crop,
+            'area': int(np.count_nonzero(crop)),
+        }
+
+
+def _overlap(a, b):
+    x0, y0, x1, y1 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+
+def _mask_within(piece, region):
+    # The piece's mask over ``region`` (which must lie inside its box)
+    x0, y0 = piece['box'][:2]
+    return piece['mask'][region[1] - y0:region[3] - y0, region[0] - x0:region[2] - x0]
+
+
+def _merge_masks(target, other):
+    ax0, ay0, ax1, ay1 = target['box']
+    bx0, by0, bx1, by1 = other['box']
+    x0, y0, x1, y1 = min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1)
+    merged = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    merged[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] |= target['mask']
+    merged[by0 - y0:by1 - y0, bx0 - x0:bx1 - x0] |= other['mask']
+    target.update(box=(x0, y0, x1, y1), mask=merged, area=int(np.count_nonzero(merged)),
+                  confidence=max(target['confidence'], other['confidence']))
+
+
+def _same_rooftop(a, b, iou_threshold, containment):
+    # Only the part both tiles saw can be compared: outside it, each piece may be cut off
+    shared = _overlap(a['window'], b['window'])
+    common = shared and _overlap(a['box'], b['box'])
+    common = common and _overlap(common, shared)
+    if not common:
+        return False
+    intersection = int(np.count_nonzero(_mask_within(a, common) & _mask_within(b, common)))
+    if not intersection:
+        return False
+    areas = [int(np.count_nonzero(_mask_within(piece, _overlap(piece['box'], shared)))) for piece in (a, b)]
+    union = areas[0] + areas[1] - intersection
+    return intersection / union >= iou_threshold or intersection / min(areas) >= containment
+
+
+def merge_tile_detections(pieces, iou_threshold=0.5, containment=0.8):
+    """
+    Merge the detections of different tiles that describe the same rooftop.
+
+    Pieces are compared only where their tiles overlap, since each tile may cut a
+    rooftop off at its edge. There, two pieces are the same rooftop when their IoU
+    reaches ``iou_threshold``, or when most of the smaller one lies inside the other
+    (a rooftop cut by a tile seam). Matches are chained, so a rooftop cut into several
+    pieces is merged into one detection even when two of its pieces do not match each
+    other directly (e.g. pieces from diagonal tiles).
+
+    Args:
+        pieces (list): Tile detections with ``tile``, ``window`` (the tile's x0, y0, x1, y1),
+            ``box``, ``mask``, ``area`` and ``confidence``
+        iou_threshold (float): Mask IoU at which two pieces are merged
+        containment (float): Share of the smaller piece inside the other at which they are merged
+
+    Returns:
+        list: One detection per rooftop, in the order of each rooftop's first piece
+    """
+    parent = list(range(len(pieces)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    # Sweep the pieces by left edge, so only pieces whose boxes overlap horizontally are compared
+    active = []
+    for index in sorted(range(len(pieces)), key=lambda i: pieces[i]['box'][0]):
+        piece = pieces[index]
+        active = [other for other in active if pieces[other]['box'][2] > piece['box'][0]]
+        for other in active:
+            if pieces[other]['tile'] != piece['tile'] and find(other) != find(index) \
+                    and _same_rooftop(pieces[other], piece, iou_threshold, containment):
+                parent[find(index)] = find(other)
+        active.append(index)
+
+    groups = {}
+    for index, piece in enumerate(pieces):
+        groups.setdefault(find(index), []).append(piece)
+    detections = []
+    for group in groups.values():
+        detection = group[0]
+        for other in group[1:]:
+            _merge_masks(detection, other)
+        detections.append(detection)
+    return detections
+
+
+def run_tiled_inference(model, image, conf_threshold=0.5, tile_size=None, overlap=0.2, batch_size=8,
+                        iou_threshold=0.5):
+    """
+    Detect rooftops with overlapping tiles at the model's native input size.
+
+    Large images are not downsampled as a whole, so small rooftops survive. Tiles
+    are preprocessed and inferred ``batch_size`` at a time and only each mask's
+    cropped bounding box is kept, so peak memory does not grow with the number
+    of tiles.
+
+    Args:
+        model (YOLO): Loaded segmentation model
+        image (numpy.ndarray): Full BGR image (not preprocessed)
+        conf_threshold (float): Confidence threshold for detections
+        tile_size (int, optional): Tile side in pixels, the model's input size by default
+        overlap (float): Fraction of a tile shared with its neighbour
+        batch_size (int): Tiles per model call
+        iou_threshold (float): Mask IoU at which detections from different tiles are merged
+
+    Returns:
+        list: Detections as dicts with ``confidence``, ``box`` (x0, y0, x1, y1) and a cropped boolean ``mask``
+    """
+    height, width = image.shape[:2]
+    tile_size = tile_size or model_input_size(model)
+    windows = tile_windows(width, height, tile_size, overlap)
+
+    pieces = []
+    for start in range(0, len(windows), batch_size):
+        chunk = windows[start:start + batch_size]
+        tiles = [prepare_image(image[y0:y1, x0:x1]) for x0, y0, x1, y1 in chunk]
+        results = model(tiles, conf=conf_threshold, imgsz=tile_size, retina_masks=True, verbose=False)
+
+        for tile_index, (window, result) in enumerate(zip(chunk, results), start):
+            for detection in _tile_detections(result, window[0], window[1]):
+                detection.update(tile=tile_index, window=window)
+                pieces.append(detection)
+
+    detections = merge_tile_detections(pieces, iou_threshold)
+    print(f"Tiled inference: {len(windows)} tiles of {tile_size}px, {len(detections)} rooftops after merging")
+    return detections
+
 
 def detect_rooftops_with_solar_potential(image_path, model_path, conf_threshold=0.5, color_opacity=0.7,
                                          display_original=True, panel_efficiency=0.20,
-                                         solar_radiation=1445, performance_ratio=0.75):
+                                         solar_radiation=1445, performance_ratio=0.75, model=None,
+                                         render=True, tiled=False, output_dir='.'):
     """
     Detect individual rooftops in an image, display masked areas with different colors,
     calculate percentage of image covered by each rooftop, and calculate solar potential.
@@ -21,216 +441,190 @@ def detect_rooftops_with_solar_potential(image_path, model_path, conf_threshold=
         panel_efficiency (float): Solar panel yield/efficiency (default: 20%)
         solar_radiation (float): Annual average solar radiation on tilted panels (kWh/m²/year)
         performance_ratio (float): Performance ratio, coefficient for losses (range 0.5 to 0.9)
+        model (YOLO, optional): Already loaded model; taken from the model registry when omitted
+        render (bool): Write the annotated result image; skip it when only the numbers are needed
+        tiled (bool): Run overlapping tiles at the model's input size instead of one downsampled pass
+        output_dir (str, optional): Where to write the result image and report; None keeps
+            everything in memory
 
     Returns:
         dict: Dictionary containing total coverage and individual rooftop information with solar potential
     """
-    
-    original_image = cv2.imread(image_path)
-    if original_image is None:
-        raise ValueError(f"Could not load image at {image_path}")
+    original_image = load_image(image_path)
+
+    if model is None:
+        model = get_model(model_path)
+    if tiled:
+        result = run_tiled_inference(model, original_image, conf_threshold)
+    else:
+        result = run_inference(model, [prepare_image(original_image)], conf_threshold)[0]
+
+    analysis, labels = analyze_detections(result, original_image, image_path, panel_efficiency=panel_efficiency,
+                                          solar_radiation=solar_radiation, performance_ratio=performance_ratio)
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        if render:
+            rendered = render_result(original_image, labels, analysis, color_opacity, display_original)
+            cv2.imwrite(os.path.join(output_dir, 'rooftop_detection_result.png'), rendered)
+        with open(os.path.join(output_dir, 'rooftop_solar_potential_report.txt'), 'w') as f:
+            f.write(format_report(analysis, image_path))
+
+    return analysis
+
 
-    # Convert from BGR to RGB for display
-    original_rgb = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
+def scale_rooftops(rooftops, scale, widen=False):
+    """
+    Copies of rooftop records with ``centroid`` and ``bbox`` multiplied by ``scale``,
+    e.g. from decoded-image pixels to the pixels of a larger image as uploaded.
+
+    Args:
+        rooftops (list): Records as in ``analysis['rooftops']``
+        scale (float): Factor to apply
+        widen (bool): Round box starts down and ends up instead of to the nearest pixel,
+            so the box still covers the whole rooftop
+
+    Returns:
+        list: The scaled records; ``rooftops`` itself when ``scale`` is 1
+    """
+    if scale == 1:
+        return rooftops
+    start, end = (math.floor, math.ceil) if widen else (round, round)
+    scaled = []
+    for rooftop in rooftops:
+        x0, y0, x1, y1 = rooftop['bbox']
+        scaled.append(dict(
+            rooftop,
+            **({'area_pixels': rooftop['area_pixels'] * scale * scale} if 'area_pixels' in rooftop else {}),
+            centroid=[round(rooftop['centroid'][0] * scale, 1), round(rooftop['centroid'][1] * scale, 1)],
+            bbox=[int(start(x0 * scale)), int(start(y0 * scale)), int(end(x1 * scale)), int(end(y1 * scale))],
+        ))
+    return scaled
+
+
+def rooftop_records(analysis, scale=1):
+    """
+    Yield the compact per-rooftop records streamed to clients while a job is still running.
+
+    Args:
+        scale (float): Uploaded width / analysed width, to report positions in the pixels
+            of the image as uploaded when it was shrunk for decoding
+
+    Yields:
+        dict: ``id``, ``area_m2``, ``percentage``, ``energy_potential_kwh_per_year``,
+            ``centroid`` and ``bbox`` (image pixels) of each rooftop, in id order
+    """
+    for rooftop in scale_rooftops(analysis['rooftops'], scale):
+        yield {
+            'id': rooftop['id'],
+            'area_m2': rooftop['area_m2'],
+            'percentage': rooftop['percentage'],
+            'energy_potential_kwh_per_year': rooftop['energy_potential_kwh_per_year'],
+            'centroid': rooftop['centroid'],
+            'bbox': rooftop['bbox'],
+        }
+
+
+def analyze_detections(result, original_image, image_path, panel_efficiency=0.20, solar_radiation=1445,
+                       performance_ratio=0.75, gsd=0.12):
+    """
+    Turn one image's model output into per-rooftop statistics.
 
-    gsd = 0.12 # meters/pixel (Average value for around 115 meters zoom in India)
+    Args:
+        result: ultralytics ``Results`` for ``original_image``, or the detection list
+            returned by :func:`run_tiled_inference`
+        original_image (numpy.ndarray): The image as decoded from disk (BGR)
+        image_path (str): Path or name of the input image
+        gsd (float): Ground sampling distance of ``original_image`` in meters/pixel
+
+    The remaining arguments are as for :func:`detect_rooftops_with_solar_potential`.
+
+    Returns:
+        tuple: (analysis, labels). ``analysis`` is the dictionary containing total coverage and
+            individual rooftop information with solar potential. Pixels covered by overlapping masks
+            are attributed to the most confident rooftop only, so the per-rooftop areas add up to the
+            union coverage. ``labels`` is the label map used for rendering, at model resolution
+            (full resolution for tiled detections).
+    """
     height, width = original_image.shape[:2]
+
+    if isinstance(result, list):
+        # Detections merged across tiles
+        labels = build_label_map_from_detections(result, width, height)
+        num_rooftops = len(result)
+    elif hasattr(result, 'masks') and result.masks is not None:
+        masks = _mask_data(result)
+        confidences = None
+        if getattr(result, 'boxes', None) is not None:
+            confidences = result.boxes.conf
+            confidences = confidences.cpu().numpy() if hasattr(confidences, 'cpu') else np.asarray(confidences)
+        labels = build_label_map(masks, confidences)
+        num_rooftops = len(masks)
+    else:
+        labels = np.zeros((1, 1), dtype=np.uint16)
+        num_rooftops = 0
+
+    analysis = measure_rooftops(labels, num_rooftops, width, height, panel_efficiency, solar_radiation,
+                                performance_ratio, gsd)
+    return analysis, labels
+
+
+def measure_rooftops(labels, num_rooftops, width, height, panel_efficiency=0.20, solar_radiation=1445,
+                     performance_ratio=0.75, gsd=0.12):
+    """
+    Areas and solar potential of the rooftops in a label map.
+
+    Args:
+        labels (numpy.ndarray): Label map over the image, at any resolution
+        num_rooftops (int): Number of labels in the map
+        width (int): Image width in pixels
+        height (int): Image height in pixels
+
+    The remaining arguments are as for :func:`analyze_detections`.
+
+    Returns:
+        dict: The analysis described in :func:`analyze_detections`
+    """
+    # gsd defaults to 0.12 meters/pixel (Average value for around 115 meters zoom in India)
     image_pixels = height * width
     image_area = height * width * gsd * gsd
-    
-    processed_image = preprocess_image(original_image, sharpen_method='unsharp_mask', amount=1.5)
 
-    model = YOLO(model_path)
-    results = model(processed_image, conf=conf_threshold)
+    areas, centroids, boxes = label_statistics(labels, num_rooftops, width, height)
 
-    rooftops = []
-    total_coverage = 0
-    total_energy_potential = 0
+    # Pixel area and percentage, then actual area in m²
+    percentages = areas / image_pixels * 100
+    areas_m2 = percentages / 100 * image_area
 
-    if display_original:
-        base_image = original_rgb.astype(np.float32) / 255.0
-    else:
-        base_image = np.ones_like(original_rgb, dtype=np.float32)
-
-    np.random.seed(42)
-    colors = []
-    for _ in range(100):
-        h = np.random.uniform(0, 1)
-        s = np.random.uniform(0.7, 1.0)
-        v = np.random.uniform(0.6, 1.0)
-
-        h_i = int(h * 6)
-        f = h * 6 - h_i
-        p = v * (1 - s)
-        q = v * (1 - f * s)
-        t = v * (1 - (1 - f) * s)
-
-        if h_i == 0:
-            r, g, b = v, t, p
-        elif h_i == 1:
-            r, g, b = q, v, p
-        elif h_i == 2:
-            r, g, b = p, v, t
-        elif h_i == 3:
-            r, g, b = p, q, v
-        elif h_i == 4:
-            r, g, b = t, p, v
-        else:
-            r, g, b = v, p, q
-
-        colors.append((r, g, b))
-
-    composite_mask = np.zeros_like(base_image)
-
-    if hasattr(results[0], 'masks') and results[0].masks is not None:
-        original_masks = results[0].masks.data
-
-        for i, original_mask in enumerate(original_masks):
-            if hasattr(original_mask, 'cpu'):
-                original_mask = original_mask.cpu().numpy()
-            else:
-                original_mask = np.array(original_mask)
-
-            mask = cv2.resize(
-                original_mask,
-                (width, height),
-                interpolation=cv2.INTER_NEAREST
-            )
-
-            # Pixel area and percentage
-            mask_area_pixels = np.sum(mask)
-            percentage = (mask_area_pixels / image_pixels) * 100
-
-            # Actual area in m²
-            area_m2 = (percentage / 100) * image_area
-
-
-            # Solar potential for this rooftop
-            # E = A * r * H * PR
-            energy_potential = area_m2 * panel_efficiency * solar_radiation * performance_ratio
-
-            total_coverage += percentage
-            total_energy_potential += energy_potential
-
-            rooftop_info = {
-                'id': i+1,
-                'percentage': percentage,
-                'area_pixels': mask_area_pixels,
-                'area_m2': area_m2,
-                'energy_potential_kwh_per_year': energy_potential,
-            }
-            rooftops.append(rooftop_info)
-
-            # Adding label to the center of each rooftop
-            if np.sum(mask) > 0:
-                y_indices, x_indices = np.where(mask > 0)
-                center_y = int(np.mean(y_indices))
-                center_x = int(np.mean(x_indices))
-
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                text = str(i+1)
-                text_size = cv2.getTextSize(text, font, 1, 2)[0]
-
-                cv2.rectangle(
-                    base_image,
-                    (center_x - text_size[0]//2 - 5, center_y - text_size[1]//2 - 5),
-                    (center_x + text_size[0]//2 + 5, center_y + text_size[1]//2 + 5),
-                    (1, 1, 1),
-                    -1
-                )
-
-                cv2.putText(
-                    base_image,
-                    text,
-                    (center_x - text_size[0]//2, center_y + text_size[1]//2),
-                    font,
-                    1,
-                    (0, 0, 0),
-                    2,
-                    cv2.LINE_AA
-                )
-
-            # Applying color to the mask
-            color = colors[i % len(colors)]
-            for c in range(3):
-                composite_mask[:, :, c] = np.where(
-                    mask > 0,
-                    composite_mask[:, :, c] * (1 - color_opacity) + color[c] * color_opacity,
-                    composite_mask[:, :, c]
-                )
-
-    # Combining the original image with the colored masks
-    if display_original:
-        result = np.where(
-            composite_mask > 0,
-            base_image * (1 - color_opacity) + composite_mask * color_opacity,
-            base_image
-        )
-    else:
-        result = np.where(composite_mask > 0, composite_mask, base_image)
-
-    result = np.clip(result, 0, 1)
-
-    plt.figure(figsize=(15, 12))
-    plt.imshow(result)
-
-    legend_elements = []
-    for i, rooftop in enumerate(rooftops):
-        color = colors[i % len(colors)]
-        legend_elements.append(
-            Patch(facecolor=color, edgecolor='black',
-                  label=f"Rooftop {rooftop['id']}: {rooftop['percentage']:.2f}% - {rooftop['area_m2']:.2f}m²")
-        )
-
-    
-    legend_elements.append(
-        Patch(facecolor='none', edgecolor='none',
-              label=f"Total Coverage: {total_coverage:.2f}%")
-    )
-    legend_elements.append(
-        Patch(facecolor='none', edgecolor='none',
-              label=f"Total Energy Potential: {total_energy_potential:.2f} kWh/year")
-    )
-
-
-    if rooftops:
-        plt.legend(handles=legend_elements, loc='upper right', fontsize='medium',
-                   title='Rooftop Coverage & Solar Potential', title_fontsize='large')
-    else:
-        plt.text(0.5, 0.5, "No rooftops detected", horizontalalignment='center',
-                 verticalalignment='center', transform=plt.gca().transAxes,
-                 fontsize=14, bbox=dict(facecolor='white', alpha=0.8))
-
-    plt.title('Rooftop Detection & Solar Potential Results')
-    plt.axis('off')
-    plt.tight_layout()
-    plt.savefig('rooftop_detection_result.png', dpi=300, bbox_inches='tight')
-
-    with open("rooftop_solar_potential_report.txt", "w") as f:
-        f.write(f"Rooftop Detection and Solar Potential Analysis Report\n")
-        f.write(f"=================================================\n\n")
-        f.write(f"Image analyzed: {image_path}\n")
-        f.write(f"Total area size: {image_area} m² \n")
-        f.write(f"Total rooftop coverage: {total_coverage:.2f}%\n")
-        f.write(f"Total available solar panel area: {total_coverage * image_area / 100:.2f} m²\n")
-        f.write(f"Solar panel efficiency used: {panel_efficiency*100}%\n")
-        f.write(f"Annual average solar radiation: {solar_radiation} kWh/m²/year\n")
-        f.write(f"Performance ratio used: {performance_ratio}\n\n")
-
-        f.write(f"Summary Results:\n")
-        f.write(f"- Total potential annual energy generation: {total_energy_potential:.2f} kWh/year\n")
-
-        f.write(f"Individual Rooftop Analysis:\n")
-        f.write(f"---------------------------\n")
-        for rooftop in rooftops:
-            f.write(f"\nRooftop {rooftop['id']}:\n")
-            f.write(f"- Coverage: {rooftop['percentage']:.2f}% of the image\n")
-            f.write(f"- Area: {rooftop['area_m2']:.2f} m²\n")
-            f.write(f"- Energy potential: {rooftop['energy_potential_kwh_per_year']:.2f} kWh/year\n")
+    # Solar potential for each rooftop
+    # E = A * r * H * PR
+    energy_potentials = areas_m2 * panel_efficiency * solar_radiation * performance_ratio
 
-    return {
+    # Overlapping pixels belong to a single rooftop, so the sum is the union coverage
+    total_coverage = percentages.sum()
+    total_energy_potential = energy_potentials.sum()
+
+    rooftops = []
+    for i in range(num_rooftops):
+        rooftops.append({
+            'id': i+1,
+            'percentage': percentages[i],
+            'area_pixels': areas[i],
+            'area_m2': areas_m2[i],
+            'energy_potential_kwh_per_year': energy_potentials[i],
+            'centroid': centroids[i],
+            'bbox': boxes[i],
+        })
+
+    analysis = {
         'total_coverage_percentage': float(total_coverage),
         'total_energy_potential': float(total_energy_potential),
+        'image_area_m2': float(image_area),
+        'parameters': {
+            'panel_efficiency': panel_efficiency,
+            'solar_radiation': solar_radiation,
+            'performance_ratio': performance_ratio,
+            'gsd': gsd,
+        },
         'rooftops': [
             {
                 'id': int(rooftop['id']),
@@ -238,6 +632,212 @@ def detect_rooftops_with_solar_potential(image_path, model_path, conf_threshold=
                 'area_pixels': float(rooftop['area_pixels']),
                 'area_m2': float(rooftop['area_m2']),
                 'energy_potential_kwh_per_year': float(rooftop['energy_potential_kwh_per_year']),
+                'centroid': [round(float(rooftop['centroid'][0]), 1), round(float(rooftop['centroid'][1]), 1)],
+                'bbox': [int(v) for v in rooftop['bbox']],
             } for rooftop in rooftops
         ]
     }
+    return analysis
+
+
+def rle_encode(mask):
+    """Run lengths of a boolean mask in row-major order, starting with a (possibly empty) run of zeros"""
+    flat = np.asarray(mask, dtype=bool).ravel()
+    if not flat.size:
+        return []
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate([[0], edges, [flat.size]]))
+    return ([0] if flat[0] else []) + runs.tolist()
+
+
+def rle_decode(counts, shape):
+    """Inverse of :func:`rle_encode`"""
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape(shape)
+
+
+def compact_predictions(result, width, height, base_conf_threshold, gsd=0.12, image_name=None):
+    """
+    Compact, JSON-serialisable copy of one image's model output, enough to re-score it later.
+
+    Every mask is kept as the run-length encoding of its bounding box crop on the
+    mask grid (model resolution, or full resolution for tiled detections), with
+    its confidence. Masks are listed in model order and empty ones are kept, so
+    rooftop ids match :func:`analyze_detections` on the same output.
+
+    Args:
+        result: ultralytics ``Results``, or the detection list from :func:`run_tiled_inference`
+        width (int): Image width in pixels
+        height (int): Image height in pixels
+        base_conf_threshold (float): Threshold the model ran at; re-scoring can only go higher
+        gsd (float): Ground sampling distance of the image in meters/pixel
+        image_name (str, optional): Name quoted in re-scored reports
+
+    Returns:
+        dict: ``width``, ``height``, ``grid`` ([columns, rows] of the mask grid), ``gsd``,
+            ``base_conf_threshold``, ``image_name`` and ``detections``
+            (``confidence``, ``box`` [x0, y0, x1, y1] in grid cells, ``counts``)
+    """
+    detections = []
+    if isinstance(result, list):
+        grid = [width, height]
+        for detection in result:
+            detections.append({'confidence': detection['confidence'], 'box': list(detection['box']),
+                               'counts': rle_encode(detection['mask'])})
+    elif getattr(result, 'masks', None) is not None:
+        masks = _mask_data(result)
+        confidences = result.boxes.conf
+        confidences = confidences.cpu().numpy() if hasattr(confidences, 'cpu') else np.asarray(confidences)
+        grid = [masks.shape[2], masks.shape[1]]
+        for mask, confidence in zip(masks, confidences):
+            binary = mask > 0.5
+            rows = np.flatnonzero(binary.any(axis=1))
+            cols = np.flatnonzero(binary.any(axis=0))
+            box = [int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1] if rows.size else [0, 0, 0, 0]
+            detections.append({'confidence': float(confidence), 'box': box,
+                               'counts': rle_encode(binary[box[1]:box[3], box[0]:box[2]])})
+    else:
+        grid = [1, 1]
+
+    return {
+        'width': width,
+        'height': height,
+        'grid': grid,
+        'gsd': gsd,
+        'base_conf_threshold': base_conf_threshold,
+        'image_name': image_name,
+        'detections': detections,
+    }
+
+
+def analyze_predictions(predictions, conf_threshold=0.5, panel_efficiency=0.20, solar_radiation=1445,
+                        performance_ratio=0.75, gsd=None):
+    """
+    Re-score stored predictions (see :func:`compact_predictions`) without running the model.
+
+    Detections at or below ``conf_threshold`` are dropped, as the model would have
+    dropped them, and the rest are measured exactly like :func:`analyze_detections`.
+
+    Args:
+        gsd (float, optional): Ground sampling distance; the one stored with the predictions by default
+
+    Returns:
+        tuple: (analysis, labels) as for :func:`analyze_detections`
+    """
+    if conf_threshold < predictions['base_conf_threshold']:
+        raise ValueError(f"conf_threshold cannot be below the base threshold "
+                         f"{predictions['base_conf_threshold']} the model ran at")
+
+    columns, rows = predictions['grid']
+    kept = []
+    for detection in predictions['detections']:
+        if detection['confidence'] <= conf_threshold:
+            continue
+        x0, y0, x1, y1 = detection['box']
+        kept.append({'confidence': detection['confidence'], 'box': (x0, y0, x1, y1),
+                     'mask': rle_decode(detection['counts'], (y1 - y0, x1 - x0))})
+
+    labels = build_label_map_from_detections(kept, columns, rows)
+    analysis = measure_rooftops(labels, len(kept), predictions['width'], predictions['height'], panel_efficiency,
+                                solar_radiation, performance_ratio, predictions['gsd'] if gsd is None else gsd)
+    return analysis, labels
+
+
+def format_report(analysis, image_path):
+    """
+    Plain-text solar potential report for an analysis returned by :func:`analyze_detections`.
+
+    Args:
+        analysis (dict): Detection result
+        image_path (str): Path or name of the input image, quoted in the report
+
+    Returns:
+        str: The report
+    """
+    params = analysis['parameters']
+    image_area = analysis['image_area_m2']
+    total_coverage = analysis['total_coverage_percentage']
+    lines = [
+        f"Rooftop Detection and Solar Potential Analysis Report",
+        f"=================================================",
+        f"",
+        f"Image analyzed: {image_path}",
+        f"Total area size: {image_area} m² ",
+        f"Total rooftop coverage: {total_coverage:.2f}%",
+        f"Total available solar panel area: {total_coverage * image_area / 100:.2f} m²",
+        f"Solar panel efficiency used: {params['panel_efficiency']*100}%",
+        f"Annual average solar radiation: {params['solar_radiation']} kWh/m²/year",
+        f"Performance ratio used: {params['performance_ratio']}",
+        f"",
+        f"Summary Results:",
+        f"- Total potential annual energy generation: {analysis['total_energy_potential']:.2f} kWh/year",
+        f"Individual Rooftop Analysis:",
+        f"---------------------------",
+    ]
+    for rooftop in analysis['rooftops']:
+        lines += [
+            f"",
+            f"Rooftop {rooftop['id']}:",
+            f"- Coverage: {rooftop['percentage']:.2f}% of the image",
+            f"- Area: {rooftop['area_m2']:.2f} m²",
+            f"- Energy potential: {rooftop['energy_potential_kwh_per_year']:.2f} kWh/year",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def _relative_difference(reference, candidate):
+    if reference == candidate:
+        return 0.0
+    return abs(candidate - reference) / max(abs(reference), 1e-9)
+
+
+def compare_backends(reference_model, candidate_model, image_paths, conf_threshold=0.5, tolerance=0.02):
+    """
+    Check that a candidate model (e.g. an INT8 ONNX export) measures the same rooftops as the reference.
+
+    Both models run the full pipeline on every image. The candidate passes when its total
+    rooftop area and energy potential stay within ``tolerance`` (relative) of the reference
+    on each image.
+
+    Args:
+        reference_model: Model whose results are trusted, normally the PyTorch weights
+        candidate_model: Model under test
+        image_paths (list): Sample images
+        conf_threshold (float): Confidence threshold for both models
+        tolerance (float): Largest accepted relative difference
+
+    Returns:
+        dict: ``passed``, ``tolerance``, the worst differences and per-image details
+    """
+    images = []
+    for image_path in image_paths:
+        original_image = load_image(image_path)
+        processed_image = prepare_image(original_image)
+        measured = []
+        for model in (reference_model, candidate_model):
+            result = run_inference(model, [processed_image], conf_threshold)[0]
+            analysis, _ = analyze_detections(result, original_image, image_path)
+            measured.append({
+                'rooftops': len(analysis['rooftops']),
+                'area_m2': sum(rooftop['area_m2'] for rooftop in analysis['rooftops']),
+                'energy_kwh_per_year': float(analysis['total_energy_potential']),
+            })
+        reference, candidate = measured
+        images.append({
+            'image': image_path,
+            'reference': reference,
+            'candidate': candidate,
+            'area_difference': _relative_difference(reference['area_m2'], candidate['area_m2']),
+            'energy_difference': _relative_difference(reference['energy_kwh_per_year'],
+                                                      candidate['energy_kwh_per_year']),
+        })
+
+    worst_area = max((image['area_difference'] for image in images), default=0.0)
+    worst_energy = max((image['energy_difference'] for image in images), default=0.0)
+    return {
+        'passed': worst_area <= tolerance and worst_energy <= tolerance,
+        'tolerance': tolerance,
+        'max_area_difference': worst_area,
+        'max_energy_difference': worst_energy,
+        'images': images,
+    }
@@ -0,0 +1,198 @@
+import gzip
+import json
+import math
+import numpy as np
+import cv2
+
+# Decimal places kept in the output: a tenth of a pixel, or about a centimetre in degrees
+PIXEL_PRECISION = 1
+DEGREE_PRECISION = 7
+
+
+def _mercator_y(lat):
+    return math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+
+def pixel_to_lonlat(width, height, bounds):
+    """
+    Map image pixels to longitude/latitude for a Web Mercator image (map screenshots
+    and XYZ tiles) covering ``bounds``.
+
+    Returns:
+        callable: ``f(points)`` turning an (N, 2) array of pixel (x, y) into (N, 2) (lon, lat)
+    """
+    west, south, east, north = bounds
+    top, bottom = _mercator_y(north), _mercator_y(south)
+
+    def transform(points):
+        lon = west + points[:, 0] / width * (east - west)
+        merc = top - points[:, 1] / height * (top - bottom)
+        lat = np.degrees(2 * np.arctan(np.exp(merc)) - np.pi / 2)
+        return np.stack([lon, lat], axis=1)
+
+    return transform
+
+
+def label_boxes(labels, num_labels):
+    """(num_labels, 4) bounding boxes (x0, y0, x1, y1, exclusive ends) of each label in label-map cells"""
+    boxes = np.zeros((num_labels, 4), dtype=np.intp)
+    ys, xs = np.nonzero(labels)
+    if not ys.size:
+        return boxes
+    ids = labels[ys, xs].astype(np.intp) - 1
+    boxes[:, 0] = boxes[:, 1] = np.iinfo(np.intp).max
+    np.minimum.at(boxes[:, 0], ids, xs)
+    np.minimum.at(boxes[:, 1], ids, ys)
+    np.maximum.at(boxes[:, 2], ids, xs + 1)
+    np.maximum.at(boxes[:, 3], ids, ys + 1)
+    boxes[boxes[:, 2] == 0] = 0
+    return boxes
+
+
+def rooftop_polygons(labels, num_rooftops, width, height, tolerance=1.0, ids=None):
+    """
+    Simplified outlines of every rooftop in a label map, in image pixel coordinates.
+
+    Each label's region is traced with ``cv2.findContours`` (holes included) and
+    simplified with Douglas-Peucker (``cv2.approxPolyDP``), ``tolerance`` being the
+    largest allowed deviation in label-map cells. Only the rooftops in ``ids``
+    are traced when it is given.
+
+    Returns:
+        list: Per rooftop, a list of polygons; each polygon is a list of rings
+            (exterior first, then holes) as (N, 2) float arrays of image (x, y)
+    """
+    rows, cols = labels.shape
+    scale = np.array([width / cols, height / rows])
+    polygons = [[] for _ in range(num_rooftops)]
+
+    for index, (x0, y0, x1, y1) in enumerate(label_boxes(labels, num_rooftops)):
+        if x1 <= x0 or (ids is not None and index + 1 not in ids):
+            continue
+        # One cell of padding so contours along the crop edge close properly
+        mask = np.zeros((y1 - y0 + 2, x1 - x0 + 2), dtype=np.uint8)
+        mask[1:-1, 1:-1] = labels[y0:y1, x0:x1] == index + 1
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        if hierarchy is None:
+            continue
+
+        rings = []
+        for contour in contours:
+            simplified = cv2.approxPolyDP(contour, tolerance, True).reshape(-1, 2)
+            if len(simplified) < 3:
+                rings.append(None)
+                continue
+            # Cell centres, back in image pixels
+            ring = (simplified + [x0 - 1 + 0.5, y0 - 1 + 0.5]) * scale
+            rings.append(np.vstack([ring, ring[:1]]))
+
+        # RETR_CCOMP: top-level contours are exteriors, their children are holes
+        for i, (_, _, first_child, parent) in enumerate(hierarchy[0]):
+            if parent != -1 or rings[i] is None:
+                continue
+            polygon = [rings[i]]
+            child = first_child
+            while child != -1:
+                if rings[child] is not None:
+                    polygon.append(rings[child])
+                child = hierarchy[0][child][0]
+            polygons[index].append(polygon)
+
+    return polygons
+
+
+def rooftop_features(labels, analysis, width, height, to_lonlat=None, tolerance=1.0, ids=None):
+    """
+    One GeoJSON feature per rooftop of an analysis, with its area and energy potential.
+
+    Coordinates are image pixels (x right, y down), or whatever ``to_lonlat`` maps an
+    (N, 2) array of them to. Rooftops not in ``ids`` (when given) are left out.
+
+    Returns:
+        list: The features
+    """
+    rooftops = analysis['rooftops']
+    precision = DEGREE_PRECISION if to_lonlat else PIXEL_PRECISION
+
+    features = []
+    for rooftop, polygons in zip(rooftops, rooftop_polygons(labels, len(rooftops), width, height, tolerance, ids)):
+        if not polygons:
+            continue
+        coordinates = [[np.round(to_lonlat(ring) if to_lonlat else ring, precision).tolist() for ring in polygon]
+                       for polygon in polygons]
+        features.append({
+            'type': 'Feature',
+            'id': rooftop['id'],
+            'geometry': ({'type': 'Polygon', 'coordinates': coordinates[0]} if len(coordinates) == 1
+                         else {'type': 'MultiPolygon', 'coordinates': coordinates}),
+            'properties': {
+                'id': rooftop['id'],
+                'area_m2': round(rooftop['area_m2'], 2),
+                'percentage': round(rooftop['percentage'], 4),
+                'energy_potential_kwh_per_year': round(rooftop['energy_potential_kwh_per_year'], 2),
+            },
+        })
+    return features
+
+
+def rooftops_geojson(labels, analysis, width, height, bounds=None, tolerance=1.0):
+    """
+    GeoJSON FeatureCollection of the rooftops in an analysis, one feature per rooftop.
+
+    Coordinates are image pixels (x right, y down) unless ``bounds`` (west, south,
+    east, north) are given, in which case they are WGS84 longitude/latitude.
+
+    Args:
+        labels (numpy.ndarray): Label map returned with ``analysis``
+        analysis (dict): Result of :func:`utils.detect.analyze_detections`
+        width (int): Image width in pixels
+        height (int): Image height in pixels
+
+    Returns:
+        dict: The FeatureCollection
+    """
+    to_lonlat = pixel_to_lonlat(width, height, bounds) if bounds else None
+    collection = {
+        'type': 'FeatureCollection',
+        'features': rooftop_features(labels, analysis, width, height, to_lonlat, tolerance),
+        'properties': {
+            'coordinates': 'lonlat' if bounds else 'pixel',
+            'width': width,
+            'height': height,
+            'total_coverage_percentage': round(analysis['total_coverage_percentage'], 4),
+            'total_energy_potential': round(analysis['total_energy_potential'], 2),
+        },
+    }
+    if bounds:
+        collection['bbox'] = list(bounds)
+    return collection
+
+
+def encode_geojson(collection):
+    """A FeatureCollection as compact, gzip-compressed JSON"""
+    return gzip.compress(json.dumps(collection, separators=(',', ':')).encode(), compresslevel=6)
+
+
+class GeoJsonWriter:
+    """
+    Writes a gzip-compressed FeatureCollection one batch of features at a time, so
+    region analyses never hold all their rooftops in memory.
+    """
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', compresslevel=6)
+        self.file.write('{"type":"FeatureCollection","features":[')
+        self.count = 0
+
+    def write(self, features):
+        for feature in features:
+            self.file.write((',' if self.count else '') + json.dumps(feature, separators=(',', ':')))
+            self.count += 1
+
+    def close(self, **members):
+        """Finish the collection; ``members`` (e.g. ``bbox``, ``properties``) follow the features"""
+        self.file.write(']')
+        for name, value in members.items():
+            self.file.write(f',{json.dumps(name)}:{json.dumps(value, separators=(",", ":"))}')
+        self.file.write('}')
+        self.file.close()
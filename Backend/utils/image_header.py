@@ -0,0 +1,43 @@
+import io
+from PIL import Image, UnidentifiedImageError
+
+# Pixel limits are enforced by the callers, not by Pillow's bomb check
+Image.MAX_IMAGE_PIXELS = None
+
+ALLOWED_FORMATS = ('PNG', 'JPEG', 'WEBP', 'BMP', 'TIFF')
+EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp', 'BMP': '.bmp', 'TIFF': '.tif'}
+
+# cv2.imread reduction flags can shrink an image by at most this factor while decoding
+MAX_DECODE_REDUCTION = 8
+
+
+def read_image_header(data):
+    """
+    Identify an encoded image from its header without decoding the pixels.
+
+    Args:
+        data (bytes): Encoded image
+
+    Returns:
+        tuple: (format, width, height), or None if the bytes are not a readable image
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.format, img.size[0], img.size[1]
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+def reduction_factor(width, height, max_pixels):
+    """
+    Smallest power-of-two downscale that brings the image within ``max_pixels``.
+
+    Returns:
+        int: 1, 2, 4 or 8, or None if even the largest reduction is not enough
+    """
+    factor = 1
+    while max_pixels and width * height > max_pixels * factor * factor:
+        factor *= 2
+        if factor > MAX_DECODE_REDUCTION:
+            return None
+    return factor
@@ -1,6 +1,49 @@
+import threading
 import cv2
 import numpy as np
 
+# Per-thread scratch buffers, reused while the frame size stays the same
+_scratch = threading.local()
+
+
+def _buffer(name, shape, dtype):
+    buffer = getattr(_scratch, name, None)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = np.empty(shape, dtype=dtype)
+        setattr(_scratch, name, buffer)
+    return buffer
+
+
+def unsharp_mask(image, amount=1.5, radius=1):
+    """
+    ``preprocess_image(image, 'unsharp_mask', amount, radius)`` with a single scratch buffer.
+
+    The blur and the high-pass share one preallocated frame and only the result is
+    newly allocated; the output is identical, including the high-pass being clipped
+    at zero like the uint8 ``addWeighted`` it replaces.
+    """
+    scratch = _buffer('blurred', image.shape, image.dtype)
+    cv2.GaussianBlur(image, (0, 0), radius, dst=scratch)
+    cv2.subtract(image, scratch, dst=scratch)
+    return cv2.addWeighted(image, 1.0, scratch, amount, 0)
+
+
+def resize_to_input(image, input_size):
+    """
+    Shrink ``image`` so its longer side is ``input_size``, as the model's letterbox would.
+
+    Images already within the input size are returned unchanged. The result is a
+    scratch buffer, valid until the next call on this thread.
+    """
+    height, width = image.shape[:2]
+    scale = input_size / max(height, width)
+    if scale >= 1:
+        return image
+    shape = (max(1, round(height * scale)), max(1, round(width * scale))) + image.shape[2:]
+    resized = _buffer('resized', shape, image.dtype)
+    cv2.resize(image, (shape[1], shape[0]), dst=resized, interpolation=cv2.INTER_LINEAR)
+    return resized
+
 def preprocess_image(image, sharpen_method='standard', amount=1.5, radius=1, threshold=0):
     """
     Preprocess the image with different sharpening methods.
@@ -0,0 +1,68 @@
+# Names shared by the API and the workers. This module must stay free of heavy
+# imports: the API enqueues jobs by name and never loads the detection code.
+import re
+
+# One queue per lane. Interactive: ordinary screenshots, answered while the user waits.
+# Bulk: large or tiled images, batch uploads and region analyses, which must never
+# hold up the interactive lane. Workers drain both by weight (config.LANE_WEIGHTS).
+LANES = {'interactive': 'rooftop_detection', 'bulk': 'rooftop_detection_bulk'}
+QUEUE_NAME = LANES['interactive']
+
+# Dotted path of the worker function, resolved by RQ inside the worker
+PROCESS_IMAGE = 'utils.tasks.process_image'
+PROCESS_REGION = 'utils.tasks.process_region'
+
+# How the annotated result image is produced:
+#   lazy  - keep the label map and source image, render on the first image request
+#   eager - render a PNG as part of the job
+#   none  - JSON and report only
+RENDER_MODES = ('lazy', 'eager', 'none')
+
+
+# Job ids are the API's uuid4 strings
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def is_job_id(name):
+    """Whether ``name`` has the form of a job id"""
+    return JOB_ID_PATTERN.fullmatch(name) is not None
+
+
+def lane_of(queue_name):
+    """Lane a queue belongs to, or None for queues outside the lanes"""
+    for lane, name in LANES.items():
+        if name == queue_name:
+            return lane
+    return None
+
+
+def input_key(job_id):
+    """Redis key holding the uploaded image bytes of a job"""
+    return f"job_input:{job_id}"
+
+
+def predictions_key(job_id):
+    """Redis key holding a job's compact raw predictions, for re-scoring"""
+    return f"job_predictions:{job_id}"
+
+
+def parse_bounds(text):
+    """
+    Read a ``west,south,east,north`` box in degrees (WGS84) covering an uploaded image.
+
+    Returns:
+        tuple: (west, south, east, north), or None if ``text`` is empty
+
+    Raises:
+        ValueError: If the text is not four numbers describing a valid box
+    """
+    if not text or not text.strip():
+        return None
+    try:
+        west, south, east, north = (float(value) for value in text.split(','))
+    except ValueError:
+        raise ValueError("bounds must be four comma-separated numbers: west,south,east,north")
+    # Web Mercator, which map screenshots and tiles use, stops at ±85.0511°
+    if not (-180 <= west < east <= 180 and -85.0511 <= south < north <= 85.0511):
+        raise ValueError("bounds must have west < east within ±180 and south < north within ±85.0511")
+    return west, south, east, north
@@ -0,0 +1,77 @@
+from rq import SimpleWorker, Worker
+from utils import config, metrics
+from utils.jobs import lane_of
+
+
+def choose_lane(pixels, tiled=False):
+    """Lane for a single upload: large and tiled images go to bulk"""
+    return 'bulk' if tiled or pixels > config.LARGE_IMAGE_PIXELS else 'interactive'
+
+
+class WeightedScheduler:
+    """
+    Orders the lane queues so that, while several lanes have work, jobs are taken
+    from them in proportion to their weights (smooth weighted round-robin, as in
+    nginx). Credit and debt are capped at one round, so a lane that was empty for
+    a while cannot monopolise the workers when jobs arrive, nor be starved after
+    having had the workers to itself.
+    """
+
+    def __init__(self, weights):
+        self.weights = {lane: weight for lane, weight in weights.items() if weight > 0}
+        self.total = sum(self.weights.values()) or 1
+        self.current = dict.fromkeys(self.weights, 0)
+
+    def served(self, lane):
+        """Account for one job taken from ``lane``"""
+        if lane not in self.weights:
+            return
+        for name, weight in self.weights.items():
+            self.current[name] = min(self.current[name] + weight, self.total)
+        self.current[lane] = max(self.current[lane] - self.total, -self.total)
+
+    def order(self, queues):
+        """``queues`` sorted by which lane is due next; queues outside the lanes come last"""
+        def due(queue):
+            lane = lane_of(queue.name)
+            if lane not in self.weights:
+                return float('-inf')
+            return self.current[lane] + self.weights[lane]
+        return sorted(queues, key=due, reverse=True)
+
+
+class WeightedWorker(SimpleWorker):
+    """A SimpleWorker that drains the lanes by weight instead of in strict queue order"""
+
+    def __init__(self, *args, weights=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lane_scheduler = WeightedScheduler(weights or config.LANE_WEIGHTS)
+        self._ordered_queues = self.lane_scheduler.order(self.queues)
+
+    def reorder_queues(self, reference_queue):
+        # Called by RQ after every dequeue with the queue the job came from
+        self.lane_scheduler.served(lane_of(reference_queue.name))
+        self._ordered_queues = self.lane_scheduler.order(self.queues)
+
+
+def estimated_wait(redis_conn, lane, queues):
+    """
+    Seconds a job queued in ``lane`` now would wait before a worker starts it.
+
+    Jobs already waiting in the lane times their recent average duration, spread
+    over the workers listening to it, each of which gives the lane only its weighted
+    share of its time while other lanes have work too.
+
+    Args:
+        queues (dict): ``{lane: rq.Queue}`` for every lane
+    """
+    waiting = queues[lane].count
+    if not waiting:
+        return 0.0
+    job_seconds = metrics.mean_job_seconds(redis_conn, lane) or config.ADMISSION_DEFAULT_JOB_SECONDS
+    workers = max(1, Worker.count(connection=redis_conn, queue=queues[lane]))
+    busy = [name for name, queue in queues.items() if name == lane or queue.count]
+    weights = config.LANE_WEIGHTS
+    share = weights.get(lane, 1) / (sum(weights.get(name, 1) for name in busy) or 1)
+    return waiting * job_seconds / (workers * share)
+
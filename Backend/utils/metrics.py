@@ -0,0 +1,130 @@
+import time
+from contextlib import contextmanager
+
+# Stages timed for every job, in pipeline order
+STAGES = ('model_load', 'decode', 'preprocess', 'inference', 'postprocess', 'stream', 'render', 'report', 'geometry',
+          'redis_write')
+
+# Upper bounds of the histogram buckets (Prometheus "le"), +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROOFTOP_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+COUNTERS_KEY = 'metrics:counters'
+
+# Completed jobs per lane kept for queue-wait estimates
+RECENT_JOBS = 100
+
+
+def histogram_key(name, label=None):
+    """Hash holding one histogram's cumulative bucket counts, sum and count"""
+    return f"metrics:histogram:{name}:{label}" if label else f"metrics:histogram:{name}"
+
+
+def recent_key(lane):
+    """List of the most recent job durations (seconds) in a lane, newest first"""
+    return f"metrics:recent_job_seconds:{lane}"
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the wall time spent in the block to ``timings[stage]`` (seconds)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def _observe(pipe, key, buckets, value):
+    for bound in buckets:
+        if value <= bound:
+            pipe.hincrby(key, repr(float(bound)), 1)
+    pipe.hincrby(key, '+Inf', 1)
+    pipe.hincrby(key, 'count', 1)
+    pipe.hincrbyfloat(key, 'sum', value)
+
+
+def record_job(redis_conn, timings, rooftops=None, failed=False, lane=None):
+    """
+    Fold one finished job into the shared counters and histograms.
+
+    Args:
+        redis_conn (Redis): Connection the API reads the metrics from
+        timings (dict): Seconds per stage, as collected with ``timed``
+        rooftops (int, optional): Rooftops detected, for completed jobs
+        failed (bool): Whether the job ended in an error
+        lane (str, optional): Lane the job was queued in; completed jobs feed its wait estimate
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hincrby(COUNTERS_KEY, 'failed' if failed else 'completed', 1)
+    for stage, seconds in timings.items():
+        _observe(pipe, histogram_key('stage_seconds', stage), LATENCY_BUCKETS, seconds)
+    if timings:
+        _observe(pipe, histogram_key('job_seconds'), LATENCY_BUCKETS, sum(timings.values()))
+    if rooftops is not None:
+        _observe(pipe, histogram_key('rooftops'), ROOFTOP_BUCKETS, rooftops)
+    if lane and timings and not failed:
+        pipe.lpush(recent_key(lane), sum(timings.values()))
+        pipe.ltrim(recent_key(lane), 0, RECENT_JOBS - 1)
+    pipe.execute()
+
+
+def mean_job_seconds(redis_conn, lane):
+    """Average duration of the lane's recent jobs, or None before any has completed"""
+    durations = redis_conn.lrange(recent_key(lane), 0, -1)
+    return sum(float(d) for d in durations) / len(durations) if durations else None
+
+
+def _histogram_lines(redis_conn, metric, key, buckets, labels=''):
+    fields = {k.decode(): v.decode() for k, v in redis_conn.hgetall(key).items()}
+    prefix = f"{labels}," if labels else ''
+    lines = []
+    for bound in buckets:
+        le = repr(float(bound))
+        lines.append(f'{metric}_bucket{{{prefix}le="{le}"}} {fields.get(le, 0)}')
+    lines.append(f'{metric}_bucket{{{prefix}le="+Inf"}} {fields.get("+Inf", 0)}')
+    suffix = f"{{{labels}}}" if labels else ''
+    lines.append(f"{metric}_sum{suffix} {float(fields.get('sum', 0))}")
+    lines.append(f"{metric}_count{suffix} {fields.get('count', 0)}")
+    return lines
+
+
+def render_metrics(redis_conn, gauges=None):
+    """
+    All metrics in the Prometheus text exposition format.
+
+    Args:
+        gauges (dict, optional): ``name: (help, value)`` point-in-time values such as queue depth;
+            ``value`` may be a dict of label sets (e.g. ``'lane="bulk"'``) to values
+    """
+    counters = {k.decode(): int(v) for k, v in redis_conn.hgetall(COUNTERS_KEY).items()}
+    lines = [
+        '# HELP geopv_jobs_total Jobs processed by the workers, by outcome',
+        '# TYPE geopv_jobs_total counter',
+        f'geopv_jobs_total{{status="completed"}} {counters.get("completed", 0)}',
+        f'geopv_jobs_total{{status="failed"}} {counters.get("failed", 0)}',
+    ]
+
+    for name, (help_text, value) in (gauges or {}).items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        if isinstance(value, dict):
+            lines += [f'{name}{{{labels}}} {v}' for labels, v in value.items()]
+        else:
+            lines.append(f'{name} {value}')
+
+    lines += ['# HELP geopv_stage_duration_seconds Time spent in each processing stage of a job',
+              '# TYPE geopv_stage_duration_seconds histogram']
+    for stage in STAGES:
+        lines += _histogram_lines(redis_conn, 'geopv_stage_duration_seconds',
+                                  histogram_key('stage_seconds', stage), LATENCY_BUCKETS, f'stage="{stage}"')
+
+    lines += ['# HELP geopv_job_duration_seconds Processing time of a job, summed over its stages',
+              '# TYPE geopv_job_duration_seconds histogram']
+    lines += _histogram_lines(redis_conn, 'geopv_job_duration_seconds', histogram_key('job_seconds'),
+                              LATENCY_BUCKETS)
+
+    lines += ['# HELP geopv_rooftops_per_image Rooftops detected per completed image',
+              '# TYPE geopv_rooftops_per_image histogram']
+    lines += _histogram_lines(redis_conn, 'geopv_rooftops_per_image', histogram_key('rooftops'),
+                              ROOFTOP_BUCKETS)
+    return '\n'.join(lines) + '\n'
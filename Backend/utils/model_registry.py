@@ -0,0 +1,99 @@
+import os
+import hashlib
+import threading
+
+# (absolute model path, sha256) -> loaded model
+_models = {}
+# absolute model path -> (mtime_ns, size, sha256), so unchanged files are not re-hashed
+_checksums = {}
+_lock = threading.Lock()
+
+
+def model_checksum(model_path):
+    """
+    Return the SHA-256 of a model file.
+
+    The digest is cached against the file's mtime and size, so calling this
+    once per job only costs a ``stat`` unless the file actually changed.
+    """
+    path = os.path.abspath(model_path)
+    stat = os.stat(path)
+    cached = _checksums.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    checksum = digest.hexdigest()
+    _checksums[path] = (stat.st_mtime_ns, stat.st_size, checksum)
+    return checksum
+
+
+def warm_up(model, size=640):
+    """
+    Run a single inference pass on a blank image so lazy initialisation
+    (weight fusing, allocator growth, kernel selection) happens before the first job.
+    """
+    import numpy as np
+
+    dummy = np.zeros((size, size, 3), dtype=np.uint8)
+    model(dummy, verbose=False)
+
+
+def get_model(model_path, warmup=False, warmup_size=640, threads=0):
+    """
+    Return a resident model for ``model_path``, loading it on first use.
+
+    Models are keyed by path and checksum: when the file on disk is replaced,
+    the next call loads the new weights and drops the stale entry. ``.onnx``
+    files run on ONNX Runtime, anything else is loaded with ultralytics.
+
+    Args:
+        model_path (str): Path to the YOLO weights or their ONNX export
+        warmup (bool): Run a dummy inference after loading a new model
+        warmup_size (int): Side length of the dummy warm-up image
+        threads (int): Intra-op threads of an ONNX Runtime session, 0 for the process default
+
+    Returns:
+        YOLO or OnnxSegmentationModel: The loaded model
+    """
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found at {model_path}")
+
+    path = os.path.abspath(model_path)
+    key = (path, model_checksum(path))
+
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            return model
+
+        print(f"Loading model {path} (sha256 {key[1][:12]})")
+        # Imported here so processes that only hash model files don't load torch
+        if path.endswith('.onnx'):
+            from utils.onnx_backend import OnnxSegmentationModel
+            model = OnnxSegmentationModel(path, threads=threads)
+        else:
+            from ultralytics import YOLO
+            model = YOLO(path)
+        if warmup:
+            warm_up(model, warmup_size)
+
+        for stale in [k for k in _models if k[0] == path]:
+            del _models[stale]
+        _models[key] = model
+
+    return model
+
+
+def clear():
+    """Drop every cached model."""
+    with _lock:
+        _models.clear()
+        _checksums.clear()
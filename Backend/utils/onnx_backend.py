@@ -0,0 +1,200 @@
+import os
+import types
+import numpy as np
+import cv2
+
+# Grey used by ultralytics to pad letterboxed inputs
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+def letterbox(image, size):
+    """
+    Scale ``image`` to fit a ``size`` x ``size`` square and pad it evenly, as ultralytics does.
+
+    Returns:
+        tuple: (padded image, scale, (left, top) padding)
+    """
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    new_w, new_h = max(1, round(width * scale)), max(1, round(height * scale))
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    left, top = (size - new_w) // 2, (size - new_h) // 2
+    padded = cv2.copyMakeBorder(image, top, size - new_h - top, left, size - new_w - left,
+                                cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return padded, scale, (left, top)
+
+
+def to_blob(images):
+    """Stack letterboxed BGR images into the float32 NCHW RGB tensor the exported model expects"""
+    return cv2.dnn.blobFromImages(images, scalefactor=1 / 255.0, swapRB=True)
+
+
+class OnnxSegmentationModel:
+    """
+    A YOLO segmentation model exported to ONNX, run with ONNX Runtime.
+
+    Called like ``ultralytics.YOLO`` (``model(images, conf=..., retina_masks=...)``) and
+    returns one result per image with ``masks.data`` and ``boxes.conf``/``xyxy``/``cls``,
+    so the rest of the pipeline does not know which backend produced them.
+    Non-maximum suppression and mask assembly follow ultralytics' defaults.
+    """
+
+    def __init__(self, path, threads=0, iou_threshold=0.7, max_det=300):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # ONNX Runtime ignores OMP_NUM_THREADS, so honour the worker's per-process limit explicitly
+        threads = threads or int(os.environ.get('OMP_NUM_THREADS', 0))
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+
+        shape = self.session.get_inputs()[0].shape
+        imgsz = shape[2] if isinstance(shape[2], int) else 640
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if 'imgsz' in metadata:
+            imgsz = max(int(v) for v in metadata['imgsz'].strip('[]').split(','))
+        self.overrides = {'imgsz': imgsz}
+
+    def __call__(self, images, conf=0.25, imgsz=None, retina_masks=False, **kwargs):
+        images = images if isinstance(images, list) else [images]
+        size = imgsz or self.overrides['imgsz']
+        boxed = [letterbox(image, size) for image in images]
+        predictions, protos = self.session.run(None, {self.input_name: to_blob([b[0] for b in boxed])})[:2]
+        return [self._postprocess(pred, proto, image.shape[:2], size, scale, pad, conf, retina_masks)
+                for pred, proto, image, (_, scale, pad) in zip(predictions, protos, images, boxed)]
+
+    def _postprocess(self, pred, proto, image_shape, size, scale, pad, conf, retina_masks):
+        # (4 box + classes + mask coefficients, anchors) -> one row per anchor
+        pred = pred.T
+        num_coeffs = proto.shape[0]
+        scores = pred[:, 4:-num_coeffs]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences > conf
+        pred, classes, confidences = pred[keep], classes[keep], confidences[keep]
+
+        cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+        xywh = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+        indices = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confidences.tolist(), classes.tolist(),
+                                          conf, self.iou_threshold, top_k=self.max_det)
+        indices = np.asarray(indices, dtype=int).reshape(-1)[:self.max_det]
+        if not len(indices):
+            return types.SimpleNamespace(orig_shape=image_shape, masks=None, boxes=None)
+        pred, classes, confidences, xywh = pred[indices], classes[indices], confidences[indices], xywh[indices]
+
+        # Boxes in original-image pixels
+        left, top = pad
+        xyxy = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+        xyxy = (xyxy - [left, top, left, top]) / scale
+        height, width = image_shape
+        xyxy = np.clip(xyxy, 0, [width, height, width, height])
+
+        # Masks over the unpadded image: full resolution for retina masks, model resolution otherwise
+        content = (max(1, round(width * scale)), max(1, round(height * scale)))
+        target = (width, height) if retina_masks else content
+        ratio = proto.shape[1] / size
+        proto = proto[:, round(top * ratio):round((top + content[1]) * ratio),
+                      round(left * ratio):round((left + content[0]) * ratio)]
+
+        coeffs = pred[:, -num_coeffs:]
+        logits = (coeffs @ proto.reshape(num_coeffs, -1)).reshape(-1, *proto.shape[1:])
+        masks = np.empty((len(logits), target[1], target[0]), dtype=np.float32)
+        box_scale = target[0] / width
+        for i, logit in enumerate(logits):
+            upsampled = cv2.resize(logit, target, interpolation=cv2.INTER_LINEAR)
+            mask = np.zeros(upsampled.shape, dtype=np.float32)
+            bx0, by0, bx1, by1 = np.round(xyxy[i] * box_scale).astype(int)
+            # sigmoid(x) > 0.5 <=> x > 0
+            mask[by0:by1, bx0:bx1] = upsampled[by0:by1, bx0:bx1] > 0
+            masks[i] = mask
+
+        return types.SimpleNamespace(
+            orig_shape=image_shape,
+            masks=types.SimpleNamespace(data=masks),
+            boxes=types.SimpleNamespace(conf=confidences.astype(np.float32), cls=classes.astype(np.float32),
+                                        xyxy=xyxy.astype(np.float32)),
+        )
+
+
+def export_onnx(model_path, onnx_path=None, imgsz=640):
+    """
+    Export YOLO weights to ONNX with dynamic batch and image sizes.
+
+    Returns:
+        str: Path of the exported model
+    """
+    from ultralytics import YOLO
+
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if onnx_path and os.path.abspath(exported) != os.path.abspath(onnx_path):
+        os.replace(exported, onnx_path)
+        exported = onnx_path
+    return str(exported)
+
+
+class CalibrationReader:
+    """Feeds sample screenshots, preprocessed exactly like production inputs, to the INT8 calibrator"""
+
+    def __init__(self, input_name, image_paths, imgsz, preprocess):
+        self.input_name = input_name
+        self.image_paths = list(image_paths)
+        self.imgsz = imgsz
+        self.preprocess = preprocess
+
+    def get_next(self):
+        while self.image_paths:
+            image = cv2.imread(self.image_paths.pop(0))
+            if image is None:
+                continue
+            padded, _, _ = letterbox(self.preprocess(image), self.imgsz)
+            return {self.input_name: to_blob([padded])}
+        return None
+
+
+def quantize_int8(onnx_path, calibration_paths, output_path, imgsz=640, preprocess=None):
+    """
+    Statically quantize an exported model to INT8 (QDQ, per-channel weights).
+
+    Only convolutions and matrix products are quantized; the detection head's
+    concatenation and activations stay in float, which keeps box and mask
+    coefficients accurate.
+
+    Args:
+        calibration_paths (list): Sample screenshots representative of production uploads
+        preprocess (callable, optional): Applied to each calibration image before letterboxing
+
+    Returns:
+        str: ``output_path``
+    """
+    import onnxruntime
+    from onnxruntime.quantization import (quantize_static, QuantFormat, QuantType, CalibrationMethod)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if not calibration_paths:
+        raise ValueError("INT8 quantization needs at least one calibration image")
+
+    prepared_path = os.path.splitext(output_path)[0] + '.prep.onnx'
+    quant_pre_process(onnx_path, prepared_path)
+    input_name = onnxruntime.InferenceSession(prepared_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    try:
+        quantize_static(
+            prepared_path,
+            output_path,
+            CalibrationReader(input_name, calibration_paths, imgsz, preprocess or (lambda image: image)),
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=['Conv', 'MatMul'],
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    finally:
+        os.remove(prepared_path)
+    return output_path
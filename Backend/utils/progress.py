@@ -0,0 +1,181 @@
+import json
+import time
+import redis
+
+# Stages a job goes through, in order; 'error' can replace any of the later ones
+STAGES = ('queued', 'preprocessing', 'inference', 'rendering', 'done')
+FINAL_STAGES = ('done', 'error')
+
+
+def channel(job_id):
+    """Pub/sub channel carrying a job's stage transitions"""
+    return f"job_events:{job_id}"
+
+
+def stage_key(job_id):
+    """Key holding a job's latest event, for clients that subscribe late"""
+    return f"job_stage:{job_id}"
+
+
+def publish_stage(redis_conn, job_id, stage, ttl=3600, **data):
+    """
+    Record and broadcast a stage transition.
+
+    Args:
+        redis_conn (Redis): Connection to publish on
+        job_id (str): Job identifier
+        stage (str): One of ``STAGES`` or ``'error'``
+        ttl (int): Seconds to keep the latest event
+        **data: Extra JSON-serialisable fields, e.g. the result on ``done``
+    """
+    event = json.dumps(dict(data, job_id=job_id, stage=stage, timestamp=time.time()))
+    pipe = redis_conn.pipeline()
+    pipe.setex(stage_key(job_id), ttl, event)
+    pipe.publish(channel(job_id), event)
+    pipe.execute()
+
+
+def latest_event(redis_conn, job_id):
+    """The most recent event of a job as a dict, or None"""
+    event = redis_conn.get(stage_key(job_id))
+    return json.loads(event) if event else None
+
+
+def result_event(job_id, result):
+    """
+    Final event rebuilt from a stored result, for a job whose stage event has
+    expired while its result was kept (e.g. refreshed by a cache hit).
+    """
+    if result.get('status') == 'error':
+        data = {'error': result.get('error')}
+        stage = 'error'
+    else:
+        data = {'result': result}
+        stage = 'done'
+    return dict(data, job_id=job_id, stage=stage, timestamp=time.time())
+
+
+def stream_events(redis_conn, job_id, heartbeat=15, max_duration=600, pubsub_conn=None, retry_ms=5000):
+    """
+    Yield Server-Sent Events for a job until it finishes.
+
+    The channel is subscribed before the stored state is read, so a transition
+    that happens in between is not lost. Comment lines are sent as keep-alives
+    while the job is waiting in the queue. The subscription uses ``pubsub_conn``
+    when given; if no connection is available there, the client is told to
+    reconnect after ``retry_ms``.
+    """
+    pubsub = (pubsub_conn or redis_conn).pubsub(ignore_subscribe_messages=True)
+    try:
+        try:
+            pubsub.subscribe(channel(job_id))
+        except redis.ConnectionError:
+            yield f"retry: {retry_ms}\n\n"
+            return
+
+        event = latest_event(redis_conn, job_id)
+        if event is not None:
+            yield f"data: {json.dumps(event)}\n\n"
+            if event['stage'] in FINAL_STAGES:
+                return
+
+        deadline = time.monotonic() + max_duration
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=heartbeat)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            data = message['data']
+            data = data.decode() if isinstance(data, bytes) else data
+            yield f"data: {data}\n\n"
+            if json.loads(data)['stage'] in FINAL_STAGES:
+                return
+    finally:
+        pubsub.close()
+
+
+def rooftops_key(job_id):
+    """Redis stream of a job's rooftop records, appended as they are measured"""
+    return f"job_rooftops:{job_id}"
+
+
+def append_rooftops(redis_conn, job_id, records, totals, ttl=3600, maxlen=None, chunk=50):
+    """
+    Append rooftop records to the job's stream, each with the running totals up to it.
+    They are sent ``chunk`` at a time, so clients see the first ones while the rest are
+    still being sent.
+
+    Args:
+        records (iterable): Per-rooftop dicts (``id``, ``area_m2``, ``energy_potential_kwh_per_year``, ...)
+        totals (dict): ``rooftops``, ``area_m2`` and ``energy_potential_kwh_per_year`` so far,
+            updated in place
+        maxlen (int, optional): Approximate cap on the stream length; the oldest records go first
+
+    Returns:
+        int: Number of records appended
+    """
+    key = rooftops_key(job_id)
+    pipe = redis_conn.pipeline(transaction=False)
+    appended = 0
+    for record in records:
+        totals['rooftops'] = totals.get('rooftops', 0) + 1
+        totals['area_m2'] = totals.get('area_m2', 0.0) + record['area_m2']
+        totals['energy_potential_kwh_per_year'] = (totals.get('energy_potential_kwh_per_year', 0.0)
+                                                   + record['energy_potential_kwh_per_year'])
+        pipe.xadd(key, {'rooftop': json.dumps(record), 'totals': json.dumps(totals)},
+                  maxlen=maxlen, approximate=True)
+        appended += 1
+        if appended % chunk == 0:
+            pipe.expire(key, ttl)
+            pipe.execute()
+    if len(pipe):
+        pipe.expire(key, ttl)
+        pipe.execute()
+    return appended
+
+
+def finish_rooftops(redis_conn, job_id, totals, ttl=3600, status='completed'):
+    """Mark the job's rooftop stream complete; readers stop polling once they see this entry"""
+    key = rooftops_key(job_id)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.xadd(key, {'end': status, 'totals': json.dumps(totals)})
+    pipe.expire(key, ttl)
+    pipe.execute()
+
+
+def read_rooftops(redis_conn, job_id, after=None, count=500):
+    """
+    Rooftop records of a job appended after the entry ``after``.
+
+    Returns:
+        dict: ``rooftops`` (up to ``count`` records), ``totals`` as of the last one,
+            ``cursor`` (pass back as ``after`` to continue), ``complete`` (True once the
+            job has finished and every record has been read) and ``status``; None if the
+            job has no stream
+    """
+    key = rooftops_key(job_id)
+    entries = redis_conn.xread({key: after or '0-0'}, count=count)
+    entries = entries[0][1] if entries else []
+    if not entries:
+        # Nothing new: report the state as of the newest entry
+        entries = redis_conn.xrevrange(key, count=1)
+        if not entries:
+            return None
+        newest = entries[0][1]
+        return {
+            'rooftops': [],
+            'totals': json.loads(newest[b'totals']),
+            'cursor': after or entries[0][0].decode(),
+            'complete': b'end' in newest,
+            'status': newest[b'end'].decode() if b'end' in newest else 'processing',
+        }
+
+    rooftops = [json.loads(fields[b'rooftop']) for _, fields in entries if b'rooftop' in fields]
+    last = entries[-1][1]
+    return {
+        'rooftops': rooftops,
+        'totals': json.loads(last[b'totals']),
+        'cursor': entries[-1][0].decode(),
+        'complete': b'end' in last,
+        'status': last[b'end'].decode() if b'end' in last else 'processing',
+    }
@@ -0,0 +1,32 @@
+import redis
+from utils import config
+
+_clients = {}
+
+
+def get_redis(url=None, pubsub=False):
+    """
+    The process's shared Redis client for ``url`` (``config.REDIS_URL`` by default).
+
+    Every module uses the same client, so connections are pooled instead of each
+    module holding its own. The pool blocks for up to ``config.REDIS_POOL_TIMEOUT``
+    seconds when all ``config.REDIS_MAX_CONNECTIONS`` are in use rather than failing.
+    redis-py replaces the pool's connections after a fork, so worker processes never
+    share a socket with their parent.
+
+    With ``pubsub`` the client draws on a separate pool of
+    ``config.REDIS_PUBSUB_MAX_CONNECTIONS``, for long-lived subscriptions.
+    """
+    url = url or config.REDIS_URL
+    client = _clients.get((url, pubsub))
+    if client is None:
+        pool = redis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=config.REDIS_PUBSUB_MAX_CONNECTIONS if pubsub else config.REDIS_MAX_CONNECTIONS,
+            timeout=config.REDIS_POOL_TIMEOUT,
+            socket_connect_timeout=config.REDIS_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=config.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        client = _clients[(url, pubsub)] = redis.Redis(connection_pool=pool)
+    return client
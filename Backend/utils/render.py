@@ -0,0 +1,293 @@
+import numpy as np
+import cv2
+from utils.artifacts import get_store, artifact_key
+
+# Output formats for the result image: name -> (file extension, mimetype)
+OUTPUT_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+DEFAULT_QUALITY = 90
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def _rooftop_palette(count=100, seed=42):
+    """Generate ``count`` saturated RGB colours (0-1 floats) for rooftop overlays."""
+    rng = np.random.RandomState(seed)
+    colors = []
+    for _ in range(count):
+        h = rng.uniform(0, 1)
+        s = rng.uniform(0.7, 1.0)
+        v = rng.uniform(0.6, 1.0)
+
+        h_i = int(h * 6)
+        f = h * 6 - h_i
+        p = v * (1 - s)
+        q = v * (1 - f * s)
+        t = v * (1 - (1 - f) * s)
+
+        if h_i == 0:
+            r, g, b = v, t, p
+        elif h_i == 1:
+            r, g, b = q, v, p
+        elif h_i == 2:
+            r, g, b = p, v, t
+        elif h_i == 3:
+            r, g, b = p, q, v
+        elif h_i == 4:
+            r, g, b = t, p, v
+        else:
+            r, g, b = v, p, q
+
+        colors.append((r, g, b))
+    return colors
+
+
+ROOFTOP_COLORS = _rooftop_palette()
+
+
+def _bgr(color):
+    r, g, b = color
+    return (int(b * 255), int(g * 255), int(r * 255))
+
+
+def normalize_format(fmt):
+    """Map a user supplied format name to a key of ``OUTPUT_FORMATS``, or None if unsupported."""
+    fmt = (fmt or 'png').strip().lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    return fmt if fmt in OUTPUT_FORMATS else None
+
+
+def nearest_index(dst_size, src_size):
+    """
+    Source index sampled by each destination pixel of a ``cv2.INTER_NEAREST`` resize,
+    computed the way OpenCV does so results match a real resize exactly.
+    """
+    scale = 1.0 / (dst_size / src_size)
+    return np.minimum(np.floor(np.arange(dst_size) * scale).astype(np.intp), src_size - 1)
+
+
+def rooftop_crops(labels, rooftops, width, height):
+    """
+    Yield ``(rooftop, (x0, y0, x1, y1), mask)`` with each rooftop's full-resolution
+    mask built only inside its bounding box.
+
+    ``labels`` may be at model resolution; it is sampled as a nearest-neighbour
+    resize to ``width`` x ``height`` would, without materialising that resize.
+    """
+    map_y = nearest_index(height, labels.shape[0])
+    map_x = nearest_index(width, labels.shape[1])
+    for rooftop in rooftops:
+        bbox = rooftop.get('bbox')
+        if not bbox or rooftop['area_pixels'] <= 0:
+            continue
+        x0, y0, x1, y1 = bbox
+        yield rooftop, (x0, y0, x1, y1), labels[np.ix_(map_y[y0:y1], map_x[x0:x1])] == rooftop['id']
+
+
+def composite_overlay(original_image, labels, rooftops, color_opacity=0.7, display_original=True):
+    """
+    Colour every rooftop's pixels, touching only the pixels inside each bounding box.
+
+    Args:
+        original_image (numpy.ndarray): BGR image
+        labels (numpy.ndarray): Label map at full or model resolution, 0 = background
+        rooftops (list): Rooftop records with ``id`` and ``bbox``
+        color_opacity (float): Opacity of color overlays (0.0-1.0)
+        display_original (bool): Whether to show masks on original image or just masks
+
+    Returns:
+        numpy.ndarray: BGR uint8 image
+    """
+    height, width = original_image.shape[:2]
+    output = original_image.copy() if display_original else np.full_like(original_image, 255)
+    colors = np.array([_bgr(c) for c in ROOFTOP_COLORS], dtype=np.float32) * color_opacity
+
+    for rooftop, (x0, y0, x1, y1), mask in rooftop_crops(labels, rooftops, width, height):
+        color = colors[(rooftop['id'] - 1) % len(colors)]
+        region = output[y0:y1, x0:x1]
+        if display_original:
+            blended = region[mask] * (1 - color_opacity) + color * color_opacity
+        else:
+            blended = np.broadcast_to(color, (int(mask.sum()), 3))
+        region[mask] = np.clip(blended, 0, 255).astype(np.uint8)
+    return output
+
+
+def _draw_labels(image, rooftops, scale):
+    thickness = max(1, int(round(2 * scale)))
+    pad = max(2, int(round(5 * scale)))
+    for rooftop in rooftops:
+        centroid = rooftop.get('centroid')
+        if not centroid or rooftop['area_pixels'] <= 0:
+            continue
+        center_x, center_y = int(centroid[0]), int(centroid[1])
+        text = str(rooftop['id'])
+        (text_w, text_h), _ = cv2.getTextSize(text, FONT, scale, thickness)
+
+        cv2.rectangle(image,
+                      (center_x - text_w // 2 - pad, center_y - text_h // 2 - pad),
+                      (center_x + text_w // 2 + pad, center_y + text_h // 2 + pad),
+                      (255, 255, 255), -1)
+        cv2.putText(image, text, (center_x - text_w // 2, center_y + text_h // 2),
+                    FONT, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+
+
+def _legend_panel(height, rooftops, total_coverage, total_energy, scale):
+    thickness = max(1, int(round(scale * 1.5)))
+    line_h = int(32 * scale)
+    margin = int(16 * scale)
+    swatch = int(20 * scale)
+
+    title = 'Rooftop Coverage & Solar Potential'
+    entries = [(ROOFTOP_COLORS[(r['id'] - 1) % len(ROOFTOP_COLORS)],
+                f"Rooftop {r['id']}: {r['percentage']:.2f}% - {r['area_m2']:.2f}m2") for r in rooftops]
+    footer = [f"Total Coverage: {total_coverage:.2f}%",
+              f"Total Energy Potential: {total_energy:.2f} kWh/year"]
+
+    widest = max([cv2.getTextSize(t, FONT, scale, thickness)[0][0] for t in [title] + footer] +
+                 [cv2.getTextSize(t, FONT, scale, thickness)[0][0] + swatch + margin for _, t in entries])
+    column_w = widest + 2 * margin
+
+    # Entries wrap into further columns when the image is too short for one
+    header_h = margin + line_h * 2
+    footer_h = line_h * len(footer) + margin
+    rows = max(1, (height - header_h - footer_h) // line_h)
+    columns = max(1, -(-len(entries) // rows))
+    panel = np.full((height, column_w * columns, 3), 255, dtype=np.uint8)
+
+    cv2.putText(panel, title, (margin, margin + line_h), FONT, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+    for index, (color, text) in enumerate(entries):
+        x = margin + (index // rows) * column_w
+        y = header_h + (index % rows) * line_h
+        cv2.rectangle(panel, (x, y), (x + swatch, y + swatch), _bgr(color), -1)
+        cv2.rectangle(panel, (x, y), (x + swatch, y + swatch), (0, 0, 0), 1)
+        cv2.putText(panel, text, (x + swatch + margin // 2, y + swatch - max(1, swatch // 8)),
+                    FONT, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+
+    for index, text in enumerate(footer):
+        y = height - footer_h + (index + 1) * line_h - margin // 2
+        cv2.putText(panel, text, (margin, y), FONT, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+    return panel
+
+
+def render_result(original_image, labels, analysis, color_opacity=0.7, display_original=True):
+    """
+    Draw the detection overlay, rooftop labels and a legend panel at the image's native resolution.
+
+    Args:
+        original_image (numpy.ndarray): BGR image the analysis was run on
+        labels (numpy.ndarray): Label map (rooftop id per pixel, 0 = background) at full or model resolution
+        analysis (dict): Detection result with ``rooftops`` and totals
+        color_opacity (float): Opacity of color overlays (0.0-1.0)
+        display_original (bool): Whether to show masks on original image or just masks
+
+    Returns:
+        numpy.ndarray: BGR uint8 image, the overlay with the legend panel on its right
+    """
+    height = original_image.shape[0]
+    scale = max(0.5, min(2.0, height / 1200))
+    rooftops = analysis['rooftops']
+
+    image = composite_overlay(original_image, labels, rooftops, color_opacity, display_original)
+    _draw_labels(image, rooftops, scale)
+
+    if not rooftops:
+        text = 'No rooftops detected'
+        thickness = max(1, int(round(2 * scale)))
+        (text_w, text_h), _ = cv2.getTextSize(text, FONT, scale * 1.4, thickness)
+        x, y = (image.shape[1] - text_w) // 2, (height + text_h) // 2
+        cv2.rectangle(image, (x - 10, y - text_h - 10), (x + text_w + 10, y + 10), (255, 255, 255), -1)
+        cv2.putText(image, text, (x, y), FONT, scale * 1.4, (0, 0, 0), thickness, cv2.LINE_AA)
+
+    panel = _legend_panel(height, rooftops, analysis['total_coverage_percentage'],
+                          analysis['total_energy_potential'], scale)
+    return np.hstack([image, panel])
+
+
+def encode_image(image, fmt='png', quality=None):
+    """
+    Encode a BGR image as PNG, JPEG or WebP.
+
+    Args:
+        image (numpy.ndarray): BGR uint8 image
+        fmt (str): One of ``OUTPUT_FORMATS``
+        quality (int, optional): 1-100 for JPEG/WebP; ignored for PNG, which is lossless
+
+    Returns:
+        bytes: The encoded image
+    """
+    if fmt == 'png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    elif fmt == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality or DEFAULT_QUALITY)]
+    elif fmt == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality or DEFAULT_QUALITY)]
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
+
+    ok, buffer = cv2.imencode(OUTPUT_FORMATS[fmt][0], image, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt}")
+    return buffer.tobytes()
+
+
+def _load_artifact(store, key, flags=cv2.IMREAD_COLOR):
+    image = cv2.imdecode(np.frombuffer(store.get(key), dtype=np.uint8), flags)
+    if image is None:
+        raise FileNotFoundError(f"Artifact {key} is not a readable image")
+    return image
+
+
+def ensure_rendered(job_id, result, fmt='png', quality=None, store=None, load_result=None):
+    """
+    Return the artifact key of the job's result image in the requested format, rendering it on first use.
+
+    The lossless PNG rendering is produced once from the stored label map and source
+    image; other formats and qualities are encoded from it and stored next to it.
+
+    Args:
+        job_id (str): Job identifier
+        result (dict): Stored job result
+        fmt (str): One of ``OUTPUT_FORMATS``
+        quality (int, optional): 1-100 for JPEG/WebP
+        store (optional): Artifact store, the configured one by default
+        load_result (callable, optional): Returns the full result when ``result`` holds only
+            some of its fields and the image has to be drawn
+
+    Returns:
+        str: Artifact key of the encoded image
+    """
+    store = store or get_store()
+    artifacts = result.get('artifacts', {})
+    master_key = artifacts.get('image') or artifact_key(job_id, 'rooftop_detection_result.png')
+
+    image = None
+    if not store.exists(master_key):
+        if 'source' not in artifacts or 'labels' not in artifacts:
+            raise FileNotFoundError("Result image was not rendered for this job")
+
+        if 'rooftops' not in result and load_result is not None:
+            result = load_result()
+        if result.get('scale', 1) != 1:
+            # Rooftop positions are stored in uploaded pixels, the source is the decoded image
+            from utils.detect import scale_rooftops
+            result = dict(result, rooftops=scale_rooftops(result['rooftops'], 1 / result['scale'], widen=True))
+        source = _load_artifact(store, artifacts['source'])
+        labels = _load_artifact(store, artifacts['labels'], cv2.IMREAD_UNCHANGED)
+        image = render_result(source, labels, result, result.get('color_opacity', 0.7))
+        store.put(master_key, encode_image(image, 'png'), OUTPUT_FORMATS['png'][1])
+
+    if fmt == 'png':
+        return master_key
+
+    quality = int(quality or DEFAULT_QUALITY)
+    variant_key = artifact_key(job_id, f"rooftop_detection_result_q{quality}{OUTPUT_FORMATS[fmt][0]}")
+    if not store.exists(variant_key):
+        if image is None:
+            image = _load_artifact(store, master_key)
+        store.put(variant_key, encode_image(image, fmt, quality), OUTPUT_FORMATS[fmt][1])
+    return variant_key
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import time
+
+CACHE_PREFIX = 'result_cache:'
+INDEX_KEY = 'result_cache:index'
+
+
+def cache_key(image_bytes, model_checksum, params):
+    """
+    Content address of an analysis: the image bytes, the model weights and the
+    parameters that influence the result.
+
+    Args:
+        image_bytes (bytes): The uploaded file, exactly as received
+        model_checksum (str): SHA-256 of the model weights
+        params (dict): JSON-serialisable analysis parameters
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    digest.update(model_checksum.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def claim(redis_conn, digest, job_id, ttl, max_entries):
+    """
+    Register ``job_id`` as the job producing ``digest``, unless another job already is.
+
+    The claim is an atomic ``SET NX``, so concurrent identical uploads all end up
+    with the same job.
+
+    Returns:
+        str: ``job_id`` if the claim succeeded, otherwise the job that owns the digest
+    """
+    key = CACHE_PREFIX + digest
+    for _ in range(2):
+        if redis_conn.set(key, job_id, nx=True, ex=ttl):
+            _index(redis_conn, digest, ttl, max_entries)
+            return job_id
+        owner = redis_conn.get(key)
+        if owner is not None:
+            return owner.decode()
+        # The entry expired between SET and GET; try once more
+    return job_id
+
+
+def release(redis_conn, digest, job_id):
+    """Forget ``digest`` if it still points at ``job_id`` (e.g. the job failed)."""
+    key = CACHE_PREFIX + digest
+    owner = redis_conn.get(key)
+    if owner is not None and owner.decode() == job_id:
+        pipe = redis_conn.pipeline()
+        pipe.delete(key)
+        pipe.zrem(INDEX_KEY, digest)
+        pipe.execute()
+
+
+def touch(redis_conn, digest, ttl, max_entries):
+    """Refresh a hit so recently used entries are the last to be evicted."""
+    redis_conn.expire(CACHE_PREFIX + digest, ttl)
+    _index(redis_conn, digest, ttl, max_entries)
+
+
+def _index(redis_conn, digest, ttl, max_entries):
+    # Sorted by last use; entries past their TTL are dropped and the least
+    # recently used ones are evicted once the cache holds more than max_entries.
+    now = time.time()
+    pipe = redis_conn.pipeline()
+    pipe.zadd(INDEX_KEY, {digest: now})
+    pipe.zremrangebyscore(INDEX_KEY, '-inf', now - ttl)
+    pipe.zcard(INDEX_KEY)
+    size = pipe.execute()[-1]
+
+    if size > max_entries:
+        evicted = redis_conn.zpopmin(INDEX_KEY, size - max_entries)
+        if evicted:
+            redis_conn.delete(*[CACHE_PREFIX + member.decode() for member, _ in evicted])
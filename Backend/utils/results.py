@@ -0,0 +1,119 @@
+import json
+import zlib
+from redis.exceptions import ResponseError
+from utils import config
+
+# Job results are Redis hashes: every top-level field is stored on its own (JSON-encoded),
+# so routes that need the status or an artifact key never deserialise the rooftop list.
+# The rooftop list is stored as 'rooftops', encoded as 'rooftops_encoding' says.
+ROOFTOPS_FIELD = 'rooftops'
+ENCODING_FIELD = 'rooftops_encoding'
+
+
+def result_key(job_id):
+    """Hash holding a finished job's result"""
+    return f"job_result:{job_id}"
+
+
+def encode_rooftops(rooftops):
+    """
+    Encode a rooftop list for storage.
+
+    Returns:
+        tuple: (bytes, encoding), the encoding being 'json', 'msgpack+zlib' or 'json+zlib'
+    """
+    limit = config.RESULT_COMPACT_ROOFTOPS
+    if not limit or len(rooftops) < limit:
+        return json.dumps(rooftops, separators=(',', ':')).encode(), 'json'
+    try:
+        import msgpack
+    except ImportError:
+        return zlib.compress(json.dumps(rooftops, separators=(',', ':')).encode(), 6), 'json+zlib'
+    return zlib.compress(msgpack.packb(rooftops), 6), 'msgpack+zlib'
+
+
+def decode_rooftops(data, encoding):
+    """Inverse of :func:`encode_rooftops`"""
+    encoding = encoding.decode() if isinstance(encoding, bytes) else encoding or 'json'
+    if encoding.endswith('+zlib'):
+        data = zlib.decompress(data)
+    if encoding.startswith('msgpack'):
+        import msgpack
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+def write_result(pipe, job_id, result, ttl):
+    """
+    Queue the commands replacing a job's result on ``pipe``.
+
+    Args:
+        pipe: Redis pipeline the commands are added to; run it to store the result
+        result (dict): The result; ``rooftop_count`` is added when it has rooftops
+        ttl (int): Seconds to keep it
+    """
+    key = result_key(job_id)
+    mapping = {name: json.dumps(value) for name, value in result.items() if name != ROOFTOPS_FIELD}
+    if ROOFTOPS_FIELD in result:
+        mapping[ROOFTOPS_FIELD], mapping[ENCODING_FIELD] = encode_rooftops(result[ROOFTOPS_FIELD])
+        mapping.setdefault('rooftop_count', json.dumps(len(result[ROOFTOPS_FIELD])))
+    pipe.delete(key)
+    pipe.hset(key, mapping=mapping)
+    pipe.expire(key, ttl)
+
+
+def queue_read(pipe, job_id, fields=None):
+    """
+    Queue the read of a job's result on ``pipe``, for :func:`parse_result`.
+
+    Args:
+        fields (tuple, optional): Fields to read; all of them by default
+    """
+    if fields is None:
+        pipe.hgetall(result_key(job_id))
+    else:
+        fields = list(fields) + ([ENCODING_FIELD] if ROOFTOPS_FIELD in fields else [])
+        pipe.hmget(result_key(job_id), fields)
+
+
+def parse_result(reply, fields=None):
+    """
+    The result dict from the reply to :func:`queue_read` with the same ``fields``, or None if there is none.
+
+    Results written as plain strings by older versions read as missing.
+    """
+    if isinstance(reply, ResponseError):
+        return None
+    if fields is not None:
+        names = list(fields) + ([ENCODING_FIELD] if ROOFTOPS_FIELD in fields else [])
+        reply = {name.encode(): value for name, value in zip(names, reply) if value is not None}
+    if not reply:
+        return None
+
+    result = {}
+    for name, value in reply.items():
+        name = name.decode()
+        if name == ROOFTOPS_FIELD:
+            result[name] = decode_rooftops(value, reply.get(ENCODING_FIELD.encode()))
+        elif name != ENCODING_FIELD:
+            result[name] = json.loads(value)
+    return result
+
+
+def read_result(redis_conn, job_id, fields=None, with_ttl=False):
+    """
+    Read a job's result, or only some of its fields, in one round trip.
+
+    Returns:
+        dict: The result, or None if there is none; ``(result, ttl)`` when ``with_ttl``
+            is set, ``ttl`` being the seconds the result has left
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    queue_read(pipe, job_id, fields)
+    if with_ttl:
+        pipe.ttl(result_key(job_id))
+    replies = pipe.execute(raise_on_error=False)
+    result = parse_result(replies[0], fields)
+    if with_ttl:
+        return result, max(0, replies[1]) if isinstance(replies[1], int) else 0
+    return result
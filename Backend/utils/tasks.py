@@ -1,87 +1,403 @@
 import os
 import json
+import itertools
+import tempfile
 import cv2
-from redis import Redis
-from utils.detect import detect_rooftops_with_solar_potential
+import numpy as np
+from rq import get_current_job
+from utils.detect import (decode_image, prepare_image, preprocess_size, run_inference, run_tiled_inference,
+                          compact_predictions, analyze_predictions, format_report, rooftop_records,
+                          scale_rooftops)
+from utils.model_registry import get_model
+from utils.render import render_result, encode_image
+from utils.geometry import rooftops_geojson, rooftop_features, encode_geojson, GeoJsonWriter
+from utils.artifacts import get_store, artifact_key, collect_garbage_periodically
+from utils.tile_source import open_tile_source, count_windows, bounds_gsd
+from utils import config, metrics
+from utils.results import write_result
+from utils.redis_client import get_redis
+from utils.image_header import read_image_header, EXTENSIONS
+from utils.progress import publish_stage, append_rooftops, finish_rooftops
+from utils.batch_jobs import record_child
+from utils.jobs import input_key, predictions_key, lane_of
 
 # Initialize Redis connection
-redis_conn = Redis(host='localhost', port=6379, db=0)
+redis_conn = get_redis()
 
-def process_image(image_path, job_id):
+COLOR_OPACITY = 0.7
+
+
+def current_lane():
+    """Lane of the RQ job being performed, or None outside a worker"""
+    job = get_current_job()
+    return lane_of(job.origin) if job else None
+
+
+def load_upload(image_key, filename=None, timings=None):
+    """
+    Fetch an uploaded image from Redis and decode it once
+    
+    Returns:
+        dict: ``key``, ``data`` (encoded bytes), ``filename``, ``image`` (BGR), ``scale``
+            (original width / decoded width, > 1 when an oversized upload was shrunk)
+            and ``timings`` (seconds per stage, filled in as the job progresses)
+    """
+    timings = {} if timings is None else timings
+    with metrics.timed(timings, 'decode'):
+        data = redis_conn.get(image_key)
+        if data is None:
+            raise FileNotFoundError("Uploaded image expired before it was processed")
+        image, scale = decode_image(data, config.MAX_IMAGE_PIXELS)
+    
+    if scale != 1:
+        print(f"Downscaled oversized upload by {scale:.2f}x while decoding")
+    return {'key': image_key, 'data': data, 'filename': filename or image_key, 'image': image, 'scale': scale,
+            'timings': timings}
+
+
+def process_image(image_key, job_id, render='lazy', tiled=False, filename=None, batch_id=None, bounds=None):
     """
     Worker function that processes the image and stores results
+    
+    ``bounds`` (west, south, east, north in degrees), when known, georeferences the rooftop outlines.
     """
+    timings = {}
     try:
-        print(f"Starting to process image: {image_path} for job: {job_id}")
+        print(f"Starting to process image: {filename or image_key} for job: {job_id}")
+        
+        # Borrow the resident model (reloaded only if the weights changed)
+        with metrics.timed(timings, 'model_load'):
+            model = get_model(config.INFERENCE_MODEL_PATH, threads=config.ONNX_THREADS)
         
-        # Check if model file exists
-        model_path = 'best.pt'
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model file not found at {model_path}")
+        print(f"Model ready, beginning detection")
         
-        print(f"Model file found, beginning detection")
+        publish_stage(redis_conn, job_id, 'preprocessing', config.RESULT_TTL)
+        upload = load_upload(image_key, filename, timings)
+        upload['bounds'] = bounds
+        upload['lane'] = current_lane()
         
-        results = detect_rooftops_with_solar_potential(
-            image_path, 
-            model_path,
-            conf_threshold=0.5,
-            color_opacity=0.7
-        )
+        if tiled:
+            # Tiles are cut from the decoded image and batched inside the inference stage.
+            # Tiles are merged at the job threshold: low-confidence masks would change the merge.
+            publish_stage(redis_conn, job_id, 'inference', config.RESULT_TTL)
+            with metrics.timed(timings, 'inference'):
+                result = run_tiled_inference(
+                    model,
+                    upload['image'],
+                    conf_threshold=config.CONF_THRESHOLD,
+                    tile_size=config.TILE_SIZE or None,
+                    overlap=config.TILE_OVERLAP,
+                    batch_size=config.TILE_BATCH_SIZE,
+                    iou_threshold=config.TILE_IOU_THRESHOLD
+                )
+        else:
+            with metrics.timed(timings, 'preprocess'):
+                processed_image = prepare_image(upload['image'], preprocess_size(model, config.PREPROCESS_MODE))
+            publish_stage(redis_conn, job_id, 'inference', config.RESULT_TTL)
+            with metrics.timed(timings, 'inference'):
+                result = run_inference(model, [processed_image], conf_threshold=config.BASE_CONF_THRESHOLD)[0]
         
         print(f"Detection completed, saving results")
+        return finish_job(upload, job_id, result, render, batch_id, tiled)
+        
+    except Exception as e:
+        return store_error(image_key, job_id, e, batch_id, timings, current_lane())
+
+
+def finish_job(upload, job_id, result, render='lazy', batch_id=None, tiled=False):
+    """
+    Post-process one image's model output and store everything for the job.
+
+    The rooftops are measured together, then streamed to the job's record stream in chunks,
+    so clients can show them while the outlines, report and image are still being made.
+
+    Rooftop centroids and boxes are published in the pixels of the image as uploaded,
+    like the outlines, even when it was shrunk for decoding.
+    """
+    height, width = upload['image'].shape[:2]
+    if upload.get('bounds'):
+        # Georeferenced uploads are measured at their own latitude and scale
+        gsd = bounds_gsd(upload['bounds'], width, height)
+    else:
+        # A shrunk image covers the same ground with fewer, larger pixels
+        gsd = 0.12 * upload['scale']
+    base_threshold = config.CONF_THRESHOLD if tiled else config.BASE_CONF_THRESHOLD
+    with metrics.timed(upload['timings'], 'postprocess'):
+        # The job's own numbers come from the kept predictions, so a re-score with the
+        # default parameters reproduces them exactly
+        predictions = compact_predictions(result, width, height, base_threshold, gsd, upload['filename'])
+        predictions['scale'] = upload['scale']
+        results, labels = analyze_predictions(predictions, config.CONF_THRESHOLD)
+    
+    with metrics.timed(upload['timings'], 'stream'):
+        totals = {}
+        append_rooftops(redis_conn, job_id, rooftop_records(results, upload['scale']), totals, config.RESULT_TTL,
+                        config.ROOFTOP_STREAM_MAXLEN, config.ROOFTOP_STREAM_CHUNK)
+    publish_stage(redis_conn, job_id, 'rendering', config.RESULT_TTL, totals=totals)
+    
+    return store_results(upload, job_id, results, labels, render, batch_id, predictions)
+
+
+def store_results(upload, job_id, results, labels, render='lazy', batch_id=None, predictions=None):
+    """
+    Write the job's artifacts to the artifact store and publish the result in Redis
+    """
+    original_image = upload['image']
+    timings = upload['timings']
+    store = get_store()
+    
+    # Every artifact is stored under the job's own prefix, so workers sharing
+    # a store never touch each other's files
+    artifacts = {
+        'report': artifact_key(job_id, 'rooftop_solar_potential_report.txt'),
+        'geometry': artifact_key(job_id, 'rooftops.geojson.gz'),
+    }
+    with metrics.timed(timings, 'report'):
+        store.put(artifacts['report'], format_report(results, upload['filename']).encode(), 'text/plain')
+    
+    # Rooftop outlines for clients that draw their own overlays, stored gzip-compressed
+    # exactly as they are served
+    with metrics.timed(timings, 'geometry'):
+        # Outlines are in the pixels of the image as uploaded, even if it was shrunk for decoding
+        height, width = (round(side * upload['scale']) for side in original_image.shape[:2])
+        collection = rooftops_geojson(labels, results, width, height, upload.get('bounds'))
+        store.put(artifacts['geometry'], encode_geojson(collection), 'application/geo+json')
+    
+    # Store the results with the job ID; rooftop positions are in uploaded pixels, 'scale'
+    # times those of the decoded image the labels and source artifacts are drawn on
+    response = {
+        'total_coverage_percentage': results['total_coverage_percentage'],
+        'total_energy_potential': results['total_energy_potential'],
+        'rooftops': scale_rooftops(results['rooftops'], upload['scale']),
+        'scale': upload['scale'],
+        'artifacts': artifacts,
+        'render': render,
+        'color_opacity': COLOR_OPACITY,
+        'conf_threshold': config.CONF_THRESHOLD,
+        'status': 'completed'
+    }
+    
+    with metrics.timed(timings, 'render'):
+        if render == 'eager':
+            artifacts['image'] = artifact_key(job_id, 'rooftop_detection_result.png')
+            store.put(artifacts['image'], encode_image(render_result(original_image, labels, results, COLOR_OPACITY)),
+                      'image/png')
+        elif render == 'lazy':
+            # Keep just enough to draw the image if a client ever asks for it
+            artifacts['labels'] = artifact_key(job_id, 'labels.png')
+            store.put(artifacts['labels'], cv2.imencode('.png', labels)[1].tobytes(), 'image/png')
+            header = read_image_header(upload['data'])
+            if upload['scale'] == 1 and header and header[0] in EXTENSIONS:
+                # The upload as received, no re-encode needed
+                artifacts['source'] = artifact_key(job_id, f"source{EXTENSIONS[header[0]]}")
+                store.put(artifacts['source'], upload['data'])
+            else:
+                artifacts['source'] = artifact_key(job_id, 'source.jpg')
+                store.put(artifacts['source'],
+                          cv2.imencode('.jpg', original_image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes(),
+                          'image/jpeg')
+    
+    print(f"Artifacts written for job: {job_id}")
+    
+    # Stages up to here; the Redis write itself is timed below and reported
+    # in the 'done' event and the metrics, since it cannot time its own payload
+    response['timings'] = dict(timings)
+    
+    # Store results in Redis (with TTL of 1 hour by default) and drop the upload
+    with metrics.timed(timings, 'redis_write'):
+        pipe = redis_conn.pipeline()
+        write_result(pipe, job_id, response, config.RESULT_TTL)
+        if predictions is not None:
+            pipe.setex(predictions_key(job_id), config.RESULT_TTL, json.dumps(predictions))
+        pipe.delete(upload['key'])
+        pipe.execute()
+    print(f"Results stored in Redis for job: {job_id}")
+    response['timings'] = dict(timings)
+    metrics.record_job(redis_conn, timings, rooftops=len(results['rooftops']), lane=upload.get('lane'))
+    
+    if batch_id:
+        record_child(redis_conn, batch_id, config.BATCH_TTL, results)
+    
+    finish_rooftops(redis_conn, job_id, {
+        'rooftops': len(results['rooftops']),
+        'area_m2': sum(rooftop['area_m2'] for rooftop in results['rooftops']),
+        'energy_potential_kwh_per_year': results['total_energy_potential'],
+    }, config.RESULT_TTL)
+    publish_stage(redis_conn, job_id, 'done', config.RESULT_TTL, result=response)
+    collect_garbage_periodically(redis_conn, store)
+        
+    return response
+
+
+def store_error(image_key, job_id, error, batch_id=None, timings=None, lane=None):
+    """
+    Publish a failed result in Redis and remove the uploaded image
+    """
+    import traceback
+    print(f"Error processing image: {str(error)}")
+    print(traceback.format_exc())
+    
+    error_response = {
+        'status': 'error',
+        'error': str(error)
+    }
+    pipe = redis_conn.pipeline()
+    write_result(pipe, job_id, error_response, config.RESULT_TTL)
+    pipe.delete(image_key)
+    pipe.execute()
+    metrics.record_job(redis_conn, timings or {}, failed=True, lane=lane)
+    
+    if batch_id:
+        record_child(redis_conn, batch_id, config.BATCH_TTL)
+    
+    finish_rooftops(redis_conn, job_id, {}, config.RESULT_TTL, status='error')
+    publish_stage(redis_conn, job_id, 'error', config.RESULT_TTL, error=str(error))
         
-        # Generate unique filenames for this job
-        result_image_path = f"results/{job_id}_rooftop_detection_result.png"
-        report_path = f"results/{job_id}_rooftop_solar_potential_report.txt"
+    return error_response
+
+
+def process_region(job_id, source_name, bounds, zoom=None):
+    """
+    Worker function that analyses every rooftop inside ``bounds`` (west, south, east,
+    north in degrees) of a configured imagery source.
+
+    The region is streamed through detection in windows (``config.REGION_WINDOW``
+    pixels, batched like tiles), each measured at its own ground resolution, and the
+    rooftops are written to a georeferenced GeoJSON file as they are found, so memory
+    does not grow with the size of the region.
+    """
+    timings = {}
+    geometry_key = artifact_key(job_id, 'rooftops.geojson.gz')
+    # Written locally as it grows, then handed to the artifact store in one piece
+    geometry_path = os.path.join(tempfile.gettempdir(), f"geopv_{job_id}_rooftops.geojson.gz")
+    writer = None
+    try:
+        print(f"Starting region analysis of {source_name} {bounds} for job: {job_id}")
+        spec = config.TILE_SOURCES.get(source_name)
+        if spec is None:
+            raise ValueError(f"Unknown tile source '{source_name}'")
         
-        # Check if result files were created
-        if not os.path.exists("rooftop_detection_result.png"):
-            raise FileNotFoundError("Result image was not generated")
-            
-        if not os.path.exists("rooftop_solar_potential_report.txt"):
-            raise FileNotFoundError("Report file was not generated")
+        with metrics.timed(timings, 'model_load'):
+            model = get_model(config.INFERENCE_MODEL_PATH, threads=config.ONNX_THREADS)
         
-        # Move the generated files to their job-specific paths
-        os.makedirs("results", exist_ok=True)
-        os.rename("rooftop_detection_result.png", result_image_path)
-        os.rename("rooftop_solar_potential_report.txt", report_path)
+        publish_stage(redis_conn, job_id, 'preprocessing', config.RESULT_TTL)
+        source = open_tile_source(spec, zoom)
+        window_count = count_windows(*source.region(bounds), config.REGION_WINDOW, config.REGION_MARGIN)
+        if window_count > config.REGION_MAX_WINDOWS:
+            raise ValueError(f"Region needs {window_count} detection windows, more than the "
+                             f"{config.REGION_MAX_WINDOWS} allowed; use a smaller area or zoom level")
+        input_size = preprocess_size(model, config.PREPROCESS_MODE)
         
-        print(f"Files moved to: {result_image_path} and {report_path}")
+        writer = GeoJsonWriter(geometry_path)
+        totals = {'windows': 0, 'rooftops': 0, 'area_m2': 0.0, 'energy': 0.0, 'ground_m2': 0.0}
+        stream_totals = {}
+        windows = source.windows(bounds, config.REGION_WINDOW, config.REGION_MARGIN)
+        while True:
+            with metrics.timed(timings, 'decode'):
+                batch = list(itertools.islice(windows, config.TILE_BATCH_SIZE))
+            if not batch:
+                break
+            with metrics.timed(timings, 'preprocess'):
+                images = [prepare_image(window.image, input_size) for window in batch]
+            with metrics.timed(timings, 'inference'):
+                results = run_inference(model, images, conf_threshold=config.BASE_CONF_THRESHOLD)
+            for window, result in zip(batch, results):
+                features = region_window_features(window, result, totals, writer.count, timings)
+                writer.write(features)
+                with metrics.timed(timings, 'stream'):
+                    append_rooftops(redis_conn, job_id, region_records(features), stream_totals, config.RESULT_TTL,
+                                    config.ROOFTOP_STREAM_MAXLEN, config.ROOFTOP_STREAM_CHUNK)
+            publish_stage(redis_conn, job_id, 'inference', config.RESULT_TTL,
+                          windows_done=totals['windows'], windows_total=window_count, totals=stream_totals)
         
-        # Store the results with the job ID
         response = {
-            'total_coverage_percentage': results['total_coverage_percentage'],
-            'total_energy_potential': results['total_energy_potential'],
-            'rooftops': results['rooftops'],
-            'image_path': result_image_path,
-            'report_path': report_path,
+            'source': source_name,
+            'bounds': list(bounds),
+            'zoom': zoom,
+            'windows': totals['windows'],
+            'rooftop_count': totals['rooftops'],
+            'region_area_m2': totals['ground_m2'],
+            'total_area_m2': totals['area_m2'],
+            'total_coverage_percentage': totals['area_m2'] / totals['ground_m2'] * 100 if totals['ground_m2'] else 0.0,
+            'total_energy_potential': totals['energy'],
+            'artifacts': {'geometry': geometry_key},
+            'render': 'none',
+            'conf_threshold': config.CONF_THRESHOLD,
             'status': 'completed'
         }
+        with metrics.timed(timings, 'geometry'):
+            writer.close(bbox=list(bounds), properties={
+                'coordinates': 'lonlat',
+                'rooftop_count': totals['rooftops'],
+                'total_area_m2': round(totals['area_m2'], 2),
+                'total_energy_potential': round(totals['energy'], 2),
+            })
+            writer = None
+            get_store().put_file(geometry_key, geometry_path, 'application/geo+json')
+        response['timings'] = dict(timings)
         
-        # Store results in Redis (with TTL of 1 hour)
-        redis_conn.setex(f"job_result:{job_id}", 3600, json.dumps(response))
-        print(f"Results stored in Redis for job: {job_id}")
-        
-        # Clean up the temporary image
-        if os.path.exists(image_path):
-            os.unlink(image_path)
-            print(f"Temporary image deleted: {image_path}")
-            
+        with metrics.timed(timings, 'redis_write'):
+            pipe = redis_conn.pipeline()
+            write_result(pipe, job_id, response, config.RESULT_TTL)
+            pipe.execute()
+        print(f"Region analysis finished for job: {job_id} ({totals['rooftops']} rooftops "
+              f"in {totals['windows']} windows)")
+        response['timings'] = dict(timings)
+        metrics.record_job(redis_conn, timings, rooftops=totals['rooftops'], lane=current_lane())
+        finish_rooftops(redis_conn, job_id, stream_totals, config.RESULT_TTL)
+        publish_stage(redis_conn, job_id, 'done', config.RESULT_TTL, result=response)
+        collect_garbage_periodically(redis_conn)
         return response
-        
+    
     except Exception as e:
-        import traceback
-        print(f"Error processing image: {str(e)}")
-        print(traceback.format_exc())
-        
-        error_response = {
-            'status': 'error',
-            'error': str(e)
-        }
-        redis_conn.setex(f"job_result:{job_id}", 3600, json.dumps(error_response))
-        
-        # Clean up on error
-        if os.path.exists(image_path):
-            os.unlink(image_path)
-            
-        return error_response
+        if writer is not None:
+            writer.file.close()
+        if os.path.exists(geometry_path):
+            os.remove(geometry_path)
+        return store_error(input_key(job_id), job_id, e, timings=timings, lane=current_lane())
+
+
+def region_window_features(window, result, totals, first_id, timings):
+    """
+    Measure one window of a region analysis and return its rooftops as georeferenced features.
+
+    A rooftop belongs to the window whose core holds its centroid, so rooftops seen
+    by two overlapping windows are counted once. ``totals`` is updated in place.
+    """
+    height, width = window.image.shape[:2]
+    with metrics.timed(timings, 'postprocess'):
+        predictions = compact_predictions(result, width, height, config.BASE_CONF_THRESHOLD, window.gsd)
+        analysis, labels = analyze_predictions(predictions, config.CONF_THRESHOLD)
+        x0, y0, x1, y1 = window.core
+        kept = {rooftop['id']: rooftop for rooftop in analysis['rooftops']
+                if x0 <= rooftop['centroid'][0] < x1 and y0 <= rooftop['centroid'][1] < y1}
+    
+    totals['windows'] += 1
+    totals['rooftops'] += len(kept)
+    totals['area_m2'] += sum(rooftop['area_m2'] for rooftop in kept.values())
+    totals['energy'] += sum(rooftop['energy_potential_kwh_per_year'] for rooftop in kept.values())
+    totals['ground_m2'] += (x1 - x0) * (y1 - y0) * window.gsd ** 2
+    if not kept:
+        return []
+    
+    with metrics.timed(timings, 'geometry'):
+        features = rooftop_features(labels, analysis, width, height, window.to_lonlat, ids=kept)
+        if not features:
+            return []
+        centroids = window.to_lonlat(np.array([kept[feature['id']]['centroid'] for feature in features]))
+        # Ids are unique over the whole region
+        for number, (feature, centroid) in enumerate(zip(features, centroids), first_id + 1):
+            feature['id'] = feature['properties']['id'] = number
+            feature['properties']['centroid'] = np.round(centroid, 7).tolist()
+            feature['properties']['gsd'] = round(window.gsd, 4)
+    return features
+
+
+def region_records(features):
+    """Stream records of a region's rooftop features: their properties plus a longitude/latitude bbox"""
+    for feature in features:
+        geometry = feature['geometry']
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        exterior = np.concatenate([np.asarray(polygon[0]) for polygon in polygons])
+        (west, south), (east, north) = exterior.min(axis=0), exterior.max(axis=0)
+        yield dict(feature['properties'], bbox=[float(west), float(south), float(east), float(north)])
@@ -0,0 +1,236 @@
+import os
+import math
+import types
+import functools
+import numpy as np
+import cv2
+
+EARTH_RADIUS = 6378137.0  # WGS84 semi-major axis, meters
+# Ground resolution of zoom level 0 at the equator for 256-pixel tiles, meters/pixel
+EQUATOR_RESOLUTION = 2 * math.pi * EARTH_RADIUS / 256
+
+
+def ground_resolution(lat, zoom, tile_size=256):
+    """Meters per pixel of Web Mercator imagery at ``zoom`` and latitude ``lat`` (degrees)"""
+    return EQUATOR_RESOLUTION * 256 / tile_size * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def lonlat_to_pixel(lon, lat, zoom, tile_size=256):
+    """Global pixel coordinates (x, y) of a point at ``zoom`` in the XYZ tiling scheme"""
+    world = tile_size * 2 ** zoom
+    x = (lon + 180) / 360 * world
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * world
+    return x, y
+
+
+def pixel_to_lonlat(x, y, zoom, tile_size=256):
+    """Inverse of :func:`lonlat_to_pixel`; works on scalars and numpy arrays"""
+    world = tile_size * 2 ** zoom
+    lon = np.asarray(x) / world * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y) / world))))
+    return lon, lat
+
+
+def ground_distance(lon0, lat0, lon1, lat1):
+    """Great-circle distance in meters (haversine)"""
+    lon0, lat0, lon1, lat1 = map(math.radians, (lon0, lat0, lon1, lat1))
+    a = math.sin((lat1 - lat0) / 2) ** 2 + math.cos(lat0) * math.cos(lat1) * math.sin((lon1 - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def bounds_gsd(bounds, width, height):
+    """Meters per pixel of a ``width`` x ``height`` image covering ``bounds`` (west, south, east, north)"""
+    west, south, east, north = bounds
+    lat = (south + north) / 2
+    gsd_x = ground_distance(west, lat, east, lat) / width
+    gsd_y = ground_distance(west, south, west, north) / height
+    return math.sqrt(gsd_x * gsd_y)
+
+
+def window_grid(x0, y0, x1, y1, window, margin):
+    """
+    Cover the pixel rectangle [x0, x1) x [y0, y1) with detection windows.
+
+    The rectangle is split into cores of ``window - 2 * margin`` pixels; each window
+    reads its core plus ``margin`` pixels of context on every side, so a rooftop cut
+    by one core edge is seen whole by the window whose core holds its centroid.
+
+    Yields:
+        tuple: ((wx0, wy0, wx1, wy1) window, (cx0, cy0, cx1, cy1) core), both in the
+            rectangle's pixel coordinates
+    """
+    core = max(1, window - 2 * margin)
+    for cy0 in range(y0, y1, core):
+        for cx0 in range(x0, x1, core):
+            cx1, cy1 = min(cx0 + core, x1), min(cy0 + core, y1)
+            yield (cx0 - margin, cy0 - margin, cx1 + margin, cy1 + margin), (cx0, cy0, cx1, cy1)
+
+
+def count_windows(x0, y0, x1, y1, window, margin):
+    core = max(1, window - 2 * margin)
+    return math.ceil((x1 - x0) / core) * math.ceil((y1 - y0) / core)
+
+
+class XyzTileSource:
+    """
+    A local directory of XYZ (slippy map) tiles at one zoom level.
+
+    ``pattern`` is a path with ``{z}``, ``{x}`` and ``{y}`` placeholders, e.g.
+    ``/data/tiles/{z}/{x}/{y}.png``. Missing tiles read as black; windows without
+    any tile on disk are skipped. Recently read tiles are kept in a small cache,
+    since neighbouring windows share their margins.
+    """
+
+    def __init__(self, pattern, zoom, tile_size=256, cache_tiles=64):
+        if zoom is None:
+            raise ValueError("XYZ tile sources need a zoom level")
+        if '{z}' not in pattern:
+            pattern = os.path.join(pattern, '{z}', '{x}', '{y}.png')
+        self.pattern = pattern
+        self.zoom = zoom
+        self.tile_size = tile_size
+        self._tile = functools.lru_cache(maxsize=cache_tiles)(self._load_tile)
+
+    def _load_tile(self, x, y):
+        path = self.pattern.format(z=self.zoom, x=x, y=y)
+        if not os.path.exists(path):
+            return None
+        tile = cv2.imread(path, cv2.IMREAD_COLOR)
+        if tile is not None and tile.shape[:2] != (self.tile_size, self.tile_size):
+            tile = cv2.resize(tile, (self.tile_size, self.tile_size), interpolation=cv2.INTER_AREA)
+        return tile
+
+    def region(self, bounds):
+        """Global pixel rectangle (x0, y0, x1, y1) covering ``bounds`` (west, south, east, north)"""
+        west, south, east, north = bounds
+        x0, y0 = lonlat_to_pixel(west, north, self.zoom, self.tile_size)
+        x1, y1 = lonlat_to_pixel(east, south, self.zoom, self.tile_size)
+        return math.floor(x0), math.floor(y0), math.ceil(x1), math.ceil(y1)
+
+    def read(self, x0, y0, x1, y1):
+        """BGR pixels of a global pixel rectangle, or None if no tile covering it exists"""
+        size = self.tile_size
+        world = size * 2 ** self.zoom
+        image = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        found = False
+        for ty in range(max(0, y0 // size), min(world, y1 - 1) // size + 1):
+            for tx in range(max(0, x0 // size), min(world, x1 - 1) // size + 1):
+                tile = self._tile(tx, ty)
+                if tile is None:
+                    continue
+                found = True
+                # Overlap of the tile and the rectangle, in global pixels
+                gx0, gy0 = max(x0, tx * size), max(y0, ty * size)
+                gx1, gy1 = min(x1, (tx + 1) * size), min(y1, (ty + 1) * size)
+                image[gy0 - y0:gy1 - y0, gx0 - x0:gx1 - x0] = \
+                    tile[gy0 - ty * size:gy1 - ty * size, gx0 - tx * size:gx1 - tx * size]
+        return image if found else None
+
+    def windows(self, bounds, window=1024, margin=128):
+        """
+        Detection windows over ``bounds``, read one at a time.
+
+        Yields:
+            SimpleNamespace: ``image`` (BGR), ``gsd`` (meters/pixel at the window's
+                latitude), ``core`` (x0, y0, x1, y1 in window pixels) and ``to_lonlat``
+                (maps an (N, 2) array of window pixels to (N, 2) longitude/latitude)
+        """
+        for (wx0, wy0, wx1, wy1), core in window_grid(*self.region(bounds), window, margin):
+            image = self.read(wx0, wy0, wx1, wy1)
+            if image is None:
+                continue
+            _, lat = pixel_to_lonlat((wx0 + wx1) / 2, (wy0 + wy1) / 2, self.zoom, self.tile_size)
+
+            def to_lonlat(points, wx0=wx0, wy0=wy0):
+                lon, lat = pixel_to_lonlat(points[:, 0] + wx0, points[:, 1] + wy0, self.zoom, self.tile_size)
+                return np.stack([lon, lat], axis=1)
+
+            yield types.SimpleNamespace(
+                image=image,
+                gsd=ground_resolution(float(lat), self.zoom, self.tile_size),
+                core=(core[0] - wx0, core[1] - wy0, core[2] - wx0, core[3] - wy0),
+                to_lonlat=to_lonlat,
+            )
+
+
+class GeoTiffSource:
+    """
+    An 8-bit RGB GeoTIFF in any projected or geographic CRS, read with rasterio.
+
+    Only the blocks under each window are read from disk, so memory stays bounded
+    by the window size however large the raster is. The zoom level is not used:
+    the raster is analysed at its native resolution.
+    """
+
+    def __init__(self, path):
+        import rasterio
+
+        self.dataset = rasterio.open(path)
+        if self.dataset.dtypes[0] != 'uint8':
+            raise ValueError(f"{path} is {self.dataset.dtypes[0]}; only 8-bit imagery is supported")
+        self.bands = [1, 2, 3] if self.dataset.count >= 3 else [1, 1, 1]
+
+    def region(self, bounds):
+        """Pixel rectangle (x0, y0, x1, y1) of the raster covering ``bounds`` (west, south, east, north)"""
+        from rasterio.warp import transform_bounds
+        from rasterio.windows import from_bounds
+
+        area = from_bounds(*transform_bounds('EPSG:4326', self.dataset.crs, *bounds, densify_pts=21),
+                           transform=self.dataset.transform)
+        x0, y0 = max(0, math.floor(area.col_off)), max(0, math.floor(area.row_off))
+        x1 = min(self.dataset.width, math.ceil(area.col_off + area.width))
+        y1 = min(self.dataset.height, math.ceil(area.row_off + area.height))
+        return x0, y0, x1, y1
+
+    def _lonlat(self, xs, ys):
+        from rasterio.warp import transform
+
+        xs, ys = self.dataset.transform * (np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+        lon, lat = transform(self.dataset.crs, 'EPSG:4326', np.atleast_1d(xs), np.atleast_1d(ys))
+        return np.asarray(lon), np.asarray(lat)
+
+    def windows(self, bounds, window=1024, margin=128):
+        """Detection windows over ``bounds``, as :meth:`XyzTileSource.windows`"""
+        from rasterio.windows import Window
+
+        width, height = self.dataset.width, self.dataset.height
+        for (wx0, wy0, wx1, wy1), core in window_grid(*self.region(bounds), window, margin):
+            wx0, wy0, wx1, wy1 = max(0, wx0), max(0, wy0), min(width, wx1), min(height, wy1)
+            rgb = self.dataset.read(self.bands, window=Window(wx0, wy0, wx1 - wx0, wy1 - wy0))
+            image = np.ascontiguousarray(rgb.transpose(1, 2, 0)[:, :, ::-1])
+
+            # Ground size of a pixel at the window centre, from the distances across it
+            cx, cy = (wx0 + wx1) / 2, (wy0 + wy1) / 2
+            lon, lat = self._lonlat([wx0, wx1, cx, cx], [cy, cy, wy0, wy1])
+            gsd_x = ground_distance(lon[0], lat[0], lon[1], lat[1]) / (wx1 - wx0)
+            gsd_y = ground_distance(lon[2], lat[2], lon[3], lat[3]) / (wy1 - wy0)
+
+            def to_lonlat(points, wx0=wx0, wy0=wy0):
+                lon, lat = self._lonlat(points[:, 0] + wx0, points[:, 1] + wy0)
+                return np.stack([lon, lat], axis=1)
+
+            yield types.SimpleNamespace(
+                image=image,
+                gsd=math.sqrt(gsd_x * gsd_y),
+                core=(core[0] - wx0, core[1] - wy0, core[2] - wx0, core[3] - wy0),
+                to_lonlat=to_lonlat,
+            )
+
+
+def open_tile_source(spec, zoom=None):
+    """
+    Open a configured imagery source.
+
+    Args:
+        spec (str): ``xyz:<tile path pattern>`` or ``geotiff:<file>``
+        zoom (int, optional): Zoom level, required for XYZ tiles
+
+    Raises:
+        ValueError: If the source kind is unknown
+    """
+    kind, _, path = spec.partition(':')
+    if kind == 'xyz':
+        return XyzTileSource(path, zoom)
+    if kind == 'geotiff':
+        return GeoTiffSource(path)
+    raise ValueError(f"Unknown tile source kind '{kind}' (expected 'xyz' or 'geotiff')")
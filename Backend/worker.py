@@ -1,20 +1,161 @@
 import os
-import redis
-from rq import Worker, Queue
+import time
+import argparse
+import multiprocessing
+from rq import Queue
+from utils import config
+from utils.redis_client import get_redis
+from utils.jobs import LANES
 
 # Configure Redis connection
-redis_conn = redis.Redis(host='localhost', port=6379, db=0)
+redis_conn = get_redis()
+
+# Define which queues this worker should process: every lane, drained by weight
+listen = list(LANES.values())
+
+# Thread-pool variables read by the numeric libraries when they initialise
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# A worker process that exits sooner than this after starting counts as a failed start;
+# the pool waits longer before each restart and stops after MAX_FAILED_STARTS in a row
+FAILED_START_SECONDS = 30
+MAX_FAILED_STARTS = 5
+MAX_RESTART_DELAY = 60
+
+
+def available_cores():
+    """CPU cores this process may run on (respects affinity masks and container cpusets)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def limit_threads(threads):
+    """
+    Cap intra-op parallelism so several worker processes don't oversubscribe the CPU.
+    Must run before torch is imported to take full effect.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+
+    import cv2
+    cv2.setNumThreads(threads)
+
+    # ONNX Runtime hosts may not have torch installed; its sessions get ONNX_THREADS instead
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def run_worker(batch=False, batch_size=None, batch_wait_ms=None, threads=None):
+    """Load the model and process jobs until stopped"""
+    if threads:
+        limit_threads(threads)
+
+    from utils.model_registry import get_model
+
+    # Load the model once so every job borrows the resident copy
+    get_model(config.INFERENCE_MODEL_PATH, warmup=config.MODEL_WARMUP, warmup_size=config.MODEL_WARMUP_SIZE,
+              threads=config.ONNX_THREADS)
+    print(f"Model loaded from {config.INFERENCE_MODEL_PATH} ({config.INFERENCE_BACKEND} backend)")
+
+    if batch:
+        from utils.batching import run_batching_worker
+        run_batching_worker(listen, redis_conn, batch_size=batch_size, max_wait_ms=batch_wait_ms)
+    else:
+        from utils.lanes import WeightedWorker
+        
+        # Start the worker. It runs jobs in this process instead of a forked
+        # child (SimpleWorker), so the model registry survives between jobs.
+        queues = [Queue(name, connection=redis_conn) for name in listen]
+        worker = WeightedWorker(queues, connection=redis_conn)
+        print(f"Worker started, listening to queues: {listen} (lane weights {config.LANE_WEIGHTS})")
+        worker.work()
+
+
+def run_pool(processes, threads, **worker_args):
+    """
+    Run ``processes`` independent workers with ``threads`` intra-op threads each,
+    restarting any that exit. Workers that die right after starting are restarted
+    with an increasing delay, and the pool gives up when one keeps failing.
+    """
+    # spawn gives each worker a fresh interpreter, so the thread limits apply before torch loads
+    context = multiprocessing.get_context('spawn')
+    worker_args['threads'] = threads
+
+    def start():
+        process = context.Process(target=run_worker, kwargs=worker_args, daemon=True)
+        process.start()
+        return process
+
+    print(f"Starting {processes} worker processes with {threads} threads each")
+    pool = [start() for _ in range(processes)]
+    started = [time.monotonic()] * processes
+    failed_starts = [0] * processes
+    restart_at = [None] * processes
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for index, process in enumerate(pool):
+                if process.is_alive():
+                    continue
+                if restart_at[index] is None:
+                    if now - started[index] < FAILED_START_SECONDS:
+                        failed_starts[index] += 1
+                    else:
+                        failed_starts[index] = 0
+                    if failed_starts[index] >= MAX_FAILED_STARTS:
+                        print(f"Worker process {process.pid} exited with code {process.exitcode} "
+                              f"{failed_starts[index]} times in a row right after starting, giving up")
+                        raise SystemExit(1)
+                    delay = min(MAX_RESTART_DELAY, 2 ** failed_starts[index]) if failed_starts[index] else 0
+                    print(f"Worker process {process.pid} exited with code {process.exitcode}, "
+                          f"restarting in {delay} s")
+                    restart_at[index] = now + delay
+                if now >= restart_at[index]:
+                    pool[index] = start()
+                    started[index] = now
+                    restart_at[index] = None
+    except KeyboardInterrupt:
+        print("Stopping worker processes")
+    finally:
+        for process in pool:
+            if process.is_alive():
+                process.terminate()
+        for process in pool:
+            process.join()
 
-# Define which queues this worker should process
-listen = ['rooftop_detection']
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GeoPV rooftop detection worker')
+    parser.add_argument('--batch', action='store_true',
+                        help='Group queued images into batched inference calls')
+    parser.add_argument('--batch-size', type=int, default=config.BATCH_SIZE,
+                        help='Maximum number of jobs per batch')
+    parser.add_argument('--batch-wait-ms', type=int, default=config.BATCH_MAX_WAIT_MS,
+                        help='Longest time to wait for a batch to fill while jobs keep arriving')
+    parser.add_argument('--processes', type=int, default=config.WORKER_PROCESSES,
+                        help='Worker processes to run; 0 sizes the pool to the available cores')
+    parser.add_argument('--threads', type=int, default=config.WORKER_THREADS,
+                        help='Intra-op threads per worker process; 0 splits the cores evenly')
+    args = parser.parse_args()
+
     # Create required directories
-    os.makedirs("temp", exist_ok=True)
     os.makedirs("results", exist_ok=True)
-    
-    # Start the worker
-    queues = [Queue(name, connection=redis_conn) for name in listen]
-    worker = Worker(queues, connection=redis_conn)
-    print(f"Worker started, listening to queues: {listen}")
-    worker.work()
\ No newline at end of file
+
+    worker_args = {'batch': args.batch, 'batch_size': args.batch_size, 'batch_wait_ms': args.batch_wait_ms}
+    cores = available_cores()
+    processes, threads = args.processes, args.threads
+    if processes == 0:
+        processes = max(1, cores // (threads or config.AUTO_THREADS_PER_WORKER))
+    if threads == 0:
+        threads = max(1, cores // processes)
+
+    if processes == 1 and not args.threads:
+        run_worker(**worker_args)
+    else:
+        run_pool(processes, threads, **worker_args)